@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from BlobCraft2x2 import DB
+from BlobCraft2x2.DB import read_crs_meta, read_crs_metas
+
+latency = 0.0
+
+def read_crs_meta_with_latency(path, **kwargs):
+    # a file open on network storage: wait before reading
+    time.sleep(latency)
+    return read_crs_meta(path, **kwargs)
+
+def make_files(directory, n_files, n_msgs):
+    # synthetic CRS binary files: a meta group with created/modified times and a msgs dataset
+    paths = []
+    start = 1720456938.0
+    for i in range(n_files):
+        path = os.path.join(directory, f"binary-0050014-2024_07_08_{i:06d}_CDT.h5")
+        with h5py.File(path, "w") as f:
+            meta = f.create_group("meta")
+            meta.attrs["created"] = start + i * 60
+            meta.attrs["modified"] = start + i * 60 + 59
+            f.create_dataset("msgs", data=np.zeros(n_msgs, dtype=np.uint8), chunks=True)
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading the meta data of CRS binary files with a growing number of processes")
+    parser.add_argument('--files', type=int, default=400, help="Number of synthetic files (default: 400)")
+    parser.add_argument('--msgs', type=int, default=100000, help="Messages per file (default: 100000)")
+    parser.add_argument('--jobs', type=str, default="1,2,4,8", help="Comma-separated process counts (default: 1,2,4,8)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Extra ms per file open, to mimic network storage (default: 0)")
+    args = parser.parse_args()
+
+    global latency
+    latency = args.latency / 1e3
+    if latency: DB.read_crs_meta = read_crs_meta_with_latency
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = make_files(tmpdir, args.files, args.msgs)
+        print(f"{args.files} files, {args.latency} ms extra latency per file")
+        reference, reference_time = None, None
+        for jobs in [int(jobs) for jobs in args.jobs.split(',')]:
+            start = time.perf_counter()
+            metas = read_crs_metas(paths, jobs=jobs)
+            elapsed = time.perf_counter() - start
+            if reference is None: reference, reference_time = metas, elapsed
+            print(f"jobs={jobs:<3} {elapsed:8.3f} s  ({elapsed / args.files * 1e3:.2f} ms per file, {reference_time / elapsed:.1f} x)  identical {metas == reference}")
+
+if __name__ == "__main__":
+    main()
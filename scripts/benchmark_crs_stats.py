@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import struct
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from BlobCraft2x2.DataManager import load_config
+from BlobCraft2x2.DB import scan_crs_msgs
+
+def make_file(path, n_msgs, max_words, seed=0):
+    # synthetic CRS binary file of pacman messages: mostly data messages of 1 to max_words words (data, trigger, sync or ping) and a few
+    # request/reply messages, stored like the DAQ does as a chunked variable-length uint8 dataset
+    rng = np.random.default_rng(seed)
+    msgs = np.empty(n_msgs, dtype=object)
+    msg_types = rng.choice([b'D', b'?', b'!'], size=n_msgs, p=[0.98, 0.01, 0.01])
+    for i in range(n_msgs):
+        n_words = rng.integers(1, max_words + 1)
+        header = struct.pack('<cIxH', msg_types[i], 1720456938 + i // 1000, n_words)
+        types = rng.choice([b'D', b'T', b'S', b'H'], size=n_words, p=[0.94, 0.02, 0.02, 0.02])
+        timestamps = rng.integers(0, 2**32, size=n_words)
+        words = b''.join(struct.pack('<cBxxIQ', t, 0, ts, 0) for t, ts in zip(types, timestamps))
+        msgs[i] = np.frombuffer(header + words, dtype=np.uint8)
+    with h5py.File(path, "w") as f:
+        f.create_dataset("msgs", data=msgs, dtype=h5py.vlen_dtype(np.dtype('u1')), chunks=(1024,))
+
+def reference_scan(path, msg_format):
+    # message by message with struct, to check the vectorized scan
+    msg_codes = {code.encode(): name for name, code in msg_format['msg_types'].items()}
+    word_codes = {code.encode(): name for name, code in msg_format['word_types'].items()}
+    stats = {f'n_{name}_msgs': 0 for name in msg_codes.values()}
+    stats.update({f'n_{name}_words': 0 for name in word_codes.values()})
+    times, timestamps = [], {name: [] for name in msg_format['timestamp_words']}
+    with h5py.File(path) as f:
+        for msg in f['msgs']:
+            msg = msg.tobytes()
+            msg_type, msg_time = struct.unpack_from('<cI', msg)
+            stats[f'n_{msg_codes[msg_type]}_msgs'] += 1
+            times.append(msg_time)
+            if msg_codes[msg_type] != 'data':
+                continue
+            for start in range(8, len(msg) - 15, 16):
+                word_type, timestamp = struct.unpack_from('<c3xI', msg, start)
+                stats[f'n_{word_codes[word_type]}_words'] += 1
+                if word_codes[word_type] in timestamps: timestamps[word_codes[word_type]].append(timestamp)
+    stats['msg_time_min'], stats['msg_time_max'] = min(times), max(times)
+    for name, values in timestamps.items():
+        stats[f'{name}_timestamp_min'], stats[f'{name}_timestamp_max'] = min(values, default=None), max(values, default=None)
+    return stats
+
+def raw_read(path, chunk_rows):
+    # reading msgs in the same chunks without looking at them: the speed the scan cannot beat
+    with h5py.File(path) as f:
+        msgs = f['msgs']
+        for i in range(0, len(msgs), chunk_rows):
+            msgs[i:i + chunk_rows]
+
+def timed(label, function, size):
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:8.3f} s  ({size / elapsed / 1e6:.1f} MB/s)")
+    return output
+
+# the repository's config, so the benchmark runs from any directory
+default_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "config", "CRS_parameters.yaml")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chunked scan of the CRS msgs dataset (message statistics of CRS_query --stats)")
+    parser.add_argument('--msgs', type=int, default=200000, help="Messages in the synthetic file (default: 200000)")
+    parser.add_argument('--max_words', type=int, default=20, help="Maximum words per message (default: 20)")
+    parser.add_argument('--config', type=str, default=default_config, help="CRS parameters with the msg_format (default: config/CRS_parameters.yaml of the repository)")
+    parser.add_argument('--chunk_rows', type=int, default=None, help="Messages read at a time (default: chunk_rows of the config)")
+    parser.add_argument('--reference', action='store_true', help="Also run the message by message reference scan and compare")
+    args = parser.parse_args()
+
+    msg_format = load_config(args.config)['msg_format']
+    chunk_rows = args.chunk_rows or msg_format['chunk_rows']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "binary-0050014-2024_07_08_000000_CDT.h5")
+        make_file(path, args.msgs, args.max_words)
+        size = os.path.getsize(path)
+        print(f"{args.msgs} messages, {size / 1e6:.1f} MB, {chunk_rows} messages per read")
+        timed("raw chunked read", lambda: raw_read(path, chunk_rows), size)
+        stats = timed("vectorized scan", lambda: scan_crs_msgs(path, msg_format, chunk_rows=chunk_rows), size)
+        if args.reference:
+            reference = timed("reference scan", lambda: reference_scan(path, msg_format), size)
+            print(f"identical {stats == reference}")
+        print(stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from influxdb.resultset import ResultSet
+
+from BlobCraft2x2.DataManager import DataManager, format_time, chicago_tz, parse_times, to_ns, epoch_to_ns
+from BlobCraft2x2.DB import influx_epoch_ns
+
+def make_result(points, series, seed=0, epoch=None):
+    # synthetic influx response: RFC3339 times with and without fractional seconds (or epoch integers), two float fields
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-07-08T11:42:18Z").value
+    per_series = points // series
+    raw = {"series": []}
+    for s in range(series):
+        times = start + np.sort(rng.integers(0, 86400 * 10**9, per_series)) // 1000 * 1000
+        times[::2] = times[::2] // 10**9 * 10**9
+        if epoch: stamps = (times // influx_epoch_ns[epoch]).tolist()
+        else: stamps = pd.DatetimeIndex(times).strftime("%Y-%m-%dT%H:%M:%S.%fZ").str.replace(".000000Z", "Z").tolist()
+        values = [[t, a, b] for t, a, b in zip(stamps, rng.random(per_series).tolist(), rng.random(per_series).tolist())]
+        raw["series"].append({"name": "benchmark", "tags": {"channel": str(s)}, "columns": ["time", "a", "b"], "values": values})
+    return ResultSet(raw)
+
+def legacy_format(result, variables):
+    # the per-row implementation DataManager.format replaced
+    formatted_data = []
+    for (measurement_name, tags_dict), data_points in result.items():
+        df = pd.DataFrame(data_points)
+        df["time"] = df["time"].apply(format_time)
+        df["time"] = pd.to_datetime(df["time"], utc=True)
+        df["time"] = df["time"].dt.tz_convert(chicago_tz)
+        for entry in df.to_dict("records"):
+            formatted_entry = {"time": entry["time"].isoformat(), **{var: entry[var] for var in variables}}
+            if tags_dict:
+                formatted_entry["tags"] = tags_dict
+            formatted_data.append(formatted_entry)
+    return formatted_data
+
+def timed(label, function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<12} {best:8.3f} s")
+    return output, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DataManager.format against the legacy per-row formatting")
+    parser.add_argument('--points', type=int, default=1000000, help="Total number of points (default: 1M)")
+    parser.add_argument('--series', type=int, default=1, help="Number of tag series the points are split over (default: 1)")
+    parser.add_argument('--epoch', type=str, default="ns", help="Epoch precision of the integer timestamps for the wire format comparison (default: ns)")
+    parser.add_argument('--repeat', type=int, default=1, help="Repetitions, the best time is reported (default: 1)")
+    args = parser.parse_args()
+
+    result = make_result(args.points, args.series)
+    print(f"Formatting {args.points} points in {args.series} series")
+    legacy, legacy_time = timed("legacy", lambda: legacy_format(result, ["a", "b"]), args.repeat)
+    vectorized, vectorized_time = timed("vectorized", lambda: DataManager(result).format(source="influx", variables=["a", "b"]), args.repeat)
+    print(f"speedup      {legacy_time / vectorized_time:8.1f} x")
+    print(f"identical    {legacy == vectorized}")
+
+    # RFC3339 strings vs epoch integers (InfluxDBManager.epoch) on the wire, the time column is where they differ
+    epoch_result = make_result(args.points, args.series, epoch=args.epoch)
+    print(f"\nTime column of {args.points} points, RFC3339 strings vs epoch='{args.epoch}' integers")
+    _, _, rfc3339_frame = DataManager(result).influx_frame()
+    _, _, epoch_frame = DataManager(epoch_result).influx_frame()
+    rfc3339_times, rfc3339_time = timed("rfc3339", lambda: to_ns(parse_times(rfc3339_frame["time"])), args.repeat)
+    epoch_times, epoch_time = timed("epoch", lambda: epoch_to_ns(epoch_frame["time"], args.epoch), args.repeat)
+    print(f"per point    {rfc3339_time / args.points * 1e9:8.1f} ns -> {epoch_time / args.points * 1e9:.1f} ns")
+    print(f"identical    {bool((rfc3339_times == epoch_times).all()) if args.epoch == 'ns' else 'n/a (truncated precision)'}")
+    epoch_formatted, epoch_format_time = timed("format", lambda: DataManager(epoch_result).format(source="influx", variables=["a", "b"], time_unit=args.epoch), args.repeat)
+    print(f"speedup      {legacy_time / epoch_format_time:8.1f} x over legacy")
+    if args.epoch == "ns": print(f"identical    {epoch_formatted == legacy}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from BlobCraft2x2.DB import SQLiteDBManager
+from BlobCraft2x2.Mx2.Mx2_query import get_runsubrun_rows, subrun_multiplier
+
+def make_db(filename, runs, subruns, extra_columns):
+    # synthetic DAQ database: one runsubrun row per subrun, indexed on runsubrun like the primary key of the real table
+    conn = sqlite3.connect(filename)
+    extra = [f"col{i}" for i in range(extra_columns)]
+    conn.execute(f"CREATE TABLE runsubrun (runsubrun INTEGER PRIMARY KEY, subrunstarttime INTEGER, subrunfinishtime INTEGER, logfilename TEXT, {', '.join(f'{col} REAL' for col in extra)})")
+    start = 1720456938
+    rows = []
+    for run in range(1, runs + 1):
+        for subrun in range(1, subruns + 1):
+            t = start + (run * subruns + subrun) * 60
+            rows.append((run * subrun_multiplier + subrun, t, t + 59, f"/data/mx2_{run}_{subrun}_Controller0Log.txt", *[float(i) for i in range(extra_columns)]))
+    conn.executemany(f"INSERT INTO runsubrun VALUES ({', '.join(['?'] * (4 + extra_columns))})", rows)
+    conn.commit()
+    conn.close()
+
+def legacy_fetch(filename, run):
+    # the per-subrun queries of the old Mx2_blob_maker, with the non-sargable runsubrun/10000 condition
+    sqlite = SQLiteDBManager(filename, run=run)
+    subruns = sqlite.get_subruns(table='runsubrun', start='subrunstarttime', end='subrunfinishtime', subrun='runsubrun', condition='runsubrun/10000')
+    rows = {}
+    for subrun in subruns:
+        columns = [c.lower() for c in sqlite.get_column_names('runsubrun')]
+        data = sqlite.query_data(table_name='runsubrun', columns=columns, conditions=[f'runsubrun/10000={run}', f'runsubrun%10000={subrun}'])
+        if data: rows[subrun] = dict(zip(columns, data[0]))
+    sqlite.close_connection()
+    return rows
+
+def range_fetch(filename, runs):
+    sqlite = SQLiteDBManager(filename, run=runs[0])
+    columns = [c.lower() for c in sqlite.get_column_names('runsubrun')]
+    rows = get_runsubrun_rows(sqlite, runs, columns)
+    for run in runs:
+        sqlite.run = run
+        subruns = sqlite.get_subruns(table='runsubrun', start='subrunstarttime', end='subrunfinishtime', subrun='runsubrun', condition='runsubrun', run_multiplier=subrun_multiplier)
+        rows[run] = {subrun: rows[run][subrun] for subrun in subruns if subrun in rows[run]}
+    sqlite.close_connection()
+    return rows
+
+def timed(label, function, n_runs):
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.3f} s  ({elapsed / n_runs * 1e3:.1f} ms per run)")
+    return output, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Mx2 runsubrun queries: per-subrun runsubrun/10000 filters vs one range query")
+    parser.add_argument('--runs', type=int, default=2000, help="Runs in the synthetic database (default: 2000)")
+    parser.add_argument('--subruns', type=int, default=50, help="Subruns per run (default: 50)")
+    parser.add_argument('--columns', type=int, default=40, help="Extra columns per row (default: 40)")
+    parser.add_argument('--query_runs', type=int, default=10, help="Number of runs fetched (default: 10)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "daq.db")
+        make_db(filename, args.runs, args.subruns, args.columns)
+        print(f"runsubrun table: {args.runs * args.subruns} rows, {os.path.getsize(filename) / 1e6:.1f} MB")
+
+        runs = list(range(args.runs // 2, args.runs // 2 + args.query_runs))
+        legacy, legacy_time = timed("legacy (per subrun)", lambda: {run: legacy_fetch(filename, run) for run in runs}, len(runs))
+        single, single_time = timed("range (per run)", lambda: {run: range_fetch(filename, [run])[run] for run in runs}, len(runs))
+        batch, batch_time = timed("range (all runs at once)", lambda: range_fetch(filename, runs), len(runs))
+        print(f"speedup      {legacy_time / single_time:8.1f} x per run, {legacy_time / batch_time:.1f} x all runs")
+        print(f"identical    {legacy == single == batch}")
+
+if __name__ == "__main__":
+    main()
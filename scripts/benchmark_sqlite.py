@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from BlobCraft2x2.DB import SQLiteDBManager
+from BlobCraft2x2.DataManager import dump
+
+def make_summary(rows, run=50014, extra_key=False):
+    # synthetic runsdb summary: one row per subrun with a nested dict like the SC/beam summaries
+    start = 1720456938
+    data = {}
+    for subrun in range(rows):
+        data[subrun] = {"run": run, "start_time_unix": start + 60 * subrun, "end_time_unix": start + 60 * subrun + 59,
+                        "filename": f"file_{subrun}.h5", "events": subrun * 7, "rate_hz": subrun * 0.5,
+                        "beam_summary": {"Total_POT": 1e13 * subrun, "Start": 0.0, "End": 0.0}}
+        if extra_key and subrun % 2: data[subrun]["new_key"] = subrun
+    return data
+
+def legacy_insert(filename, table_name, data, global_run):
+    # the per-row INSERT of the old SQLiteDBManager.insert_data, one connection and commit per table
+    sqlite_manager = SQLiteDBManager(filename, run=-100)
+    sqlite_manager.create_table(table_name, sqlite_manager.extract_schema(data))
+    for subrun, details in data.items():
+        flat_details = {"run": details["run"], "subrun": subrun, "global_run": global_run}
+        for key, value in details.items():
+            if isinstance(value, dict):
+                for subkey, subvalue in value.items():
+                    flat_details[f"{key}_{subkey}"] = subvalue
+            else:
+                flat_details[key] = value
+        columns = ", ".join(flat_details.keys())
+        placeholders = ", ".join(["?"] * len(flat_details))
+        sqlite_manager.cursor.execute(f"INSERT OR REPLACE INTO {table_name} ({columns}) VALUES ({placeholders})", list(flat_details.values()))
+    sqlite_manager.conn.commit()
+    sqlite_manager.close_connection()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bulk runsdb SQLite writer against per-row inserts")
+    parser.add_argument('--rows', type=int, default=100000, help="Subrun rows per table (default: 100k)")
+    parser.add_argument('--tables', type=int, default=5, help="Number of tables in the output file (default: 5)")
+    args = parser.parse_args()
+
+    # the rows as dump() passes them to the writer, built outside the timed sections
+    data = {f"table_{i}": {k: {"global_run": 50014, **v} for k, v in make_summary(args.rows).items()} for i in range(args.tables)}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy_file, bulk_file = os.path.join(tmpdir, "legacy.db"), os.path.join(tmpdir, "bulk")
+
+        start = time.perf_counter()
+        for table_name, table in data.items():
+            legacy_insert(legacy_file, table_name, table, global_run=50014)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with SQLiteDBManager(f"{bulk_file}.db", run=-100) as writer:
+            for table_name, table in data.items():
+                writer.dump_data(table, table_name, global_run=50014)
+        bulk_time = time.perf_counter() - start
+
+        rows = args.rows * args.tables
+        print(f"legacy       {legacy_time:8.3f} s  {rows / legacy_time:10.0f} rows/s")
+        print(f"bulk         {bulk_time:8.3f} s  {rows / bulk_time:10.0f} rows/s")
+        print(f"speedup      {legacy_time / bulk_time:8.1f} x")
+
+        # later rows with a key the table does not have yet widen it instead of failing
+        with SQLiteDBManager(f"{bulk_file}.db", run=-100) as writer:
+            dump(make_summary(10, run=50015, extra_key=True), bulk_file, format='sqlite', tablename="table_0", global_run=50015, writer=writer)
+        conn = sqlite3.connect(f"{bulk_file}.db")
+        print(f"widened      {conn.execute('SELECT count(new_key), count(*) FROM table_0').fetchone()} (new_key, rows)")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from BlobCraft2x2.DataManager import dump
+
+# documents dump(format='json') has to write exactly like json.dump, nested lists included
+documents = {
+    "records": [{"time": "2024-07-08T11:40:00-05:00", "a": 1.5, "b": None}, {"time": "2024-07-08T11:41:00-05:00", "a": 2, "b": "x"}],
+    "nested lists in a dict": {"a": [[1, 2], [3, 4]], "b": {"c": [[], [[5]]]}, "d": []},
+    "list of lists": [[1, 2], [3]],
+    "list of records with list values": [{"time": "2024-07-08T11:40:00-05:00", "values": [[1, 2], [3]], "tags": {"host": "h1"}}],
+    "ucondb-like": {"subrun_1": {"LAr_level_mm": [{"time": "2024-07-08T11:40:00-05:00", "magnitude": 1.0}], "empty": []}},
+}
+
+def written(data, indent):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "out")
+        dump(data, filename, format='json', indent=indent)
+        with open(f"{filename}.json") as f:
+            return f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the streamed json dump is identical to json.dump")
+    parser.parse_args()
+
+    failed = []
+    for name, data in documents.items():
+        for indent in (4, None):
+            expected = json.dumps(data, indent=indent, separators=None if indent is not None else (",", ":"))
+            identical = written(data, indent) == expected
+            print(f"{name:<35} indent={indent!s:<5} identical {identical}")
+            if not identical: failed.append((name, indent))
+
+    # a streamed dump: the batches of an iterator are appended to one array
+    batches = iter([documents["records"][:1], documents["records"][1:]])
+    identical = written(batches, 4) == json.dumps(documents["records"], indent=4)
+    print(f"{'streamed batches':<35} indent=4     identical {identical}")
+    if not identical: failed.append(("streamed batches", 4))
+
+    if failed:
+        sys.exit(f"Different from json.dump: {failed}")
+
+if __name__ == "__main__":
+    main()
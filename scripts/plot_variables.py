@@ -1,12 +1,14 @@
 import sys
 import json
+import gzip
 import matplotlib.pyplot as plt
 from datetime import datetime
 import pandas as pd
 import os
+from BlobCraft2x2.DataManager import read_hdf5, hdf5_measurements
 
 def read_json_file(filename):
-    with open(filename, 'r') as file:
+    with (gzip.open(filename, 'rt') if filename.endswith('.gz') else open(filename, 'r')) as file:
         data = json.load(file)
     return data
 
@@ -106,7 +108,16 @@ def plot_data(df, variables, tag_columns, json_filename):
             plt.savefig(f"Plots/{base_filename}_subplot_{fig_index + 1}.png")
             #plt.show()
 
-def main(json_filename):
+def main(json_filename, start=None, end=None):
+    if json_filename.endswith('.h5'): #only the rows between start and end are read from the file
+        for measurement in hdf5_measurements(json_filename):
+            df = read_hdf5(json_filename, measurement, start=start, end=end)
+            df['time'] = df['time'].dt.tz_localize(None)
+            tag_columns = [col for col in df.columns if col.startswith('tags.')]
+            variables = [col for col in df.columns if col != 'time' and col not in tag_columns and pd.api.types.is_numeric_dtype(df[col])]
+            plot_data(df, variables, tag_columns, f"{measurement.replace('/', '_')}_{start}_{end}") #same <name>_<start>_<end> pattern as the json file names
+        return
+
     data = read_json_file(json_filename)
     df = create_dataframe(data)
     tag_columns = [col for col in df.columns if col.startswith('tags.')]
@@ -116,4 +127,6 @@ def main(json_filename):
 
 if __name__ == "__main__":
     json_filename = sys.argv[1]
-    main(json_filename)
+    start = sys.argv[2] if len(sys.argv) > 2 else None #optional time slice for .h5 files
+    end = sys.argv[3] if len(sys.argv) > 3 else None
+    main(json_filename, start, end)
@@ -14,7 +14,10 @@ setup(
             'CRS_query = BlobCraft2x2.CRS.CRS_query:main',
             'LRS_query = BlobCraft2x2.LRS.LRS_query:main',
             'Mx2_query = BlobCraft2x2.Mx2.Mx2_query:main',
-            'Beam_query = BlobCraft2x2.Beam.beam_query:main'
+            'Beam_query = BlobCraft2x2.Beam.beam_query:main',
+            'Run_catalog = BlobCraft2x2.Catalog.run_catalog:main',
+            'Runsdb_build = BlobCraft2x2.Runsdb.runsdb_build:main',
+            'Runsdb_batch = BlobCraft2x2.Runsdb.runsdb_build:batch_main'
         ],
     },
 
@@ -28,5 +31,8 @@ setup(
         'python-dateutil',
         'h5py'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     python_requires='>=3.9',
 )
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import threading
+import numpy as np
 import pandas as pd
 from ..DataManager import load_config, dump
 from ..DB import IFBeamManager
 from ..DataManager import parse_datetime
 
-config = load_config('config/IFbeam_parameters.yaml')
+config = None #config/IFbeam_parameters.yaml, read by the first request so importing the blob makers does not need the file
 manager = IFBeamManager(config)
+manager_lock = threading.Lock() #the manager holds the time range of the request, one request at a time
+pot_cache = {} #(start, end): POT series fetched by cache_POT_series, reused for every span inside it
 
 def calculate_total_pot(df_pot):
     if df_pot.empty:
@@ -19,10 +23,46 @@ def calculate_total_pot(df_pot):
 
     return value, first_time, last_time
 
+def get_config():
+    global config
+    if config is None:
+        config = load_config('config/IFbeam_parameters.yaml')
+        manager.config = config
+    return config
+
+def fetch_POT_series(start, end):
+    with manager_lock:
+        beam_config = get_config()
+        manager.set_time_range(start=start, end=end)
+        df_pot = manager.get_data(beam_config['pot_device_name'], combine_unit=True)
+    if not df_pot.empty: df_pot = df_pot[df_pot['value'] > float(beam_config['pot_threshold'])].reset_index(drop=True)
+    return df_pot
+
+def cache_POT_series(start, end):
+    # fetch the POT series of [start, end] once, e.g. a whole run or consecutive runs of a batch, so the beam summaries of every system's
+    # subruns inside it are not fetched again. Nothing is fetched if a cached series already covers it
+    start_dt, end_dt = parse_datetime(start, is_start=True), parse_datetime(end, is_start=False)
+    if any(cache_start <= start_dt and end_dt <= cache_end for cache_start, cache_end in list(pot_cache)):
+        return get_POT_series(start, end)
+    df_pot = fetch_POT_series(start, end)
+    pot_cache[(start_dt, end_dt)] = df_pot
+    return df_pot
+
+def clear_POT_cache():
+    pot_cache.clear()
+
+def get_POT_series(start, end):
+    start_dt, end_dt = parse_datetime(start, is_start=True), parse_datetime(end, is_start=False)
+    for (cache_start, cache_end), df_pot in list(pot_cache.items()):
+        if cache_start <= start_dt and end_dt <= cache_end:
+            if df_pot.empty:
+                return df_pot
+            times = df_pot['time'].to_numpy(dtype=np.float64) # IFBeam times are unix ms
+            return df_pot[(times >= start_dt.timestamp() * 1e3) & (times <= end_dt.timestamp() * 1e3)].reset_index(drop=True)
+    return fetch_POT_series(start, end)
+
 def get_POT(start, end, total=False):
-    manager.set_time_range(start=start, end=end)
-    df_pot = manager.get_data(config['pot_device_name'], combine_unit=True)
-    if not df_pot.empty: df_pot = df_pot[df_pot['value'] > float(config['pot_threshold'])].reset_index(drop=True)
+    df_pot = get_POT_series(start, end)
     if total:
         return calculate_total_pot(df_pot)
     else:
@@ -41,6 +81,38 @@ def get_beam_summary(start, end, dump_data=False):
     if dump_data: dump(beam_data, f"BeamTotalPOT_{start}_{end}")
     return beam_data
 
+def get_beam_summaries(intervals):
+    # intervals: list of (start, end) times, e.g. all the subruns of a run. The POT timeseries is fetched once for the whole span and summed per interval
+    if not intervals:
+        return []
+
+    bounds = [(parse_datetime(start, is_start=True), parse_datetime(end, is_start=False)) for start, end in intervals]
+    first = min(range(len(bounds)), key=lambda i: bounds[i][0])
+    last = max(range(len(bounds)), key=lambda i: bounds[i][1])
+    print(f'Getting beam summaries for {len(intervals)} intervals: {intervals[first][0]} to {intervals[last][1]}')
+    df_pot = get_POT_series(intervals[first][0], intervals[last][1])
+
+    if df_pot.empty:
+        return [{"Total_POT": 0.0, "Start": 0.0, "End": 0.0} for _ in intervals]
+
+    df_pot = df_pot.sort_values('time', kind='stable').reset_index(drop=True)
+    times = df_pot['time'].to_numpy(dtype=np.float64) # IFBeam times are unix ms
+    pot_cumsum = np.concatenate([[0.], np.cumsum(df_pot['value'].to_numpy(dtype=np.float64))])
+
+    starts_ms = np.array([start.timestamp() * 1e3 for start, _ in bounds])
+    ends_ms = np.array([end.timestamp() * 1e3 for _, end in bounds])
+    lo = np.searchsorted(times, starts_ms, side='left')
+    hi = np.searchsorted(times, ends_ms, side='right')
+    totals = pot_cumsum[hi] - pot_cumsum[lo]
+
+    beam_data = []
+    for i in range(len(intervals)):
+        if hi[i] > lo[i]:
+            beam_data.append({"Total_POT": totals[i], "Start": df_pot['time'].iloc[lo[i]], "End": df_pot['time'].iloc[hi[i] - 1]})
+        else:
+            beam_data.append({"Total_POT": 0.0, "Start": 0.0, "End": 0.0})
+    return beam_data
+
 
 def main():
     parser = argparse.ArgumentParser(description="Query IFBeam database and dump data to JSON file.")
@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
-import io
+import os
 from pathlib import Path
 import tarfile
 
 import h5py
-import numpy as np
 
-from ..Beam.beam_query import get_beam_summary
+from ..Beam.beam_query import get_beam_summaries
 from ..DataManager import dump, load_config, unix_to_iso
+from ..DB import hash_daq_configs, read_crs_metas, read_crs_msg_stats, store_daq_configs
+from ..Catalog.run_catalog import get_run_catalog
+
+config_tars = {} #opened daq_configs tarballs by hash, a config shared by many files is only opened once
+
+
+def get_config_data(h5path=None, config_hash=None, config_store=None):
+    # the daq_configs tarball of a CRS binary file (or of a config hash from the CRS output), read from the content-addressed config_store
+    # (config/CRS_parameters.yaml). The file's config is hashed and stored first if it is not there yet
+    if config_store is None:
+        config_store = load_config("config/CRS_parameters.yaml")['config_store']
+    if config_hash is None:
+        with h5py.File(h5path) as h5f:
+            config_hash = hash_daq_configs(h5f)
+            if config_hash is None:
+                raise KeyError(f"No daq_configs in {h5path}")
+            stored = store_daq_configs(h5f, config_hash, config_store)
+    else:
+        stored = os.path.join(config_store, f"{config_hash}.tar")
+    if config_hash not in config_tars:
+        config_tars[config_hash] = tarfile.open(stored)
+    return config_tars[config_hash]
 
 
-def get_config_data(h5path):
-    with h5py.File(h5path) as h5f:
-        tar_bytes = np.array(h5f['daq_configs']).data
-        fileobj = io.BytesIO(tar_bytes)
-    return tarfile.open(fileobj=fileobj)
-
-
-def CRS_blob_maker(run, sql_format=False):
+def CRS_blob_maker(run, sql_format=False, jobs=1, stats=False):
     print(f"\n----------------------------------------Fetching CRS data for the run {run}----------------------------------------")
 
     config = load_config("config/CRS_parameters.yaml")
@@ -30,36 +44,50 @@ def CRS_blob_maker(run, sql_format=False):
     else:
         output = {}
 
-    files = Path(data_dir).rglob(f'binary-{run:07d}-*.h5')
+    # (path, created, modified, msg count, config hash) of every file of the run, from the run catalog if it is built (no walk over data_dir,
+    # no file opened). Otherwise the files are read by jobs processes, in subrun order, and their new configs are stored
+    catalog = get_run_catalog(jobs=jobs)
+    files = catalog.get_crs_files(run) if catalog is not None else None
+    if files is None:
+        files = read_crs_metas(sorted(Path(data_dir).rglob(f'binary-{run:07d}-*.h5')), jobs=jobs, config_store=config.get('config_store'))
+
+    files = sorted(files, key=lambda file: Path(file[0]))
+    # message type counts and timestamp ranges of every file, from a chunked scan of its msgs dataset
+    msg_stats = read_crs_msg_stats([file[0] for file in files], config['msg_format'], jobs=jobs) if stats else [None] * len(files)
 
-    for i, path in enumerate(sorted(files)):
+    for i, ((path, start_time, end_time, msg_count, config_hash), file_stats) in enumerate(zip(files, msg_stats)):
+        path = Path(path)
         print(path)
         subrun = i + 1
         info = {}
 
-        with h5py.File(path) as f:
-            start_time = f['meta'].attrs['created']
-            end_time = f['meta'].attrs['modified']
-            msg_rate = len(f['msgs']) / (end_time - start_time)
+        msg_rate = msg_count / (end_time - start_time)
 
-            if sql_format:
-                info['subrun'] = subrun
-
-            info['run'] = run
-            info['start_time_unix'] = start_time
-            info['end_time_unix'] = end_time
-            info['start_time'] = unix_to_iso(start_time);
-            info['end_time'] = unix_to_iso(end_time);
-            info['filename'] = path.name
-            info['msg_rate'] = msg_rate
+        if sql_format:
+            info['subrun'] = subrun
+
+        info['run'] = run
+        info['start_time_unix'] = start_time
+        info['end_time_unix'] = end_time
+        info['start_time'] = unix_to_iso(start_time);
+        info['end_time'] = unix_to_iso(end_time);
+        info['filename'] = path.name
+        info['msg_rate'] = msg_rate
+        info['config_hash'] = config_hash
+        if file_stats is not None:
+            info.update(file_stats)
 
         if sql_format:
             output.append(info)
         else:
-            info['beam_summary'] = get_beam_summary(info['start_time'],
-                                                    info['end_time'])
             output[subrun] = info
 
+    if not sql_format:
+        beam_summaries = get_beam_summaries([(info['start_time'], info['end_time'])
+                                             for info in output.values()])
+        for info, beam_summary in zip(output.values(), beam_summaries):
+            info['beam_summary'] = beam_summary
+
     start_subrun, end_subrun = 1, len(output)
     start_str = output[0]['start_time'] if sql_format else output[start_subrun]['start_time']
     end_str = output[-1]['end_time'] if sql_format else output[end_subrun]['end_time']
@@ -76,9 +104,11 @@ def main():
     parser = argparse.ArgumentParser(description="Query SQLite database and dump data to JSON file.")
     parser.add_argument("--run", type=int, required=True, help="Run number")
     parser.add_argument('--sql-format', action='store_true')
+    parser.add_argument('--jobs', type=int, default=1, help="Number of processes reading the HDF5 files (default: 1)")
+    parser.add_argument('--stats', action='store_true', help="Add message type counts and timestamp ranges from a scan of every file's msgs")
     args = parser.parse_args()
 
-    CRS_blob_maker(args.run, sql_format=args.sql_format)
+    CRS_blob_maker(args.run, sql_format=args.sql_format, jobs=args.jobs, stats=args.stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import threading
+from ..DB import RunCatalog
+from ..DataManager import load_config, parse_datetime, unix_to_iso
+
+catalog_config_file = "config/catalog_parameters.yaml"
+run_catalog = None #one catalog per process, refreshed when it is first used
+run_catalog_lock = threading.Lock() #blob makers running in parallel threads (runsdb_build) open and refresh it once
+
+def open_run_catalog(config_file=catalog_config_file):
+    config = load_config(config_file)
+    sources = {}
+    for system, source in config["sources"].items():
+        sources[system] = {**source, "filename": load_config(source["config"]).get("filename")}
+    return RunCatalog(config["filename"], sources), config
+
+def refresh_run_catalog(catalog, config, rebuild=False, jobs=1):
+    catalog.refresh(rebuild=rebuild, tail_rows=config.get("refresh_tail_rows", 1000))
+    crs_files = config.get("crs_files")
+    if crs_files:
+        crs_config = load_config(crs_files["config"])
+        catalog.refresh_crs_files(crs_config.get("data_dir"), pattern=crs_files.get("pattern", "binary-*.h5"), recheck_recent=crs_files.get("recheck_recent", 86400),
+                                  rebuild=rebuild, jobs=jobs, config_store=crs_config.get("config_store"))
+
+def get_run_catalog(jobs=1):
+    # the run catalog for the blob makers, None if it has not been built (they query the source databases directly then).
+    # jobs: processes reading new CRS files when it is refreshed
+    global run_catalog
+    with run_catalog_lock:
+        if run_catalog is None:
+            if not os.path.exists(catalog_config_file) or not os.path.exists(load_config(catalog_config_file)["filename"]):
+                return None
+            catalog, config = open_run_catalog()
+            refresh_run_catalog(catalog, config, jobs=jobs)
+            run_catalog = catalog
+    return run_catalog
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the run catalog, an indexed list of the CRS, LRS and Mx2 subruns (config/catalog_parameters.yaml)")
+    parser.add_argument('--refresh', action='store_true', help="Index new and changed rows of the source databases (builds the catalog if it does not exist)")
+    parser.add_argument('--rebuild', action='store_true', help="Index all the source databases again from scratch")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of processes reading new CRS files (default: 1)")
+    parser.add_argument('--run', type=int, default=None, help="Print the subruns of this run")
+    parser.add_argument('--system', type=str, default=None, help="Only this system (crs, lrs, mx2 or crs_files for the CRS binary files)")
+    parser.add_argument('--time', type=str, default=None, help="Print the subruns of every system overlapping this time (various formats like 'YYYY-MM-DD HH:MM:SS')")
+    args = parser.parse_args()
+
+    catalog, config = open_run_catalog()
+    if args.refresh or args.rebuild:
+        refresh_run_catalog(catalog, config, rebuild=args.rebuild, jobs=args.jobs)
+
+    systems = [args.system] if args.system else list(catalog.sources) + ["crs_files"]
+    if args.run is not None:
+        for system in systems:
+            for subrun, start, end in catalog.get_subrun_rows(system, args.run) or []:
+                print(f"{system} run {args.run} subrun {subrun}: {unix_to_iso(start)} to {unix_to_iso(end)}")
+        if "crs_files" in systems:
+            for path, created, modified, msg_count, config_hash in catalog.get_crs_files(args.run) or []:
+                print(f"crs file {path}: {unix_to_iso(created)} to {unix_to_iso(modified)}, {msg_count} msgs, config {config_hash}")
+    if args.time is not None:
+        t = parse_datetime(args.time, is_start=True).timestamp()
+        for subrun in catalog.find_subruns(t, systems=systems):
+            print(f"{subrun['system']} run {subrun['run']} subrun {subrun['subrun']}: {unix_to_iso(subrun['start_unix'])} to {unix_to_iso(subrun['end_unix'])}")
+        if "crs_files" in systems:
+            for path, run, created, modified, msg_count in catalog.find_crs_files(t):
+                print(f"crs file {path} (run {run}): {unix_to_iso(created)} to {unix_to_iso(modified)}, {msg_count} msgs")
+
+    catalog.close_connection()
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,294 @@
 #!/usr/bin/env python3
 
+import os
+import json
+import time
+import atexit
+import urllib.parse
+import fnmatch
+import hashlib
+import tempfile
+import threading
+from functools import partial
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import sqlalchemy as alc
 import sqlite3
+import h5py
 from influxdb import InfluxDBClient
+from influxdb.resultset import ResultSet
 import numpy as np
 import requests
 import pandas as pd
 
 chicago_tz =  ZoneInfo("America/Chicago")
 
+#aggregates that can be computed per subsample bucket: name: (InfluxQL function, SQL function)
+subsample_aggregates = {
+    "mean": ("mean", alc.func.avg),
+    "min": ("min", alc.func.min),
+    "max": ("max", alc.func.max),
+    "count": ("count", alc.func.count),
+}
+
+# ns per unit of the epoch precisions influx can return timestamps in
+influx_epoch_ns = {"ns": 1, "u": 10**3, "ms": 10**6, "s": 10**9, "m": 60 * 10**9, "h": 3600 * 10**9}
+
+def get_subsample_ms(subsample):
+    # width of a subsample (or stream window) interval in ms, None if the interval has no fixed width (e.g. months)
+    if not subsample:
+        return None
+    try:
+        bucket_ms = int(pd.Timedelta(subsample).total_seconds() * 1e3)
+    except ValueError:
+        return None
+    return bucket_ms if bucket_ms > 0 else None
+
+def get_bucket_ms(subsample):
+    # bucket size in ms when the database can do the subsampling, None if it has to be resampled in pandas. The pandas resample starts its
+    # buckets at America/Chicago midnight, which is a whole number of hours from the UTC midnight the database buckets start at (GROUP BY time
+    # and floor(t / bucket) are aligned to the unix epoch). So only intervals dividing one hour give the same buckets, DST changes included
+    bucket_ms = get_subsample_ms(subsample)
+    return bucket_ms if bucket_ms is not None and 3600000 % bucket_ms == 0 else None
+
+def get_subsample_columns(variables, aggregates=None):
+    if not aggregates or list(aggregates) == ["mean"]:
+        return list(variables)
+    return [f"{var}_{agg}" for var in variables for agg in aggregates]
+
+def read_summary_stats(row, variables, aliases):
+    # {variable: {statistic: value}} of a summary row, looked up by alias so a variable whose name starts with another one's
+    # (temp, temp_top) does not take its statistics. Aliases missing from the row (e.g. no points below threshold) are left out
+    stats = {var: {} for var in variables}
+    for alias, (var, statistic) in aliases.items():
+        if alias in row: stats[var][statistic] = row[alias]
+    return stats
+
+def check_aggregates(aggregates):
+    for agg in aggregates or []:
+        if agg not in subsample_aggregates:
+            raise ValueError(f"Unsupported subsample aggregate {agg}. It can only be one of {list(subsample_aggregates)}")
+
+def iter_dataset_bytes(dataset, chunk_size=1 << 20):
+    # raw bytes of an HDF5 dataset in chunks of at most chunk_size, without copying the whole dataset. Contiguous, unfiltered datasets
+    # (like the scalar opaque daq_configs) are read straight from the file at their offset
+    offset = dataset.id.get_offset()
+    if offset is not None and dataset.chunks is None and dataset.external is None:
+        remaining = dataset.id.get_storage_size()
+        buffer = bytearray(min(chunk_size, remaining))
+        with open(dataset.file.filename, 'rb') as f:
+            f.seek(offset)
+            while remaining > 0:
+                n = f.readinto(memoryview(buffer)[:min(len(buffer), remaining)])
+                if not n:
+                    raise OSError(f"Unexpected end of file reading {dataset.name} in {dataset.file.filename}")
+                remaining -= n
+                yield memoryview(buffer)[:n]
+    elif dataset.ndim == 1:
+        step = max(1, chunk_size // dataset.dtype.itemsize)
+        buffer = np.empty(min(step, len(dataset)), dtype=dataset.dtype)
+        for i in range(0, len(dataset), step):
+            n = min(step, len(dataset) - i)
+            dataset.read_direct(buffer, np.s_[i:i + n], np.s_[0:n])
+            yield memoryview(buffer[:n]).cast('B')
+    else:
+        yield memoryview(np.ascontiguousarray(dataset[()])).cast('B')
+
+def hash_daq_configs(f):
+    # sha256 of the raw daq_configs tarball of an open CRS binary file, None if it has none
+    if 'daq_configs' not in f:
+        return None
+    sha = hashlib.sha256()
+    for chunk in iter_dataset_bytes(f['daq_configs']):
+        sha.update(chunk)
+    return sha.hexdigest()
+
+def store_daq_configs(f, config_hash, config_store):
+    # <config_store>/<config_hash>.tar, written only if no file has stored this config yet. Written to a temporary file first so concurrent
+    # writers (the processes of read_crs_metas) never leave a partial tarball behind
+    stored = os.path.join(config_store, f"{config_hash}.tar")
+    if not os.path.exists(stored):
+        os.makedirs(config_store, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=config_store, suffix=".part", delete=False) as tmp:
+            for chunk in iter_dataset_bytes(f['daq_configs']):
+                tmp.write(chunk)
+        os.replace(tmp.name, stored)
+    return stored
+
+def read_crs_meta(path, skip_errors=False, config_store=None):
+    # (path, meta created, meta modified, message count, daq_configs hash) of a CRS binary file, None if it cannot be read and skip_errors
+    # is set. With a config_store, configs not stored yet are added to it
+    try:
+        with h5py.File(path) as f:
+            config_hash = hash_daq_configs(f)
+            if config_hash is not None and config_store is not None:
+                store_daq_configs(f, config_hash, config_store)
+            return str(path), float(f['meta'].attrs['created']), float(f['meta'].attrs['modified']), len(f['msgs']), config_hash
+    except (OSError, KeyError) as e:
+        if not skip_errors: raise
+        print(f"WARNING: Could not read the CRS meta data of {path}: {e!r}")
+        return None
+
+def map_crs_files(read, paths, jobs=1):
+    # read(path) of every path, in the order of paths. With jobs > 1 a process pool opens the files concurrently
+    paths = list(paths)
+    if jobs <= 1 or len(paths) <= 1:
+        return [read(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+        return list(executor.map(read, paths, chunksize=max(1, len(paths) // (4 * jobs))))
+
+def read_crs_metas(paths, jobs=1, skip_errors=False, config_store=None):
+    return map_crs_files(partial(read_crs_meta, skip_errors=skip_errors, config_store=config_store), paths, jobs)
+
+def le_uint32(buffer, index):
+    # little-endian uint32 at every index of a uint8 buffer
+    return (buffer[index].astype(np.uint32) | buffer[index + 1].astype(np.uint32) << 8 |
+            buffer[index + 2].astype(np.uint32) << 16 | buffer[index + 3].astype(np.uint32) << 24)
+
+def scan_crs_msgs(path, msg_format, chunk_rows=None):
+    # per-file statistics of the pacman messages in the msgs dataset (variable-length uint8) of a CRS binary file: the number of messages
+    # and data message words of every type in msg_format (config/CRS_parameters.yaml), the range of the message header times and of the
+    # word timestamps. msgs is read chunk_rows messages at a time (rounded to whole HDF5 chunks), so memory does not grow with the file
+    header_length, word_length = msg_format['header_length'], msg_format['word_length']
+    msg_codes = {name: ord(code) for name, code in msg_format['msg_types'].items()}
+    word_codes = {name: ord(code) for name, code in msg_format['word_types'].items()}
+    msg_counts, word_counts = np.zeros(256, dtype=np.int64), np.zeros(256, dtype=np.int64)
+    time_range = [None, None]
+    timestamp_ranges = {name: [None, None] for name in msg_format['timestamp_words']}
+
+    def update(limits, values):
+        if len(values):
+            lo, hi = int(values.min()), int(values.max())
+            limits[0] = lo if limits[0] is None else min(limits[0], lo)
+            limits[1] = hi if limits[1] is None else max(limits[1], hi)
+
+    with h5py.File(path) as f:
+        msgs = f['msgs']
+        if h5py.check_vlen_dtype(msgs.dtype) != np.dtype('u1'):
+            print(f"WARNING: msgs in {path} are not pacman messages (variable-length uint8), no message statistics")
+            return None
+        step = chunk_rows or msg_format.get('chunk_rows', 65536)
+        if msgs.chunks:
+            step = max(1, step // msgs.chunks[0]) * msgs.chunks[0]
+        for i in range(0, len(msgs), step):
+            chunk = msgs[i:i + step]
+            lengths = np.fromiter(map(len, chunk), dtype=np.int64, count=len(chunk))
+            chunk, lengths = chunk[lengths >= header_length], lengths[lengths >= header_length]
+            if not len(chunk):
+                continue
+            buffer = np.concatenate(chunk)
+            starts = np.cumsum(lengths) - lengths
+            msg_types = buffer[starts]
+            msg_counts += np.bincount(msg_types, minlength=256)
+            update(time_range, le_uint32(buffer, starts + msg_format['header_timestamp_offset']))
+
+            # word starts of the data messages: header_length + k*word_length past the message start for each of their complete words
+            data = msg_types == msg_codes['data']
+            n_words = (lengths[data] - header_length) // word_length
+            if not n_words.sum():
+                continue
+            first_word = np.repeat(starts[data] + header_length, n_words)
+            word_index = np.arange(n_words.sum()) - np.repeat(np.cumsum(n_words) - n_words, n_words)
+            word_starts = first_word + word_index * word_length
+            word_types = buffer[word_starts]
+            word_counts += np.bincount(word_types, minlength=256)
+            for name, limits in timestamp_ranges.items():
+                update(limits, le_uint32(buffer, word_starts[word_types == word_codes[name]] + msg_format['word_timestamp_offset']))
+
+    stats = {f'n_{name}_msgs': int(msg_counts[code]) for name, code in msg_codes.items()}
+    stats.update({f'n_{name}_words': int(word_counts[code]) for name, code in word_codes.items()})
+    stats['msg_time_min'], stats['msg_time_max'] = time_range
+    for name, (lo, hi) in timestamp_ranges.items():
+        stats[f'{name}_timestamp_min'], stats[f'{name}_timestamp_max'] = lo, hi
+    return stats
+
+def read_crs_msg_stats(paths, msg_format, jobs=1, chunk_rows=None):
+    return map_crs_files(partial(scan_crs_msgs, msg_format=msg_format, chunk_rows=chunk_rows), paths, jobs)
+
+class ConnectionRegistry:
+    # process-wide cache of database engines, HTTP sessions, influx clients and read-only sqlite handles, so every blob maker
+    # (and every run of a batch) reuses them instead of connecting again. Connections are only opened when they are first used, the counts
+    # and setup times of the ones a process used are reported at exit
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
+        self.sessions = {}
+        self.influx_clients = {}
+        self.sqlite_conns = {}
+        self.stats = {}
+        atexit.register(self.close_all)
+
+    def record(self, kind, created, seconds=0.):
+        stats = self.stats.setdefault(kind, {"created": 0, "reused": 0, "seconds": 0.})
+        stats["created" if created else "reused"] += 1
+        stats["seconds"] += seconds
+
+    def get_cached(self, kind, cache, key, create):
+        with self.lock:
+            if key in cache:
+                self.record(kind, created=False)
+                return cache[key]
+            start = time.perf_counter()
+            cache[key] = create()
+            self.record(kind, created=True, seconds=time.perf_counter() - start)
+            return cache[key]
+
+    def get_engine(self, url, pool_size=5, max_overflow=10, pool_recycle=3600):
+        # pooled connections are checked with a ping before they are handed out, the pool options of the first call are kept
+        return self.get_cached("psql engine", self.engines, url, lambda: alc.create_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle, pool_pre_ping=True))
+
+    def connect(self, engine):
+        start = time.perf_counter()
+        connection = engine.connect()
+        with self.lock:
+            self.record("psql checkout", created=True, seconds=time.perf_counter() - start)
+        return connection
+
+    def get_session(self, name):
+        return self.get_cached("http session", self.sessions, name, requests.Session)
+
+    def get_influx_client(self, host, port):
+        # InfluxDBClient sessions are not shared between threads, every thread gets its own keep-alive client
+        return self.get_cached("influx client", self.influx_clients, (host, port, threading.get_ident()), lambda: InfluxDBClient(host=host, port=port))
+
+    def close_influx_client(self, client):
+        with self.lock:
+            for key in [key for key, cached in self.influx_clients.items() if cached is client]:
+                del self.influx_clients[key]
+        client.close()
+
+    def get_sqlite(self, filename):
+        return self.get_cached("sqlite handle", self.sqlite_conns, os.path.abspath(filename), lambda: sqlite3.connect(f"file:{filename}?mode=ro", uri=True, check_same_thread=False))
+
+    def report(self):
+        if not self.stats:
+            return
+        print("\nConnections:")
+        for kind, stats in self.stats.items():
+            print(f"  {kind:<16} {stats['created']} opened in {stats['seconds']:.3f} s, {stats['reused']} reused")
+
+    def close_all(self):
+        self.report()
+        with self.lock:
+            for engine in self.engines.values(): engine.dispose()
+            for session in self.sessions.values(): session.close()
+            for client in self.influx_clients.values(): client.close()
+            for conn in self.sqlite_conns.values(): conn.close()
+            self.engines, self.sessions, self.influx_clients, self.sqlite_conns, self.stats = {}, {}, {}, {}, {}
+
+connections = ConnectionRegistry()
+
 class PsqlDBManager:
-    def __init__(self, config):
+    def __init__(self, config, pool_options=None):
         self.config = config
         self.start = None
         self.end = None
         self.url = self.create_url()
-        self.engine = alc.create_engine(self.url)
-        self.connection = self.engine.connect()
+        self.engine = connections.get_engine(self.url, **(pool_options or {}))
+        self.connection = connections.connect(self.engine)
+        self.table_names = None
 
     def set_time_range(self, start, end):
         self.start = start
@@ -29,72 +299,154 @@ class PsqlDBManager:
         return url_template.format(**self.config)
 
     def get_years_months(self):
-        year_st = "{:04d}".format(self.start.year)
-        month_st = "{:02d}".format(self.start.month)
+        # (YYYY, MM) of every month from start to end, the cryostat data is split into one table per month
+        months = []
+        year, month = self.start.year, self.start.month
+        while (year, month) <= (self.end.year, self.end.month):
+            months.append(("{:04d}".format(year), "{:02d}".format(month)))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return months
 
-        year_end = "{:04d}".format(self.end.year)
-        month_end = "{:02d}".format(self.end.month)
+    def get_partition_tables(self, table_prefix):
+        # monthly tables covering the time range. Months without a table (e.g. before the historian was running) are skipped with a warning
+        if self.table_names is None:
+            self.table_names = set(alc.inspect(self.connection).get_table_names())
+        tables = []
+        for year, month in self.get_years_months():
+            table_name = f"{table_prefix}_{year}_{month}"
+            if table_name in self.table_names: tables.append(table_name)
+            else: print(f"WARNING: Table {table_name} does not exist, skipping it")
+        return tables
 
-        years = [year_st]
-        months = [month_st]
-        if year_st != year_end:
-            years.append(year_end)
+    def stream_query(self, query, batch_size=10000):
+        # rows come from a server-side cursor in batches of batch_size instead of being fetched all at once. The options are set on the
+        # statement, Connection.execution_options() would change them in place for every later query of the pooled connection
+        result = self.connection.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.partitions():
+            yield partition
 
-        if month_st != month_end:
-            months.append(month_end)
+    def get_cryostat_union(self, table_prefix, variable, tagid):
+        # one UNION ALL over the monthly tables, as a subquery with t_stamp and floatvalue columns
+        start_utime = int(self.start.timestamp() * 1e3)
+        end_utime = int(self.end.timestamp() * 1e3)
+        selects = []
+        for table_name in self.get_partition_tables(table_prefix):
+            tab = alc.table(table_name, alc.Column("t_stamp"), alc.Column("floatvalue"), alc.Column("tagid"))
+            selects.append(alc.select(tab.c.t_stamp, tab.c.floatvalue).select_from(tab).where(alc.and_(tab.c.tagid == str(tagid), tab.c.t_stamp >= str(int(start_utime)), tab.c.t_stamp <= str(int(end_utime)))))
+        if not selects:
+            return None
+        return (alc.union_all(*selects) if len(selects) > 1 else selects[0]).subquery()
 
-        return years, months
+    def get_subsample_select(self, time_column, bucket_column, value_columns, aggregates=None):
+        # columns for a GROUP BY bucket query, named like DataManager names the client-side resampled columns, and the HAVING condition
+        # dropping the buckets with a missing aggregate like the dropna() after the client-side resample
+        check_aggregates(aggregates)
+        aggregates = aggregates or ["mean"]
+        names = get_subsample_columns([column.name for column in value_columns], aggregates)
+        aggregated = [subsample_aggregates[agg][1](column) for column in value_columns for agg in aggregates]
+        return [bucket_column.label(time_column.name)] + [column.label(name) for column, name in zip(aggregated, names)], alc.and_(*[column.isnot(None) for column in aggregated])
 
-    def get_cryostat_data(self, table_prefix, variable, tagid):
+    def iter_cryostat_data(self, table_prefix, variable, tagid, subsample=None, aggregates=None, batch_size=10000):
         print(f"\nQuerying {variable} data from PostgreSQL Database")
 
+        values = self.get_cryostat_union(table_prefix, variable, tagid)
+        if values is None:
+            return
+        bucket_ms = get_bucket_ms(subsample)
+        if bucket_ms is not None:
+            bucket = alc.cast(alc.func.floor(values.c.t_stamp / bucket_ms) * bucket_ms, alc.BigInteger)
+            columns, complete = self.get_subsample_select(values.c.t_stamp, bucket, [values.c.floatvalue], aggregates)
+            query = alc.select(*columns).group_by(bucket).having(complete).order_by(bucket)
+        else:
+            query = alc.select(values.c.t_stamp, values.c.floatvalue).order_by(values.c.t_stamp)
+        yield from self.stream_query(query, batch_size)
+
+    def get_cryostat_data(self, table_prefix, variable, tagid, subsample=None, aggregates=None):
         result_data = []
-        years, months = self.get_years_months() # we have to do this because cryostat data is split into multiple tables based on years and months. This should account for runs spanning across months or yeara
-        start_utime = int(self.start.timestamp() * 1e3)
-        end_utime = int(self.end.timestamp() * 1e3)
-        for y in years:
-            for m in months:
-                table_name = f"{table_prefix}_{y}_{m}"
-                tab = alc.table(table_name, alc.Column("t_stamp"), alc.Column("floatvalue"), alc.Column("tagid"))
-                query = alc.select(tab.c.t_stamp, tab.c.floatvalue).select_from(tab).where(alc.and_(tab.c.tagid == str(tagid), tab.c.t_stamp >= str(int(start_utime)), tab.c.t_stamp <= str(int(end_utime))))
-                result = self.connection.execute(query)
-                result_data.extend(result.all())
+        for rows in self.iter_cryostat_data(table_prefix, variable, tagid, subsample=subsample, aggregates=aggregates):
+            result_data.extend(rows)
         return result_data
 
-    def get_purity_monitor_data(self, tablename, variables=[], last_value=False):
+    def iter_purity_monitor_data(self, tablename, variables=[], subsample=None, aggregates=None, batch_size=10000, verbose=True):
+        if verbose: print(f"\nQuerying {variables} from purity monitor measurements from PostgreSQL Database")
+
+        tab = alc.table(tablename, alc.Column("timestamp"), *[alc.Column(var) for var in variables])
+        query_columns = [tab.c.timestamp] + [tab.c[var] for var in variables]
+        bucket_ms = get_bucket_ms(subsample)
+        if bucket_ms is not None:
+            bucket = alc.func.to_timestamp(alc.func.floor(alc.extract("epoch", tab.c.timestamp) * 1e3 / bucket_ms) * bucket_ms / 1e3)
+            query_columns, complete = self.get_subsample_select(tab.c.timestamp, bucket, [tab.c[var] for var in variables], aggregates)
+        query = alc.select(*query_columns).select_from(tab).where(alc.and_(tab.c.timestamp >= self.start, tab.c.timestamp <= self.end))
+        if bucket_ms is not None: query = query.group_by(bucket).having(complete).order_by(bucket)
+        else: query = query.order_by(tab.c.timestamp)
+        yield from self.stream_query(query, batch_size)
+
+    def get_purity_monitor_last_values(self, tablename, variables, times, lookback=None):
+        # latest row at or before each of times (within lookback before it if given), None where there is none.
+        # One query: a UNION ALL of ORDER BY timestamp DESC LIMIT 1 selects, tagged with the index of their time
+        tab = alc.table(tablename, alc.Column("timestamp"), *[alc.Column(var) for var in variables])
+        selects = []
+        for i, t in enumerate(times):
+            condition = tab.c.timestamp <= t
+            if lookback is not None: condition = alc.and_(condition, tab.c.timestamp > t - lookback)
+            last = alc.select(alc.literal(i).label("idx"), tab.c.timestamp, *[tab.c[var] for var in variables]).select_from(tab).where(condition).order_by(tab.c.timestamp.desc()).limit(1).subquery()
+            selects.append(alc.select(last))
+        if not selects:
+            return []
+        last_values = [None] * len(times)
+        for row in self.connection.execute(alc.union_all(*selects) if len(selects) > 1 else selects[0]):
+            last_values[row[0]] = tuple(row[1:])
+        return last_values
+
+    def get_purity_monitor_data(self, tablename, variables=[], last_value=False, subsample=None, aggregates=None):
         print(f"\nQuerying {variables} from purity monitor measurements from PostgreSQL Database")
 
+        if last_value: #latest row at or before the end of the time range, however far back it is
+            last = self.get_purity_monitor_last_values(tablename, variables, [self.end])[0]
+            if last is None: print(f"WARNING: No purity monitor measurement found before {self.end}")
+            return last
+
         result_data = []
-        columns = [alc.Column("timestamp")] + [alc.Column(var) for var in variables]
-        tab = alc.table(tablename, *columns)
+        for rows in self.iter_purity_monitor_data(tablename, variables, subsample=subsample, aggregates=aggregates, verbose=False):
+            result_data.extend(rows)
 
-        query_columns = [tab.c.timestamp] + [tab.c[var] for var in variables]
+        if not result_data:
+            print(f"WARNING: No data found for the given time period from {self.start} to {self.end}")
+        return result_data
 
-        if last_value:
-            day_increment = timedelta(days=1)
-            while not result_data:
-                initial_start = self.start
-                query = alc.select(*query_columns).select_from(tab).where(alc.and_(tab.c.timestamp >= self.start, tab.c.timestamp <= self.end))
-                result = self.connection.execute(query)
-                result_data.extend(result.all())
+    def get_summary_select(self, value_columns, threshold=None, percentiles=()):
+        # count, count below threshold, mean, min, max and percentiles of every column, named <column>_<statistic>.
+        # Returns the columns and their {name: (column, statistic)} for read_summary_stats
+        query_columns, aliases = [], {}
+        for column in value_columns:
+            statistics = {"count": alc.func.count(column), "mean": alc.func.avg(column), "min": alc.func.min(column), "max": alc.func.max(column)}
+            if threshold is not None:
+                statistics["below"] = alc.func.count(column).filter(column < threshold)
+            statistics.update({f"p{p:g}": alc.func.percentile_cont(p / 100.).within_group(column) for p in percentiles})
+            for statistic, expression in statistics.items():
+                aliases[f"{column.name}_{statistic}"] = (column.name, statistic)
+                query_columns.append(expression.label(f"{column.name}_{statistic}"))
+        return query_columns, aliases
 
-                if result_data:
-                    return result_data[-1]
-                else:
-                    print(f"WARNING: No data found for the given time period {self.start} to {self.end}")
-                    self.start = initial_start - day_increment
-                    self.end = initial_start
-                    print(f"Extending time range by one day before the subrun: {self.start} to {self.end} to obtain the last purity monitor measurement")
-        else:
-            query = alc.select(*query_columns).select_from(tab).where(alc.and_(tab.c.timestamp >= self.start, tab.c.timestamp <= self.end))
-            result = self.connection.execute(query)
-            result_data.extend(result.all())
+    def get_summary_stats(self, query, variables, aliases):
+        return read_summary_stats(self.connection.execute(query).mappings().one(), variables, aliases)
 
-            if result_data:
-                return result_data
-            else:
-                print(f"WARNING: No data found for the given time period from {self.start} to {self.end}")
-                return result_data
+    def get_cryostat_summary_stats(self, table_prefix, variable, tagid, threshold=None, percentiles=()):
+        print(f"\nQuerying {variable} summary statistics from PostgreSQL Database")
+
+        values = self.get_cryostat_union(table_prefix, variable, tagid)
+        if values is None:
+            return {"count": 0, "mean": None, "min": None, "max": None, **({"below": 0} if threshold is not None else {}), **{f"p{p:g}": None for p in percentiles}}
+        query_columns, aliases = self.get_summary_select([values.c.floatvalue.label(variable)], threshold=threshold, percentiles=percentiles)
+        return self.get_summary_stats(alc.select(*query_columns), [variable], aliases)[variable]
+
+    def get_purity_monitor_summary_stats(self, tablename, variables, threshold=None, percentiles=()):
+        print(f"\nQuerying {variables} summary statistics from purity monitor measurements from PostgreSQL Database")
+
+        tab = alc.table(tablename, alc.Column("timestamp"), *[alc.Column(var) for var in variables])
+        query_columns, aliases = self.get_summary_select([tab.c[var] for var in variables], threshold=threshold, percentiles=percentiles)
+        query = alc.select(*query_columns).select_from(tab).where(alc.and_(tab.c.timestamp >= self.start, tab.c.timestamp <= self.end))
+        return self.get_summary_stats(query, variables, aliases)
 
     def make_filename(self, measurement_name):
         return f"{measurement_name}_{self.start.isoformat()}_{self.end.isoformat()}"
@@ -104,63 +456,268 @@ class PsqlDBManager:
         if self.connection is not None:
             self.connection.close()
 
+def metadata_key(kind, database, measurement=None):
+    return f"{kind}/{database}" if measurement is None else f"{kind}/{database}/{measurement}"
+
+class InfluxMetadataCache:
+    # measurements, field keys and tag keys per database/measurement, persisted to a json file so that warm runs skip the SHOW queries
+    def __init__(self, filename=None, ttl=86400):
+        self.filename = filename
+        self.ttl = ttl #seconds
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.modified = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not read InfluxDB metadata cache {self.filename}, starting from an empty cache: {e}")
+            self.entries = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (time.time() - entry["fetched"]) < self.ttl:
+                self.hits += 1
+                return entry["value"]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = {"fetched": time.time(), "value": value}
+            self.modified = True
+
+    def invalidate(self, database=None, measurement=None):
+        with self.lock:
+            if database is None:
+                self.entries = {}
+            else:
+                keys = [key for key in self.entries if key.split('/', 2)[1] == database and (measurement is None or key.split('/', 2)[2:] == [measurement])]
+                for key in keys:
+                    del self.entries[key]
+            self.modified = True
+
+    def save(self):
+        with self.lock:
+            if not self.filename or not self.modified:
+                return
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_filename, self.filename)
+            self.modified = False
+
+    def report(self):
+        print(f"InfluxDB metadata cache: {self.hits} hits, {self.misses} misses")
+
 class InfluxDBManager:
-    def __init__(self, config):
+    def __init__(self, config, metadata_cache=None, epoch="ns"):
         self.config = config
         self.start = None
         self.end = None
-        self.client = InfluxDBClient(host=self.config["host"], port=self.config["port"])
+        self.client = connections.get_influx_client(self.config["host"], self.config["port"])
+        self.metadata_cache = metadata_cache
+        if epoch is not None and epoch not in influx_epoch_ns:
+            raise ValueError(f"Unsupported epoch precision '{epoch}'. Use one of {list(influx_epoch_ns)} or None for RFC3339 strings")
+        self.epoch = epoch #precision of the integer timestamps returned by fetch_measurement_data, None for RFC3339 strings
 
     def set_time_range(self, start, end):
         self.start = start
         self.end = end
 
+    def cached_metadata(self, key, fetch):
+        if self.metadata_cache is None:
+            return fetch()
+        value = self.metadata_cache.get(key)
+        if value is None:
+            value = fetch()
+            self.metadata_cache.set(key, value)
+        return value
+
     def fetch_measurement_fields(self, database, measurement):
-        result = self.client.query(f'SHOW FIELD KEYS ON "{database}" FROM "{measurement}"')
-        fields = [field["fieldKey"] for field in result.get_points()]
-        return fields
+        def fetch():
+            result = self.client.query(f'SHOW FIELD KEYS ON "{database}" FROM "{measurement}"')
+            return [field["fieldKey"] for field in result.get_points()]
+        return self.cached_metadata(metadata_key("fields", database, measurement), fetch)
 
     def fetch_measurements(self, database):
-        query = f'SHOW MEASUREMENTS ON "{database}"'
-        result = self.client.query(query)
-        measurements = [measurement["name"] for measurement in result.get_points()]
-        return measurements
+        def fetch():
+            query = f'SHOW MEASUREMENTS ON "{database}"'
+            result = self.client.query(query)
+            return [measurement["name"] for measurement in result.get_points()]
+        return self.cached_metadata(metadata_key("measurements", database), fetch)
+
+    def get_measurement_query(self, database, measurement, variables, subsample, aggregates, start_utime, end_utime, end_inclusive=True):
+        # with a subsample interval dividing one hour the aggregation is done by influx (GROUP BY time), see get_bucket_ms
+        variable_str = ', '.join(variables)
+
+        tag_keys = self.fetch_tag_keys(database, measurement)
+        group_by = list(tag_keys)
+
+        bucket_ms = get_bucket_ms(subsample)
+        if bucket_ms is not None:
+            check_aggregates(aggregates)
+            aggregates = aggregates or ["mean"]
+            names = get_subsample_columns(variables, aggregates)
+            aggregated = [f'{subsample_aggregates[agg][0]}("{var}")' for var in variables for agg in aggregates]
+            variable_str = ', '.join(f'{column} AS "{name}"' for column, name in zip(aggregated, names))
+            group_by = [f'time({bucket_ms}ms)'] + group_by
+
+        group_by_str = ', '.join(group_by)
+        fill_str = ' fill(none)' if bucket_ms is not None else ''
+        end_str = '<=' if end_inclusive else '<'
+
+        if group_by: return f'SELECT {variable_str} FROM "{measurement}" WHERE time >= {start_utime}ms and time {end_str} {end_utime}ms GROUP BY {group_by_str}{fill_str}'
+        return f'SELECT {variable_str} FROM "{measurement}" WHERE time >= {start_utime}ms and time {end_str} {end_utime}ms'
 
-    def fetch_measurement_data(self, database, measurement, variables=[], subsample=None):
+    def fetch_measurement_data(self, database, measurement, variables=[], subsample=None, aggregates=None):
         print(f"\nQuerying {variables} in {measurement} from {database} from InfluxDB Database")
 
         start_utime = int(self.start.timestamp() * 1e3)
         end_utime = int(self.end.timestamp() * 1e3)
 
-        query = ''
-        variable_str = ', '.join(variables)
+        query = self.get_measurement_query(database, measurement, variables, subsample, aggregates, start_utime, end_utime)
+        result = self.client.query(query, database=database, epoch=self.epoch)
+        return result
 
-        tag_keys = self.fetch_tag_keys(database, measurement)
-        tag_keys_str = ', '.join(tag_keys)
+    def get_windows(self, window_ms=None, align_ms=None):
+        # (start, end, end_inclusive) in ms covering the time range. Edges are multiples of window_ms since the epoch,
+        # rounded up to a multiple of align_ms so GROUP BY time buckets are never split between two windows
+        start_utime = int(self.start.timestamp() * 1e3)
+        end_utime = int(self.end.timestamp() * 1e3)
+        if not window_ms:
+            return [(start_utime, end_utime, True)]
+        if align_ms: window_ms = -(-window_ms // align_ms) * align_ms
+        edges = [start_utime] + list(range((start_utime // window_ms + 1) * window_ms, end_utime + 1, window_ms))
+        return [(window_start, window_end, False) for window_start, window_end in zip(edges, edges[1:])] + [(edges[-1], end_utime, True)]
 
-        if tag_keys: query = f'SELECT {variable_str} FROM "{measurement}" WHERE time >= {start_utime}ms and time <= {end_utime}ms GROUP BY {tag_keys_str}'
-        else:  query = f'SELECT {variable_str} FROM "{measurement}" WHERE time >= {start_utime}ms and time <= {end_utime}ms'
-        result = self.client.query(query, database=database)
-        return result
+    def iter_measurement_data(self, database, measurement, variables=[], subsample=None, aggregates=None, window=None, batch_size=10000):
+        # streaming version of fetch_measurement_data: yields one generator per time window (window like '1D', None for the whole range),
+        # each yielding ResultSets of at most batch_size points that influx sends as a chunked response
+        print(f"\nStreaming {variables} in {measurement} from {database} from InfluxDB Database")
+
+        for window_start, window_end, end_inclusive in self.get_windows(get_subsample_ms(window), get_bucket_ms(subsample)):
+            query = self.get_measurement_query(database, measurement, variables, subsample, aggregates, window_start, window_end, end_inclusive=end_inclusive)
+            yield self.client.query(query, database=database, epoch=self.epoch, chunked=True, chunk_size=batch_size)
+
+    def post_query(self, query, database, epoch=None):
+        # like client.query, but the statements go in a form-encoded POST body. client.query puts q in the URL even with method='POST',
+        # which proxies and the server's header limits reject for long statement lists
+        params = {'db': database}
+        if epoch is not None: params['epoch'] = epoch
+        headers = {**self.client._headers, 'Content-Type': 'application/x-www-form-urlencoded'}
+        response = self.client.request('query', method='POST', params=params, data=urllib.parse.urlencode({'q': query}), headers=headers)
+        data = response._msgpack or response.json()
+        results = [ResultSet(result) for result in data.get('results', [])]
+        return results[0] if len(results) == 1 else results
+
+    def fetch_last_values(self, database, measurement, variables, times_ms, lookback_ms=None, batch_size=100):
+        # latest point (over all series) at or before each of times_ms, within lookback_ms before it if given, None where there is none.
+        # One ORDER BY time DESC LIMIT 1 statement per time, sent in the body of POST requests (post_query) of at most batch_size statements
+        if not len(times_ms):
+            return []
+        print(f"\nQuerying the last {variables} in {measurement} from {database} before {len(times_ms)} times from InfluxDB Database")
+
+        variable_str = ', '.join(f'"{var}"' for var in variables)
+        queries = []
+        for t in times_ms:
+            time_str = f'time <= {int(t)}ms' if lookback_ms is None else f'time > {int(t - lookback_ms)}ms and time <= {int(t)}ms'
+            queries.append(f'SELECT {variable_str} FROM "{measurement}" WHERE {time_str} ORDER BY time DESC LIMIT 1')
+
+        points = []
+        for i in range(0, len(queries), batch_size):
+            results = self.post_query('; '.join(queries[i:i + batch_size]), database, epoch=self.epoch)
+            if not isinstance(results, list): results = [results]
+            points += [next(iter(result.get_points()), None) for result in results]
+        return points
+
+    def fetch_summary_stats(self, database, measurement, variables, threshold=None, percentiles=()):
+        # count, count below threshold, mean, min, max and percentiles of every variable over all series, computed by influx.
+        # Everything goes out as one request, the below-threshold counts need their own WHERE clause so they are a second statement
+        print(f"\nQuerying {variables} summary statistics in {measurement} from {database} from InfluxDB Database")
+
+        start_utime = int(self.start.timestamp() * 1e3)
+        end_utime = int(self.end.timestamp() * 1e3)
+        time_str = f'time >= {start_utime}ms and time <= {end_utime}ms'
+
+        statistics, aliases = [], {}
+        for var in variables:
+            functions = {"count": f'count("{var}")', "mean": f'mean("{var}")', "min": f'min("{var}")', "max": f'max("{var}")', **{f"p{p:g}": f'percentile("{var}", {p:g})' for p in percentiles}}
+            for statistic, function in functions.items():
+                aliases[f"{var}_{statistic}"] = (var, statistic)
+                statistics.append(f'{function} AS "{var}_{statistic}"')
+        queries = [f'SELECT {", ".join(statistics)} FROM "{measurement}" WHERE {time_str}']
+        if threshold is not None:
+            aliases.update({f"{var}_below": (var, "below") for var in variables})
+            queries += [f'SELECT count("{var}") AS "{var}_below" FROM "{measurement}" WHERE {time_str} and "{var}" < {threshold}' for var in variables]
+
+        results = self.client.query('; '.join(queries), database=database)
+        if not isinstance(results, list): results = [results]
+
+        row = {}
+        for result in results:
+            for point in result.get_points():
+                row.update(point)
+
+        summary = read_summary_stats(row, variables, aliases)
+        for stats in summary.values():
+            stats["count"] = stats.get("count") or 0
+            if threshold is not None: stats["below"] = stats.get("below") or 0
+        return summary
 
     def fetch_tag_keys(self, database, measurement):
-        tag_keys_result = self.client.query(f'SHOW TAG KEYS ON "{database}" FROM "{measurement}"')
-        tag_keys = [tag["tagKey"] for tag in tag_keys_result.get_points()]
-        return tag_keys
+        def fetch():
+            tag_keys_result = self.client.query(f'SHOW TAG KEYS ON "{database}" FROM "{measurement}"')
+            return [tag["tagKey"] for tag in tag_keys_result.get_points()]
+        return self.cached_metadata(metadata_key("tags", database, measurement), fetch)
 
     def make_filename(self, database, measurement):
         return f'{database}_{measurement}_{self.start.isoformat()}_{self.end.isoformat()}'
 
     def close_connection(self):
-        if self.client is not None:
-            self.client.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.save()
+            self.metadata_cache.report()
+        self.client = None #the client stays open in the connection registry for the next manager
 
 class SQLiteDBManager:
-    def __init__(self, filename, run):
+    def __init__(self, filename, run, read_only=False):
         self.run = run
         self.filename = filename
-        self.conn = sqlite3.connect(self.filename)
+        self.read_only = read_only #read-only handles are shared through the connection registry
+        self.conn = connections.get_sqlite(self.filename) if read_only else sqlite3.connect(self.filename)
         self.cursor = self.conn.cursor()
+        self.building = False
+        self.table_columns = {} #lower-case column names of the tables written through this manager
+        self.tables_built = [] #tables dumped since begin_build, reported once by end_build
+
+    def __enter__(self):
+        self.begin_build()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None: self.end_build()
+        else: self.conn.rollback()
+        self.close_connection()
+
+    def begin_build(self):
+        # bulk writes of a whole output file: every dump_data goes into one transaction committed by end_build
+        self.building = True
+        self.tables_built = []
+
+    def end_build(self):
+        self.conn.commit()
+        self.building = False
+        if self.tables_built:
+            print(f"Dumped tables {', '.join(dict.fromkeys(self.tables_built))} to sqlite database file {self.filename}")
 
     def query_data(self, table_name, conditions, columns):
         columns_str = ", ".join(columns)
@@ -177,9 +734,15 @@ class SQLiteDBManager:
         column_names = [info[1] for info in columns_info]  # The second element in each tuple is the column name
         return column_names
 
-    def get_subruns(self, table, start, end, subrun, condition):
+    def get_subruns(self, table, start, end, subrun, condition, run_multiplier=None, catalog=None, system=None):
+        # run_multiplier: condition is a column packing run*run_multiplier + subrun (Mx2 runsubrun), matched with a range so an index on it is used
+        # catalog: a RunCatalog to look the subruns of system up in instead of querying table
         subrun_columns = [subrun, start, end]
-        subruns_data = self.query_data(table_name=table, conditions=[f"{condition}={self.run}"], columns=subrun_columns)
+        subruns_data = catalog.get_subrun_rows(system, self.run) if catalog is not None else None
+        if subruns_data is None:
+            if run_multiplier: run_condition = f"{condition} BETWEEN {self.run * run_multiplier} AND {(self.run + 1) * run_multiplier - 1}"
+            else: run_condition = f"{condition}={self.run}"
+            subruns_data = self.query_data(table_name=table, conditions=[run_condition], columns=subrun_columns)
 
         subruns = {}
         for row in subruns_data:
@@ -234,47 +797,278 @@ class SQLiteDBManager:
             key_str = 'PRIMARY KEY (run, subrun)'
         self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({key_cols}, {columns_str}, {key_str})")
 
-    def insert_data(self, table_name, data, global_run=None, is_global_subrun=False):
-        for subrun, details in data.items():
-            flat_details = {}
-            if is_global_subrun:
-                flat_details['global_subrun'] = subrun
+    def widen_table(self, table_name, schema):
+        # add the columns the table does not have yet (e.g. a new key in a later run)
+        if table_name not in self.table_columns:
+            self.table_columns[table_name] = {column.lower() for column in self.get_column_names(table_name)}
+        existing = self.table_columns[table_name]
+        for col, col_type in schema.items():
+            if col.lower() in existing:
+                continue
+            if any(issubclass(col_type, c) for c in [int, np.integer]):
+                col_type = "INTEGER"
+            elif any(issubclass(col_type, c) for c in [float, np.floating]):
+                col_type = "REAL"
             else:
-                flat_details['run'] = details['run']
-                flat_details['subrun'] = subrun
-            flat_details['global_run'] = global_run
+                col_type = "TEXT"
+            self.cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {col_type}")
+            existing.add(col.lower())
 
-            for key, value in details.items():
-                if isinstance(value, dict):
-                    for subkey, subvalue in value.items():
-                        composite_key = f"{key}_{subkey}"
-                        flat_details[composite_key] = subvalue
-                else:
-                    flat_details[key] = value
+    def get_row_layout(self, keys, values, key_columns):
+        # columns of the rows with these keys and value types, and where each column is in key values + values with the nested dicts
+        # expanded; a column set twice (e.g. run, also a key of the row) keeps its first position and its last value
+        flat_columns = list(key_columns)
+        nested = []
+        for i, (key, value) in enumerate(zip(keys, values)):
+            if isinstance(value, dict):
+                nested.append((i, tuple(value)))
+                flat_columns += [f"{key}_{subkey}" for subkey in value]
+            else:
+                flat_columns.append(key)
+        positions = {}
+        for index, column in enumerate(flat_columns):
+            positions[column] = index
+        return nested, tuple(positions), itemgetter(*positions.values())
 
-            columns = ", ".join(flat_details.keys())
-            placeholders = ", ".join(["?"] * len(flat_details))
-            values = list(flat_details.values())
+    def flatten_data(self, data, global_run=None, is_global_subrun=False):
+        # flat rows grouped by their column order: {columns: [values, ...]}, plus the first row of every group
+        # the layout of a row is looked up by its keys and value types, so most rows are flattened with a few tuple operations
+        groups = {}
+        first_rows = []
+        layouts = {}
+        key_columns = ('global_subrun', 'global_run') if is_global_subrun else ('run', 'subrun', 'global_run')
+        for subrun, details in data.items():
+            values = tuple(details.values())
+            layout_key = (tuple(details), tuple(map(type, values)))
+            layout = layouts.get(layout_key)
+            if layout is not None:
+                for i, subkeys in layout[0]:
+                    if tuple(values[i]) != subkeys:
+                        layout = None
+                        break
+            if layout is None:
+                layout = layouts[layout_key] = self.get_row_layout(layout_key[0], values, key_columns)
+            nested, columns, take = layout
 
-            self.cursor.execute(f"INSERT OR REPLACE INTO {table_name} ({columns}) VALUES ({placeholders})", values)
+            flat = (subrun, global_run) if is_global_subrun else (details['run'], subrun, global_run)
+            start = 0
+            for i, _ in nested:
+                flat += values[start:i] + tuple(values[i].values())
+                start = i + 1
+            row = take(flat + values[start:])
+
+            rows = groups.get(columns)
+            if rows is None:
+                rows = groups[columns] = []
+                first_rows.append(dict(zip(columns, row)))
+            rows.append(row)
+        return groups, first_rows
+
+    def insert_data(self, table_name, groups):
+        # one executemany with a prepared statement per column order
+        for columns, values in groups.items():
+            placeholders = ", ".join(["?"] * len(columns))
+            self.cursor.executemany(f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})", values)
 
     def dump_data(self, data, table_name, global_run=None, is_global_subrun=False):
-        schema = self.extract_schema(data)
+        groups, first_rows = self.flatten_data(data, global_run=global_run, is_global_subrun=is_global_subrun)
+        # the first row of every column order has the first value of every column, so its schema is the schema of all rows
+        schema = self.extract_schema(dict(enumerate(first_rows)))
+        schema.pop('global_subrun' if is_global_subrun else 'subrun', None)
         self.create_table(table_name, schema, is_global_subrun=is_global_subrun)
-        self.insert_data(table_name, data, global_run=global_run, is_global_subrun=is_global_subrun)
-        self.conn.commit()
+        self.widen_table(table_name, schema)
+        self.insert_data(table_name, groups)
+        if self.building: self.tables_built.append(table_name)
+        else: self.conn.commit()
 
     def close_connection(self):
-        if self.conn:
+        if self.read_only:
+            self.cursor.close()
+        elif self.conn:
             self.conn.close()
 
 
 
+class RunCatalog:
+    # local index of the subruns in the LRS, Mx2 and CRS databases, which cannot be indexed themselves: one (system, run, subrun, start_unix,
+    # end_unix, source_key) row per source row, source_key being the rowid of that row. sources: {system: {filename, table, run, subrun, start,
+    # end, run_multiplier}} where run_multiplier is set when the run column packs run*run_multiplier + subrun
+    def __init__(self, filename, sources):
+        self.filename = filename
+        self.sources = sources
+        self.conn = sqlite3.connect(self.filename, check_same_thread=False) #shared by the blob makers of every thread once refreshed, the reads each take their own cursor
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS subruns (system TEXT, run INTEGER, subrun INTEGER, start_unix NUMERIC, end_unix NUMERIC, source_key INTEGER, PRIMARY KEY (system, source_key))")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS subruns_run ON subruns (system, run, subrun)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS subruns_start ON subruns (system, start_unix)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sources (system TEXT PRIMARY KEY, filename TEXT, mtime REAL, size INTEGER, max_key INTEGER, max_duration REAL)")
+        if self.cursor.execute("SELECT 1 FROM pragma_table_info('crs_files') WHERE name='config_hash'").fetchone() is None:
+            # catalogs built before the config hashes were indexed: their CRS files are read again on the next refresh
+            self.cursor.execute("DROP TABLE IF EXISTS crs_files")
+            self.cursor.execute("DROP TABLE IF EXISTS crs_dirs")
+            self.cursor.execute("DELETE FROM sources WHERE system='crs_files'")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS crs_files (path TEXT PRIMARY KEY, directory TEXT, run INTEGER, size INTEGER, mtime REAL, created REAL, modified REAL, msg_count INTEGER, config_hash TEXT)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS crs_files_run ON crs_files (run)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS crs_files_dir ON crs_files (directory)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS crs_files_created ON crs_files (created)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS crs_dirs (directory TEXT PRIMARY KEY, parent TEXT, mtime REAL)")
+        self.conn.commit()
+
+    def refresh(self, rebuild=False, tail_rows=1000):
+        # sources whose file did not change are skipped. Otherwise only rows after the last indexed rowid are read, together with the last
+        # tail_rows indexed ones whose end times may still have been filled in. A source that shrank or moved is indexed again from scratch
+        for system, source in self.sources.items():
+            filename = os.path.abspath(source["filename"])
+            if not os.path.exists(filename):
+                print(f"WARNING: {system} database {filename} not found, it is not in the run catalog")
+                continue
+            stat = os.stat(filename)
+            indexed = self.cursor.execute("SELECT filename, mtime, size, max_key FROM sources WHERE system=?", (system,)).fetchone()
+            if not rebuild and indexed is not None and tuple(indexed[:3]) == (filename, stat.st_mtime, stat.st_size):
+                continue
+
+            source_conn = connections.get_sqlite(filename)
+            max_key = source_conn.execute(f"SELECT max(rowid) FROM {source['table']}").fetchone()[0] or 0
+            if rebuild or indexed is None or indexed[0] != filename or max_key < (indexed[3] or 0):
+                self.cursor.execute("DELETE FROM subruns WHERE system=?", (system,))
+                from_key = 0
+            else:
+                from_key = max((indexed[3] or 0) - tail_rows, 0)
+
+            rows = source_conn.execute(f"SELECT rowid, {source['run']}, {source['subrun']}, {source['start']}, {source['end']} FROM {source['table']} WHERE rowid > ?", (from_key,)).fetchall()
+            run_multiplier = source.get("run_multiplier")
+            if run_multiplier:
+                rows = [(key, *divmod(int(run), run_multiplier), start, end) for key, run, _, start, end in rows]
+            self.cursor.executemany("INSERT OR REPLACE INTO subruns (source_key, run, subrun, start_unix, end_unix, system) VALUES (?, ?, ?, ?, ?, ?)", [(*row, system) for row in rows])
+
+            max_duration = self.cursor.execute("SELECT max(end_unix - start_unix) FROM subruns WHERE system=? AND start_unix > 0 AND end_unix > 0", (system,)).fetchone()[0] or 0
+            self.cursor.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)", (system, filename, stat.st_mtime, stat.st_size, max_key, max_duration))
+            self.conn.commit()
+            print(f"Run catalog: indexed {len(rows)} {system} rows from {filename}")
+
+    def refresh_crs_files(self, data_dir, pattern="binary-*.h5", recheck_recent=86400, rebuild=False, jobs=1, config_store=None):
+        # CRS binary files under data_dir with their meta created/modified times, message count and daq_configs hash (new configs are added to
+        # config_store, see read_crs_meta), so CRS_blob_maker never walks the tree or
+        # opens the files. A directory is only listed again if its mtime changed (a file was added, removed or renamed in it), otherwise its
+        # known subdirectories are followed. Files modified less than recheck_recent seconds ago may still be written and are stat'ed again.
+        # New and changed files are read at the end, by jobs processes
+        if not os.path.isdir(data_dir):
+            print(f"WARNING: CRS data directory {data_dir} not found, its files are not in the run catalog")
+            return
+        data_dir = os.path.abspath(data_dir)
+        indexed_dir = self.cursor.execute("SELECT filename FROM sources WHERE system='crs_files'").fetchone()
+        if rebuild or (indexed_dir is not None and indexed_dir[0] != data_dir):
+            self.cursor.execute("DELETE FROM crs_files")
+            self.cursor.execute("DELETE FROM crs_dirs")
+        known_dirs = {directory: mtime for directory, mtime in self.cursor.execute("SELECT directory, mtime FROM crs_dirs")}
+        n_listed = 0
+        to_read = {}
+        pending = [data_dir]
+        while pending:
+            directory = pending.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                continue
+            indexed = {row[0]: row[1:] for row in self.cursor.execute("SELECT path, size, mtime FROM crs_files WHERE directory=?", (directory,))}
+            if known_dirs.get(directory) == dir_mtime:
+                pending.extend(row[0] for row in self.cursor.execute("SELECT directory FROM crs_dirs WHERE parent=?", (directory,)))
+                candidates = [path for path, (size, mtime) in indexed.items() if mtime > time.time() - recheck_recent]
+            else:
+                n_listed += 1
+                subdirs, candidates = [], []
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False): subdirs.append(entry.path)
+                        elif fnmatch.fnmatch(entry.name, pattern): candidates.append(entry.path)
+                removed = set(indexed) - set(candidates)
+                self.cursor.executemany("DELETE FROM crs_files WHERE path=?", [(path,) for path in removed])
+                for subdir in [row[0] for row in self.cursor.execute("SELECT directory FROM crs_dirs WHERE parent=?", (directory,))]:
+                    if subdir not in subdirs: self.forget_crs_dir(subdir)
+                self.cursor.executemany("INSERT OR REPLACE INTO crs_dirs VALUES (?, ?, ?)", [(subdir, directory, known_dirs.get(subdir)) for subdir in subdirs])
+                self.cursor.execute("INSERT OR REPLACE INTO crs_dirs VALUES (?, ?, ?)", (directory, os.path.dirname(directory) if directory != data_dir else None, dir_mtime))
+                pending.extend(subdirs)
+
+            for path in candidates:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if indexed.get(path) != (stat.st_size, stat.st_mtime):
+                    to_read[path] = stat
+
+        rows = []
+        for meta in read_crs_metas(to_read, jobs=jobs, skip_errors=True, config_store=config_store):
+            if meta is None:
+                continue
+            path, created, modified, msg_count, config_hash = meta
+            try:
+                run = int(os.path.basename(path).split('-')[1])
+            except (IndexError, ValueError):
+                print(f"WARNING: No run number in the CRS file name {path}")
+                continue
+            rows.append((path, os.path.dirname(path), run, to_read[path].st_size, to_read[path].st_mtime, created, modified, msg_count, config_hash))
+        self.cursor.executemany("INSERT OR REPLACE INTO crs_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        max_duration = self.cursor.execute("SELECT max(modified - created) FROM crs_files").fetchone()[0] or 0
+        self.cursor.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)", ("crs_files", data_dir, time.time(), None, None, max_duration))
+        self.conn.commit()
+        if n_listed or rows: print(f"Run catalog: listed {n_listed} directories, read {len(rows)} CRS files under {data_dir}")
+
+    def forget_crs_dir(self, directory):
+        for subdir in [row[0] for row in self.cursor.execute("SELECT directory FROM crs_dirs WHERE parent=?", (directory,))]:
+            self.forget_crs_dir(subdir)
+        self.cursor.execute("DELETE FROM crs_files WHERE directory=?", (directory,))
+        self.cursor.execute("DELETE FROM crs_dirs WHERE directory=?", (directory,))
+
+    def get_crs_files(self, run):
+        # (path, created, modified, msg_count, config_hash) of the files of a run, None if the CRS files are not indexed
+        if self.conn.execute("SELECT 1 FROM sources WHERE system='crs_files'").fetchone() is None:
+            return None
+        return self.conn.execute("SELECT path, created, modified, msg_count, config_hash FROM crs_files WHERE run=? ORDER BY path", (run,)).fetchall()
+
+    def find_crs_files(self, start, end=None):
+        # (path, run, created, modified, msg_count) of the files overlapping [start, end], like find_subruns
+        end = start if end is None else end
+        max_duration = (self.conn.execute("SELECT max_duration FROM sources WHERE system='crs_files'").fetchone() or [0])[0]
+        return self.conn.execute("SELECT path, run, created, modified, msg_count FROM crs_files WHERE created BETWEEN ? AND ? AND modified >= ? ORDER BY created",
+                                 (start - max_duration, end, start)).fetchall()
+
+    def get_subrun_rows(self, system, run):
+        # (subrun, start_unix, end_unix) rows of a run, in the same form as the SQLiteDBManager.get_subruns query. None if system is not indexed
+        if self.conn.execute("SELECT 1 FROM sources WHERE system=?", (system,)).fetchone() is None:
+            return None
+        return self.conn.execute("SELECT subrun, start_unix, end_unix FROM subruns WHERE system=? AND run=? ORDER BY subrun, source_key", (system, run)).fetchall()
+
+    def get_source_keys(self, system, run):
+        if self.conn.execute("SELECT 1 FROM sources WHERE system=?", (system,)).fetchone() is None:
+            return None
+        return [row[0] for row in self.conn.execute("SELECT source_key FROM subruns WHERE system=? AND run=? ORDER BY subrun, source_key", (system, run)).fetchall()]
+
+    def find_subruns(self, start, end=None, systems=None):
+        # subruns of every system overlapping [start, end] (unix times, a single time if end is None). A subrun is never longer than the
+        # longest indexed one, so only the start_unix index range [start - max_duration, end] has to be read
+        end = start if end is None else end
+        found = []
+        for system, max_duration in self.conn.execute("SELECT system, max_duration FROM sources WHERE system != 'crs_files'").fetchall():
+            if systems is not None and system not in systems:
+                continue
+            rows = self.conn.execute("SELECT run, subrun, start_unix, end_unix, source_key FROM subruns WHERE system=? AND start_unix BETWEEN ? AND ? AND end_unix >= ? ORDER BY start_unix",
+                                     (system, start - max_duration, end, start)).fetchall()
+            found.extend({"system": system, "run": run, "subrun": subrun, "start_unix": start_unix, "end_unix": end_unix, "source_key": source_key}
+                         for run, subrun, start_unix, end_unix, source_key in rows)
+        return found
+
+    def close_connection(self):
+        if self.conn:
+            self.conn.close()
+
 class IFBeamManager:
     def __init__(self, config):
         self.config = config
         self.start = None
         self.end = None
+        self.session = None #opened by the first request, so importing beam_query does not open a connection
 
     def set_time_range(self, start, end):
         self.start = start
@@ -285,8 +1079,9 @@ class IFBeamManager:
         return base_url
 
     def fetch_data(self, url):
+        if self.session is None: self.session = connections.get_session("ifbeam")
         try:
-            response = requests.get(url)
+            response = self.session.get(url)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
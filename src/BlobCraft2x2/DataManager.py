@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import json
 import csv
+import os
+import io
+import gzip
+import h5py
 from zoneinfo import ZoneInfo
 from dateutil import parser as date_parser
 from datetime import datetime, time
 import yaml
-from .DB import SQLiteDBManager
+from .DB import SQLiteDBManager, get_bucket_ms, get_subsample_columns, influx_epoch_ns
 from collections.abc import Mapping
+from itertools import chain, repeat
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 chicago_tz =  ZoneInfo("America/Chicago")
 default_utc_time = "1969-12-31T18:00:00-06:00"
@@ -24,6 +34,76 @@ def parse_datetime(date_str, is_start):
             return datetime.combine(dt.date(), time.max, tzinfo=chicago_tz)
     return dt.astimezone(chicago_tz)
 
+def format_time(time_str): #because sometimes isoformat in influxdb can be  of this format 2024-05-28T07:54:56Z and pd.to_datetime complains without the microseconds
+    if not isinstance(time_str, str): return time_str
+    if '.' in time_str:
+        split_time = time_str.split('.')
+        microseconds = split_time[1]
+        if len(microseconds) < 7:
+            microseconds += '0' * (7 - len(microseconds))
+            return split_time[0] + '.' + microseconds + 'Z'
+        else:
+            return time_str
+    else:
+        return time_str[:-1] + '.000000Z'
+
+def ns_to_iso(time_ns):
+    return pd.Timestamp(int(time_ns), tz="UTC").tz_convert(chicago_tz).isoformat()
+
+def parse_times(times):
+    # one vectorized parse to UTC, no format_time patching is needed because influx RFC3339 strings (with or without fractional seconds)
+    # are read by numpy's ISO parser once the Z is stripped, anything else goes through pandas' ISO8601 parser
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return pd.to_datetime(times, utc=True)
+    times = pd.Series(times).to_numpy(dtype=object)
+    stripped = [t[:-1] for t in times if isinstance(t, str) and t.endswith("Z")]
+    if len(stripped) == len(times):
+        try:
+            return pd.to_datetime(np.array(stripped, dtype="datetime64[ns]"), utc=True)
+        except ValueError:
+            pass
+    return pd.to_datetime(times, utc=True, format="ISO8601")
+
+def epoch_to_ns(times, time_unit):
+    return np.asarray(times, dtype="int64") * influx_epoch_ns[time_unit]
+
+def to_ns(times):
+    return pd.DatetimeIndex(times).as_unit("ns").asi8
+
+def ns_to_iso_array(time_ns):
+    # vectorized ns_to_iso: Timestamp.isoformat() in Chicago time, without fraction, with .ffffff or with .fffffffff like pandas
+    time_ns = np.asarray(time_ns, dtype="int64")
+    local_ns = pd.DatetimeIndex(time_ns, tz="UTC").tz_convert(chicago_tz).tz_localize(None).asi8
+
+    fraction = np.mod(local_ns, 10**9)
+    iso = np.empty(len(local_ns), dtype=object)
+    for mask, unit in ((fraction == 0, "s"), ((fraction != 0) & (fraction % 1000 == 0), "us"), (fraction % 1000 != 0, "ns")):
+        if mask.any(): iso[mask] = np.datetime_as_string(local_ns[mask].view("datetime64[ns]"), unit=unit, casting="unsafe")
+
+    offsets, inverse = np.unique((local_ns - time_ns) // (60 * 10**9), return_inverse=True)
+    offset_str = np.array([f"{'-' if o < 0 else '+'}{abs(o) // 60:02d}:{abs(o) % 60:02d}" for o in offsets.tolist()], dtype=object)
+    return (iso + offset_str[inverse.reshape(-1)]).tolist()
+
+def asof_indices(times_ns, point_times_ns, tolerance_ns=None):
+    # index of the latest point at or before every time (the last one of equal times), -1 if there is none within tolerance_ns
+    points = pd.DataFrame({"point_time": np.asarray(point_times_ns, dtype="int64"), "idx": np.arange(len(point_times_ns))}).sort_values("point_time", kind="stable")
+    query = pd.DataFrame({"time": np.asarray(times_ns, dtype="int64"), "order": np.arange(len(times_ns))}).sort_values("time", kind="stable")
+    merged = pd.merge_asof(query, points, left_on="time", right_on="point_time", direction="backward", tolerance=tolerance_ns)
+    return merged.sort_values("order")["idx"].fillna(-1).astype("int64").to_numpy()
+
+def influx_series(result):
+    # (tags_dict, columns, values) of every series in an influx ResultSet, without building one dict per point like ResultSet.items()
+    for series in result.raw.get("series", []):
+        yield series.get("tags", None), series["columns"], series.get("values", [])
+
+def make_entries(times, values, variables, tags_dict=None):
+    keys = ["time"] + list(variables)
+    columns = [times] + list(values)
+    if tags_dict:
+        keys.append("tags")
+        columns.append(repeat(tags_dict, len(times)))
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
 def unix_to_iso(unix_time):
     return datetime.fromtimestamp(unix_time, tz=chicago_tz).isoformat()
 
@@ -56,13 +136,280 @@ def clean_subrun_dict(subrun_dict, start, end):
 
     return cleaned_subrun_dict
 
+def plan_subsample(subsample, variables, aggregates=None):
+    # returns (subsample for the database query, variables to format, subsample for DataManager.format).
+    # Intervals dividing one hour are aggregated by the database (see get_bucket_ms), anything else falls back to resampling in pandas
+    if subsample is None:
+        return None, variables, None
+    if get_bucket_ms(subsample) is not None:
+        return subsample, get_subsample_columns(variables, aggregates), None
+    return None, variables, subsample
+
+hdf5_chunk_rows = 65536
+
+def records_to_columns(records):
+    # formatted entries ({"time": iso, var: value, "tags": {...}}) -> DataManager.to_columns series, one per distinct tags. Only for data that
+    # was formatted already, the SC dumps ask DataManager for the columns and never go through the ISO strings
+    groups = {}
+    for record in records:
+        groups.setdefault(json.dumps(record.get("tags") or {}, sort_keys=True), (record.get("tags"), []))[1].append(record)
+    columns = []
+    for tags_dict, rows in groups.values():
+        variables = list(dict.fromkeys(key for row in rows for key in row if key not in ("time", "tags")))
+        series = {"time": to_ns(parse_times([row["time"] for row in rows]))}
+        series.update({var: np.array([row.get(var) for row in rows], dtype=object) for var in variables})
+        columns.append((tags_dict, series))
+    return columns
+
+def concat_columns(columns):
+    # DataManager.to_columns series -> int64 ns times, {var: values} (None where a series does not have the variable) and the json tags of every series
+    variables = list(dict.fromkeys(var for _, series in columns for var in series if var != "time"))
+    times = np.concatenate([np.asarray(series["time"], dtype="int64") for _, series in columns])
+    values = {}
+    for var in variables:
+        arrays = [np.asarray(series[var]) if var in series else np.full(len(series["time"]), None, dtype=object) for _, series in columns]
+        values[var] = np.concatenate(arrays if len({array.dtype for array in arrays}) == 1 else [array.astype(object) for array in arrays])
+    tags = [json.dumps(tags_dict, sort_keys=True) if tags_dict else "" for tags_dict, _ in columns]
+    return times, values, tags
+
+def to_hdf5_array(values):
+    # numeric and boolean columns are stored as float64 (missing values are NaN), anything else as variable length strings
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        return values.astype("float64")
+    try:
+        if not any(isinstance(value, str) for value in values):
+            return np.asarray(values, dtype="float64")
+    except (TypeError, ValueError):
+        pass
+    return np.asarray(["" if value is None else str(value) for value in values], dtype=h5py.string_dtype())
+
+def empty_hdf5_array(length, dtype):
+    if h5py.check_string_dtype(dtype) is not None:
+        return np.full(length, "", dtype=h5py.string_dtype())
+    return np.full(length, np.nan)
+
+def append_hdf5_dataset(group, name, array):
+    if name not in group:
+        group.create_dataset(name, data=array, chunks=(min(max(len(array), 1), hdf5_chunk_rows),), maxshape=(None,), compression="gzip", shuffle=True)
+        return
+    dataset = group[name]
+    old_length = dataset.shape[0]
+    dataset.resize((old_length + len(array),))
+    dataset[old_length:] = array
+
+def write_hdf5_measurement(group, columns):
+    # one group per measurement: int64 ns "time", one dataset per variable and "tag_code" indexing the json "tags" attribute.
+    # Rows are sorted by time on write and "sorted" records whether that still holds after appends, read_hdf5 relies on it for slicing
+    times, values, series_tags = concat_columns(columns)
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+
+    old_length = group["time"].shape[0] if "time" in group else 0
+    tags = json.loads(group.attrs.get("tags", "[]"))
+    tag_codes = {tag: code for code, tag in enumerate(tags)}
+    codes = np.repeat(np.array([tag_codes.setdefault(tag, len(tag_codes)) for tag in series_tags], dtype="int32"),
+                      [len(series["time"]) for _, series in columns])[order]
+    tags = list(tag_codes)
+
+    variables = json.loads(group.attrs.get("variables", "[]"))
+    for var in list(values) + [var for var in variables if var not in values]:
+        if var in values:
+            array = to_hdf5_array(values[var])[order]
+            if var not in group and old_length:
+                append_hdf5_dataset(group, var, empty_hdf5_array(old_length, array.dtype))
+        else:
+            array = empty_hdf5_array(len(times), group[var].dtype)
+        append_hdf5_dataset(group, var, array)
+        if var not in variables: variables.append(var)
+
+    was_sorted = group.attrs.get("sorted", True) and (old_length == 0 or len(times) == 0 or group["time"][old_length - 1] <= times[0])
+    append_hdf5_dataset(group, "time", times)
+    append_hdf5_dataset(group, "tag_code", codes)
+    group["time"].attrs["units"] = "ns since unix epoch, UTC"
+    group.attrs["variables"] = json.dumps(variables)
+    group.attrs["tags"] = json.dumps(tags)
+    group.attrs["sorted"] = bool(was_sorted)
+
+def write_hdf5(data, h5_file):
+    # data is the DataManager.to_columns output of one measurement (or a list of its formatted entries) or a dict of them,
+    # nested dicts become nested groups
+    for name, value in data.items():
+        if isinstance(value, Mapping):
+            write_hdf5(value, h5_file.require_group(name))
+        elif value:
+            write_hdf5_measurement(h5_file.require_group(name), records_to_columns(value) if isinstance(value[0], Mapping) else value)
+
+def hdf5_measurements(filename):
+    measurements = []
+    with h5py.File(filename, "r") as f:
+        f.visititems(lambda name, obj: measurements.append(name) if isinstance(obj, h5py.Group) and "time" in obj else None)
+    return measurements
+
+def bisect_dataset(dataset, value, side="left"):
+    # binary search on a sorted dataset, only log2(n) elements (and their chunks) are read
+    lo, hi = 0, dataset.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if dataset[mid] < value or (side == "right" and dataset[mid] == value): lo = mid + 1
+        else: hi = mid
+    return lo
+
+def to_hdf5_time(t, is_start):
+    if t is None: return None
+    if isinstance(t, str): t = parse_datetime(t, is_start=is_start)
+    t = pd.Timestamp(t)
+    if t.tzinfo is None: t = t.tz_localize(chicago_tz)
+    return t.as_unit("ns").value
+
+def read_hdf5(filename, measurement=None, start=None, end=None):
+    # DataFrame with tz-aware "time", the variables and one "tags.<key>" column per tag key (like pd.json_normalize of the json dump).
+    # Only the rows between start and end are read
+    with h5py.File(filename, "r") as f:
+        if measurement is None:
+            measurements = hdf5_measurements(filename)
+            if len(measurements) != 1:
+                raise ValueError(f"{filename} has {len(measurements)} measurements, choose one of {measurements}")
+            measurement = measurements[0]
+        group = f[measurement]
+        time = group["time"]
+        start_ns, end_ns = to_hdf5_time(start, True), to_hdf5_time(end, False)
+
+        if group.attrs.get("sorted", True):
+            lo = 0 if start_ns is None else bisect_dataset(time, start_ns, side="left")
+            hi = time.shape[0] if end_ns is None else bisect_dataset(time, end_ns, side="right")
+            read = lambda dataset: dataset[lo:hi]
+        else: #appended out of order, the time column has to be scanned
+            times = time[:]
+            mask = np.ones(len(times), dtype=bool)
+            if start_ns is not None: mask &= times >= start_ns
+            if end_ns is not None: mask &= times <= end_ns
+            read = lambda dataset: dataset[:][mask]
+
+        df = pd.DataFrame({"time": pd.to_datetime(read(time), utc=True).tz_convert(chicago_tz)})
+        for var in json.loads(group.attrs["variables"]):
+            values = read(group[var])
+            df[var] = values.astype(str) if h5py.check_string_dtype(group[var].dtype) is not None else values
+
+        tags = [json.loads(tag) if tag else {} for tag in json.loads(group.attrs["tags"])]
+        codes = read(group["tag_code"])
+        for key in dict.fromkeys(key for tag in tags for key in tag):
+            df[f"tags.{key}"] = pd.Categorical(np.array([tag.get(key) for tag in tags], dtype=object)[codes])
+    return df
+
 def load_config(config_file):
     with open(config_file, 'r') as f:
         return yaml.safe_load(f)
 
+def frame_records(df):
+    # DataFrame chunk -> formatted entries, datetime columns become Chicago ISO strings like DataManager.format
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = ns_to_iso_array(to_ns(df[column] if df[column].dt.tz is not None else df[column].dt.tz_localize("UTC")))
+    return df.to_dict("records")
+
+class JSONStreamWriter:
+    # Writes JSON piece by piece so only one record is serialized at a time. Records can come from lists, iterators or DataFrame chunks
+    # (also as values of a dict). Only the items of an iterator are batches (lists or DataFrames of records), a list is always a JSON array. With indent=4 the output is identical to json.dump(data, f, indent=4), indent=None writes compact JSON.
+    # rollover='day' splits a record stream into one valid JSON array per local date of the record "time"
+    extensions = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, filename, indent=4, compression=None, rollover=None):
+        if compression not in self.extensions:
+            raise ValueError(f"Unsupported compression '{compression}'. It can only be gzip or zstd")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package, pip install zstandard or use gzip")
+        if rollover not in (None, "day"):
+            raise ValueError(f"Unsupported rollover '{rollover}'. It can only be day")
+        self.filename = filename
+        self.indent = indent
+        self.compression = compression
+        self.rollover = rollover
+        self.separators = (",", ": ") if indent is not None else (",", ":")
+        self.files = {}
+        self.counts = {}
+        self.filenames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self, suffix):
+        path = f"{self.filename}{suffix}.json{self.extensions[self.compression]}"
+        if self.compression == "gzip":
+            f = gzip.open(path, "wt", encoding="utf-8")
+        elif self.compression == "zstd":
+            f = io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb")), encoding="utf-8")
+        else:
+            f = open(path, "w")
+        self.files[suffix] = f
+        self.counts[suffix] = 0
+        self.filenames.append(path)
+        return f
+
+    def newline(self, level):
+        return "" if self.indent is None else "\n" + " " * (self.indent * level)
+
+    def dumps(self, value, level):
+        text = json.dumps(value, indent=self.indent, separators=self.separators)
+        return text if self.indent is None or level == 0 else text.replace("\n", self.newline(level))
+
+    def iter_records(self, records):
+        # the records of a list, a DataFrame or an iterator of records and batches (lists or DataFrame chunks of records, e.g. a streamed dump)
+        if isinstance(records, pd.DataFrame): records = [records]
+        batches = hasattr(records, "__next__")
+        for record in records:
+            if isinstance(record, pd.DataFrame): yield from frame_records(record)
+            elif batches and isinstance(record, (list, tuple)): yield from record
+            else: yield record
+
+    def encode(self, value, level):
+        if isinstance(value, Mapping):
+            if not value:
+                yield "{}"
+                return
+            yield "{"
+            for i, (key, item) in enumerate(value.items()):
+                yield ("," if i else "") + self.newline(level + 1) + json.dumps(key if isinstance(key, str) else json.dumps(key)) + self.separators[1]
+                yield from self.encode(item, level + 1)
+            yield self.newline(level) + "}"
+        elif isinstance(value, (list, tuple, pd.DataFrame)) or hasattr(value, "__next__"):
+            empty = True
+            for record in self.iter_records(value):
+                yield ("[" if empty else ",") + self.newline(level + 1)
+                yield from (self.encode(record, level + 1) if isinstance(record, Mapping) and not isinstance(record, dict) else [self.dumps(record, level + 1)])
+                empty = False
+            yield "[]" if empty else self.newline(level) + "]"
+        else:
+            yield self.dumps(value, level)
+
+    def write_document(self, data):
+        # a whole document (e.g. the ucondb dict of measurements), iterators and DataFrames inside it are streamed
+        f = self.files.get("") or self.open("")
+        for chunk in self.encode(data, 0):
+            f.write(chunk)
+        self.counts[""] = None
+
+    def write_records(self, records):
+        # records are appended to the top level array, can be called once per chunk
+        for record in self.iter_records(records):
+            suffix = f"_{record['time'][:10]}" if self.rollover else ""
+            f = self.files.get(suffix) or self.open(suffix)
+            f.write(("[" if self.counts[suffix] == 0 else ",") + self.newline(1) + self.dumps(record, 1))
+            self.counts[suffix] += 1
+
+    def close(self):
+        for suffix, f in self.files.items():
+            if self.counts[suffix] is not None:
+                f.write("[]" if self.counts[suffix] == 0 else self.newline(0) + "]")
+            f.close()
+        self.files = {}
+
 def dump(data, filename, format='json', tablename='runsdb', global_run=None,
-         is_global_subrun=False):
-    if not data:
+         is_global_subrun=False, measurement=None, indent=4, compression=None, rollover=None, writer=None):
+    if data is None or (isinstance(data, (list, dict)) and not data) or (isinstance(data, pd.DataFrame) and data.empty):
         return
     if format == 'sqlite-global':
         assert is_global_subrun
@@ -84,17 +431,15 @@ def dump(data, filename, format='json', tablename='runsdb', global_run=None,
             }
             for global_subrun, info in data.items()
         }
-        sqlite_manager = SQLiteDBManager(f'{filename}.db', run=-100)
-        schema = sqlite_manager.extract_schema(global_subrun_data)
-        sqlite_manager.create_table(tablename, schema, is_global_subrun=True)
-        sqlite_manager.insert_data(tablename, global_subrun_data,
-                                   global_run=global_run, is_global_subrun=True)
-        sqlite_manager.conn.commit()
-        sqlite_manager.close_connection()
-        print(f"Dumping table {tablename} to sqlite database file {filename}.db")
+        sqlite_manager = writer or SQLiteDBManager(f'{filename}.db', run=-100)
+        sqlite_manager.dump_data(global_subrun_data, tablename, global_run=global_run, is_global_subrun=True)
+        if writer is None:
+            sqlite_manager.close_connection()
+            print(f"Dumping table {tablename} to sqlite database file {sqlite_manager.filename}")
 
     elif format=='sqlite':
-        sqlite_manager = SQLiteDBManager(f'{filename}.db', run=-100)
+        # writer: an open SQLiteDBManager shared by all the tables of one output file (see scripts/test_runsdb.py), committed when its build ends
+        sqlite_manager = writer or SQLiteDBManager(f'{filename}.db', run=-100)
         if global_run is not None:
             data = {k: {'global_run': global_run, **v}
                     for k, v in data.items()}
@@ -114,21 +459,36 @@ def dump(data, filename, format='json', tablename='runsdb', global_run=None,
                        **({'filename': data[k]['filename']} if 'filename' in data[k] else {}),
                        **data[k]}
         sqlite_manager.dump_data(data, tablename, global_run=global_run, is_global_subrun=is_global_subrun)
-        sqlite_manager.close_connection()
-        print(f"Dumping table {tablename} to sqlite database file {filename}.db")
+        if writer is None:
+            sqlite_manager.close_connection()
+            print(f"Dumping table {tablename} to sqlite database file {sqlite_manager.filename}")
     elif format=='json':
-        with open(f'{filename}.json', "w") as json_file:
-            json.dump(data, json_file, indent=4)
-        print(f"Dumping data to {filename}.json")
+        # streamed, records can be an iterator or DataFrame chunks. A dict is written as one document and cannot roll over
+        if rollover and isinstance(data, Mapping):
+            raise ValueError("rollover is only supported for lists of records")
+        with JSONStreamWriter(filename, indent=indent, compression=compression, rollover=rollover) as writer:
+            if isinstance(data, Mapping): writer.write_document(data)
+            else: writer.write_records(data)
+        if writer.filenames: print(f"Dumping data to {', '.join(writer.filenames)}")
+        else: print(f"WARNING: No data to dump to {filename}.json")
+    elif format=='hdf5':
+        # time series only: DataManager.to_columns output (or a list of formatted entries) is stored as one measurement group, a dict as one group
+        # per key. Existing files are appended to, an iterator of batches (e.g. one per streamed time window) is appended batch by batch
+        with h5py.File(f'{filename}.h5', "a") as h5_file:
+            for batch in (data if hasattr(data, "__next__") else [data]):
+                write_hdf5(batch if isinstance(batch, Mapping) else {measurement or os.path.basename(filename): batch}, h5_file)
+        print(f"Dumping data to {filename}.h5")
     else:
-        raise ValueError(f'{format} is an unsupported file format type. It can only be json, and sqlite specifically for runsdb')
+        raise ValueError(f'{format} is an unsupported file format type. It can only be json, hdf5 for time series, and sqlite specifically for runsdb')
 
 class DataManager:
     def __init__(self, data):
         self.data = data
         self.formatted_data = data
 
-    def format(self, source="", variables=[], subsample_interval=None):
+    def format(self, source="", variables=[], subsample_interval=None, aggregates=None, time_unit=None, drop_missing=False):
+        # time_unit is the epoch precision of influx integer timestamps (InfluxDBManager.epoch), None for RFC3339 strings.
+        # drop_missing: data subsampled by influx, its buckets with a missing aggregate are dropped like the pandas resample drops them
         if not self.data:
             print(f"WARNING: No data found")
             return None
@@ -136,53 +496,137 @@ class DataManager:
         self.formatted_data = []
 
         if source=="influx":
-            for key, data_points in self.data.items():
-                measurement_name, tags_dict = key
-                df = pd.DataFrame(data_points)
-                self.process_dataframe(df, variables, subsample_interval, tags_dict)
+            parts = self.influx_parts(variables, subsample_interval, aggregates=aggregates, time_unit=time_unit, drop_missing=drop_missing)
+            iso_times = ns_to_iso_array(np.concatenate([times for _, times, _ in parts])) if parts else []
+            start = 0
+            for tags_dict, times, series in parts:
+                end = start + len(times)
+                self.formatted_data += make_entries(iso_times[start:end], [values.tolist() for values in series.values()], list(series), tags_dict)
+                start = end
         elif source=="psql":
-            df = pd.DataFrame(self.data, columns=["time"] + variables)
-            df["time"] = pd.to_datetime(df["time"], unit="ms") #because cryostat measurements are in ms
-            self.process_dataframe(df, variables, subsample_interval)
+            self.process_dataframe(self.psql_frame(variables), variables, subsample_interval, aggregates=aggregates)
         else:
             raise ValueError("Unsupported source format. Can only handle datatypes from influxsb and psql databases")
 
         return self.formatted_data
 
-    def process_dataframe(self, df, variables, subsample_interval, tags_dict=None):
-        def format_time(time_str): #because sometimes isoformat in influxdb can be  of this format 2024-05-28T07:54:56Z and pd.to_datetime complains without the microseconds
-            if not isinstance(time_str, str): return time_str
-            if '.' in time_str:
-                split_time = time_str.split('.')
-                microseconds = split_time[1]
-                if len(microseconds) < 7:
-                    microseconds += '0' * (7 - len(microseconds))
-                    return split_time[0] + '.' + microseconds + 'Z'
-                else:
-                    return time_str
-            else:
-                return time_str[:-1] + '.000000Z'
+    def psql_frame(self, variables):
+        df = pd.DataFrame(self.data, columns=["time"] + variables)
+        df["time"] = pd.to_datetime(df["time"], unit="ms") #because cryostat measurements are in ms
+        return df
+
+    def influx_frames(self):
+        # one frame per series, built from the raw columns/values so each series keeps the dtypes it had with pd.DataFrame(points)
+        return [(tags_dict, pd.DataFrame(values, columns=columns)) for tags_dict, columns, values in influx_series(self.data)]
+
+    def influx_frame(self):
+        # all the series in one frame built from their raw points, with the series of every row as categorical codes into the tags dicts.
+        # None if the series have different columns or a column would not have the dtype it has in the frame of each series alone
+        # (a series of only ints or only None in a float column, anything but strings in an object column), influx_frames() is used then
+        series = list(influx_series(self.data))
+        if not series or any(columns != series[0][1] for _, columns, _ in series):
+            return None
+        lengths = [len(values) for _, _, values in series]
+        codes = pd.Categorical.from_codes(np.repeat(np.arange(len(series)), lengths), categories=range(len(series)))
+        df = pd.DataFrame(list(chain.from_iterable(values for _, _, values in series)), columns=series[0][1])
+        starts = np.cumsum([0] + lengths[:-1])
+        filled = [length > 0 for length in lengths]
+        for j, column in enumerate(df.columns):
+            if column == "time":
+                continue
+            if df[column].dtype == "float64":
+                values = df[column].to_numpy()
+                missing = np.isnan(values)
+                whole = ~missing & (values == np.floor(values))
+                for k in np.flatnonzero(np.logical_and.reduceat(missing, starts[filled]) | np.logical_and.reduceat(whole, starts[filled])):
+                    _, _, points = series[np.flatnonzero(filled)[k]]
+                    if missing[starts[filled][k]] or all(type(point[j]) is int for point in points):
+                        return None
+            elif df[column].dtype == "object" and pd.api.types.infer_dtype(df[column], skipna=True) not in ("string", "empty"):
+                return None
+        return [tags_dict for tags_dict, _, _ in series], codes, df
 
-        df["time"] = df["time"].apply(format_time)
-        df["time"] = pd.to_datetime(df["time"], utc=True)
-        df["time"] = df["time"].dt.tz_convert(chicago_tz)
+    def influx_parts(self, variables, subsample_interval=None, aggregates=None, time_unit=None, drop_missing=False):
+        # (tags_dict, int64 ns times, {variable: array}) of every series in result order. The series are processed as one frame
+        # (see influx_frame): its times are converted once and every series is resampled by one groupby on the series codes
+        combined = self.influx_frame()
+        if combined is None:
+            parts = []
+            for tags_dict, df in self.influx_frames():
+                df, frame_variables = self.prepare_dataframe(df, variables, subsample_interval, aggregates=aggregates, time_unit=time_unit)
+                series = {"time": to_ns(df["time"]), **{var: df[var].to_numpy() for var in frame_variables}}
+                if drop_missing and subsample_interval is None:
+                    complete = df[variables].notna().all(axis=1).to_numpy()
+                    series = {name: values[complete] for name, values in series.items()}
+                parts.append((tags_dict, series.pop("time"), series))
+            return parts
 
+        tags, codes, df = combined
+        self.prepare_times(df, time_unit, subsampled=subsample_interval is not None)
+        frame_variables = variables
         if subsample_interval is not None:
-            formatted_entries = self.subsample(df, subsample_interval=subsample_interval)
+            if len(tags) > 1: df, codes = self.subsample(df, subsample_interval=subsample_interval, aggregates=aggregates, by=codes)
+            else: df = self.subsample(df, subsample_interval=subsample_interval, aggregates=aggregates) #a single series needs no groupby
+            frame_variables = get_subsample_columns(variables, aggregates)
+        times = to_ns(df["time"])
+        codes = np.asarray(codes)
+        series = {var: df[var].to_numpy() for var in frame_variables}
+        if drop_missing and subsample_interval is None:
+            complete = df[variables].notna().all(axis=1).to_numpy()
+            times, codes = times[complete], codes[complete]
+            series = {name: values[complete] for name, values in series.items()}
+        bounds = np.searchsorted(codes, np.arange(len(tags) + 1)) if len(tags) > 1 else [0, len(times)] #codes are sorted by series
+        return [(tags_dict, times[a:b], {name: values[a:b] for name, values in series.items()}) for tags_dict, a, b in zip(tags, bounds[:-1], bounds[1:])]
+
+    def to_columns(self, source="", variables=[], subsample_interval=None, aggregates=None, time_unit=None, drop_missing=False):
+        # the data of format() as one (tags_dict, {"time": int64 ns array, var: array}) entry per series, in the same order format() walks them.
+        # The times are never turned into ISO strings (hdf5 output, run-level slicing)
+        if not self.data:
+            return []
+
+        columns = []
+        if source=="influx":
+            for tags_dict, times, series in self.influx_parts(variables, subsample_interval, aggregates=aggregates, time_unit=time_unit, drop_missing=drop_missing):
+                series = {"time": times, **series}
+                if not np.all(np.diff(times) >= 0): #influx returns series sorted by time, this is just a safety net
+                    order = np.argsort(times, kind="stable")
+                    series = {name: values[order] for name, values in series.items()}
+                columns.append((tags_dict, series))
+        elif source=="psql":
+            df, variables = self.prepare_dataframe(self.psql_frame(variables), variables, subsample_interval, aggregates=aggregates)
+            columns.append((None, {"time": to_ns(df["time"]), **{var: df[var].to_numpy() for var in variables}}))
         else:
-            formatted_entries = df.to_dict("records")
+            raise ValueError("Unsupported source format. Can only handle datatypes from influxsb and psql databases")
 
-        for entry in formatted_entries:
-            formatted_entry = {
-                "time": entry["time"].isoformat(),
-                **{var: entry[var] for var in variables}
-            }
-            if tags_dict:
-                formatted_entry["tags"] = tags_dict
+        return columns
 
-            self.formatted_data.append(formatted_entry)
+    def prepare_times(self, df, time_unit=None, subsampled=False):
+        # tz-aware times, in Chicago time for the pandas resample
+        if time_unit is not None: df["time"] = pd.to_datetime(epoch_to_ns(df["time"], time_unit), utc=True)
+        else: df["time"] = parse_times(df["time"])
+        if subsampled: df["time"] = df["time"].dt.tz_convert(chicago_tz)
 
-    def subsample(self, df, subsample_interval):
-        df_resampled = df.resample(subsample_interval, on="time").mean().dropna()
-        formatted_entries = df_resampled.reset_index().to_dict("records")
-        return formatted_entries
+    def prepare_dataframe(self, df, variables, subsample_interval, aggregates=None, time_unit=None):
+        # tz-aware times, resampled in pandas with a subsample interval. Returns the frame and its variables
+        self.prepare_times(df, time_unit, subsampled=subsample_interval is not None)
+        if subsample_interval is not None:
+            df = self.subsample(df, subsample_interval=subsample_interval, aggregates=aggregates)
+            variables = get_subsample_columns(variables, aggregates)
+        return df, variables
+
+    def process_dataframe(self, df, variables, subsample_interval, tags_dict=None, aggregates=None, time_unit=None):
+        df, variables = self.prepare_dataframe(df, variables, subsample_interval, aggregates=aggregates, time_unit=time_unit)
+        self.formatted_data += make_entries(ns_to_iso_array(to_ns(df["time"])), [df[var].tolist() for var in variables], variables, tags_dict)
+
+    def subsample(self, df, subsample_interval, aggregates=None, by=None):
+        # by: the series codes of a frame holding several series, each one is resampled on its own and the codes of the rows are returned too
+        resampler = (df.groupby(by, observed=True) if by is not None else df).resample(subsample_interval, on="time")
+        if not aggregates or list(aggregates) == ["mean"]:
+            df_resampled = resampler.mean().dropna()
+        else:
+            df_resampled = resampler.agg(aggregates)
+            df_resampled.columns = [f"{var}_{agg}" for var, agg in df_resampled.columns]
+            df_resampled = df_resampled.dropna()
+        if by is None:
+            return df_resampled.reset_index()
+        return df_resampled.reset_index(level=1).reset_index(drop=True), df_resampled.index.get_level_values(0).to_numpy(dtype="int64")
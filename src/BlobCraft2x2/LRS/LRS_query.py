@@ -2,16 +2,70 @@ import argparse
 import yaml
 from ..DB import SQLiteDBManager
 from ..DataManager import dump, load_config, unix_to_iso, clean_subrun_dict
-from ..Beam.beam_query import get_beam_summary
-
-def LRS_blob_maker(run, start=None, end=None, dump_all_data=False):
+from ..Beam.beam_query import get_beam_summaries
+from ..Catalog.run_catalog import get_run_catalog
+
+moas_channels_cache = {} #(db filename, config_id, columns): channel rows, shared by every run of a process
+max_sql_variables = 900 #bound parameters per IN (...) query, under SQLite's SQLITE_MAX_VARIABLE_NUMBER (999 before SQLite 3.32)
+
+def chunked(values, size=max_sql_variables):
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def get_subrun_rows(sqlite, run, meta_columns, moas_columns, source_keys=None):
+    # every lrs_runs_data row of the run joined with its moas_versions row in one query. The version is the active_moas filename
+    # without its 5 character prefix and 4 character extension, a missing version has a NULL moas rowid.
+    # source_keys: the rowids of the run from the run catalog, looked up directly instead of scanning for morcs_run_nr. They are queried
+    # max_sql_variables at a time in ascending order, so the rows of a subrun stay in rowid order across queries
+    meta_str = ", ".join(f"l.{col}" for col in meta_columns)
+    moas_str = ", ".join(f"m.{col}" for col in moas_columns)
+    if source_keys is None: conditions = [("l.morcs_run_nr = ?", (run,))]
+    else: conditions = [(f"l.rowid IN ({', '.join(['?'] * len(keys))})", tuple(keys)) for keys in chunked(sorted(source_keys))]
+
+    subrun_rows = {}
+    for condition, params in conditions:
+        query = (f"SELECT l.subrun, l.rowid, m.rowid, {meta_str}{', ' + moas_str if moas_columns else ''} FROM lrs_runs_data l "
+                 f"LEFT JOIN moas_versions m ON m.version = substr(l.active_moas, 6, length(l.active_moas) - 9) "
+                 f"WHERE {condition} ORDER BY l.subrun, l.rowid, m.rowid")
+        sqlite.cursor.execute(query, params)
+        for subrun, lrs_rowid, moas_rowid, *values in sqlite.cursor.fetchall():
+            subrun_rows.setdefault(subrun, []).append((lrs_rowid, moas_rowid, values))
+    return dict(sorted(subrun_rows.items()))
+
+def get_moas_channels(sqlite, config_ids, columns):
+    missing = [config_id for config_id in config_ids if (sqlite.filename, config_id, tuple(columns)) not in moas_channels_cache]
+    if missing:
+        channels = {config_id: [] for config_id in missing}
+        for config_ids_chunk in chunked(missing):
+            placeholders = ", ".join(["?"] * len(config_ids_chunk))
+            sqlite.cursor.execute(f"SELECT config_id, {', '.join(columns)} FROM moas_channels WHERE config_id IN ({placeholders})", config_ids_chunk)
+            for config_id, *values in sqlite.cursor.fetchall():
+                channels[config_id].append(dict(zip(columns, values)))
+        for config_id, rows in channels.items():
+            moas_channels_cache[(sqlite.filename, config_id, tuple(columns))] = rows
+    return {config_id: moas_channels_cache[(sqlite.filename, config_id, tuple(columns))] for config_id in config_ids}
+
+def LRS_blob_maker(run, start=None, end=None, dump_all_data=False, subruns=None):
+    # subruns: the subrun dict of the run if the caller already has it (runsdb_build), otherwise it is queried
     print(f"\n----------------------------------------Fetching LRS data for the run {run}----------------------------------------")
     config = load_config("config/LRS_parameters.yaml")
-    sqlite = SQLiteDBManager(run=run, filename=config.get('filename'))
+    sqlite = SQLiteDBManager(run=run, filename=config.get('filename'), read_only=True)
+    catalog = get_run_catalog()
 
     output = {}
-    subruns = sqlite.get_subruns(table='lrs_runs_data', start='start_time_unix', end='end_time_unix', subrun='subrun', condition='morcs_run_nr')
-    if start and end: subruns = clean_subrun_dict(subruns, start=start, end=end)
+    if subruns is None:
+        subruns = sqlite.get_subruns(table='lrs_runs_data', start='start_time_unix', end='end_time_unix', subrun='subrun', condition='morcs_run_nr', catalog=catalog, system='lrs')
+        if start and end: subruns = clean_subrun_dict(subruns, start=start, end=end)
+
+    beam_summaries = dict(zip(subruns.keys(), get_beam_summaries([(times['start_time'], times['end_time']) for times in subruns.values()])))
+
+    if not dump_all_data:
+        meta_columns = config.get('lrs_runs_data_summary', [])
+        moas_columns = config.get('moas_versions_summary', [])
+    else:
+        meta_columns = sqlite.get_column_names('lrs_runs_data')
+        moas_columns = sqlite.get_column_names('moas_versions')
+    subrun_rows = get_subrun_rows(sqlite, run, meta_columns, moas_columns, source_keys=catalog.get_source_keys('lrs', run) if catalog is not None else None)
 
     start_time = None
     end_time = None
@@ -19,60 +73,41 @@ def LRS_blob_maker(run, start=None, end=None, dump_all_data=False):
         if start_time is None: start_time = times['start_time']
         end_time = times['end_time']
 
-        meta_columns=None
-        moas_columns=None
-
-        if not dump_all_data:
-            meta_columns = config.get('lrs_runs_data_summary', [])
-            moas_columns = config.get('moas_versions_summary', [])
-        else:
-            meta_columns = sqlite.get_column_names('lrs_runs_data')
-            moas_columns = sqlite.get_column_names('moas_versions')
-
-        meta_rows = sqlite.query_data(table_name='lrs_runs_data', conditions=[f"morcs_run_nr=={run}", f"subrun=={subrun}"], columns=meta_columns)
-        data = [dict(zip(meta_columns, row)) for row in meta_rows]
-
-
-        if not data:
+        if subrun not in subrun_rows:
             continue
 
         # unix_time_columns = {'first_event_tai', 'last_event_tai'}
 
-        for row in data:
-            row['start_time'] = times['start_time']
-            row['end_time'] = times['end_time']
-            # row.update({col: unix_to_iso(row[col]) for col in unix_time_columns if col in row})
+        first_rowid = subrun_rows[subrun][0][0]
+        rows = [(moas_rowid, values) for lrs_rowid, moas_rowid, values in subrun_rows[subrun] if lrs_rowid == first_rowid]
+        data = dict(zip(meta_columns, rows[0][1]))
+        data['start_time'] = times['start_time']
+        data['end_time'] = times['end_time']
+        # data.update({col: unix_to_iso(data[col]) for col in unix_time_columns if col in data})
 
-        moas_filename = data[0]["active_moas"] #moas filename is stored here which can then be used to get moas info (especially config id)
+        moas_filename = data.get("active_moas") #moas filename is stored here which can then be used to get moas info (especially config id)
         if not moas_filename:
             raise ValueError(f"ERROR: No MOAS version found")
 
         moas_version = moas_filename[5:-4]
-        moas_data = sqlite.query_data(table_name='moas_versions', conditions=[f"version=='{moas_version}'"], columns=moas_columns)
-        if not moas_data:
+        if rows[0][0] is None:
             raise ValueError(f"ERROR: No data found for MOAS version extracted from filename: {moas_filename}")
-        if len(moas_data) > 1:
+        if len(rows) > 1:
             raise ValueError(f"ERROR: Multiple MOAS versions found for this run/subrun {moas_version}")
-        moas_dict = [dict(zip(moas_columns, row)) for row in moas_data]
 
-        data[0].update(moas_dict[0])
-        data[0]["beam_summary"] = get_beam_summary(times['start_time'], times['end_time'])
-        output[subrun] = data[0]
+        data.update(zip(moas_columns, rows[0][1][len(meta_columns):]))
+        data["beam_summary"] = beam_summaries[subrun]
+        output[subrun] = data
         output[subrun]['run'] = run
 
-        if not dump_all_data: continue
-
-        moas_channels_columns = config.get('moas_channels', [])
-        config_ids = [moas_row['config_id'] for moas_row in moas_dict]
-        if len(config_ids) > 1:
-            raise ValueError(f"ERROR: Multiple config_id values found for MOAS version {moas_version}")
-
-        moas_channels_data = sqlite.query_data(table_name='moas_channels', conditions=[f"config_id=={config_id}"], columns=moas_channels_columns)
-        if not moas_channels_data:
-            raise ValueError(f"ERROR: No MOAS channels data found")
-
-        moas_channels_dict = [dict(zip(moas_channels_columns, row)) for row in moas_channels_data] #Then get the channel information based on the config id for that particular run/subrun
-        output[subrun]["moas_channels"] = moas_channels_dict
+    moas_channels = {}
+    if dump_all_data and output:
+        #every distinct channel table is stored once next to the subruns, keyed by config_id. Subruns refer to it by their config_id
+        config_ids = list(dict.fromkeys(data['config_id'] for data in output.values()))
+        moas_channels = get_moas_channels(sqlite, config_ids, config.get('moas_channels', []))
+        for config_id, channels in moas_channels.items():
+            if not channels:
+                raise ValueError(f"ERROR: No MOAS channels data found for config_id {config_id}")
 
     sqlite.close_connection()
 
@@ -81,7 +116,7 @@ def LRS_blob_maker(run, start=None, end=None, dump_all_data=False):
 
     elif dump_all_data:
         fname = f'LRS_all_ucondb_measurements_run-{run}_{start_time}_{end_time}'
-        dump(output, fname)
+        dump({"subruns": output, "moas_channels": moas_channels}, fname)
 
     return output
 
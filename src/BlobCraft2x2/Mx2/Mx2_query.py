@@ -5,66 +5,91 @@ from pathlib import Path
 
 from ..DB import SQLiteDBManager
 from ..DataManager import dump, load_config, unix_to_iso, clean_subrun_dict
-from ..Beam.beam_query import get_beam_summary
+from ..Beam.beam_query import get_beam_summaries
+from ..Catalog.run_catalog import get_run_catalog
 
-def Mx2_blob_maker(run, start=None, end=None, dump_all_data=False):
-    print(f"\n----------------------------------------Fetching Mx2 data for the run {run}----------------------------------------")
+subrun_multiplier = 10000 #runsubrun = run*10000 + subrun
 
-    config = load_config("config/Mx2_parameters.yaml")
-    sqlite = SQLiteDBManager(run=run, filename=config.get('filename'))
-
-    output = {}
-    subruns = sqlite.get_subruns(table='runsubrun', start='subrunstarttime', end='subrunfinishtime', subrun='runsubrun', condition='runsubrun/10000')
-    if start and end: subruns = clean_subrun_dict(subruns, start=start, end=end)
-
-    start_time = None
-    end_time = None
-    for subrun, times in subruns.items():
-        if start_time is None: start_time = times['start_time']
-        end_time = times['end_time']
-
-        columns = sqlite.get_column_names('runsubrun')
-        columns = [c.lower() for c in columns]
-        conditions = [f'runsubrun/10000={run}', f'runsubrun%10000={subrun}']
-        rows = sqlite.query_data(table_name='runsubrun', columns=columns, conditions=conditions)
-
-        data = [dict(zip(columns, row)) for row in rows]
-
-        if not data:
-            continue
-
-        info = {key: val for key, val in data[0].items() if key != 'runsubrun'}
-        info['start_time_unix'] = info['subrunstarttime']
-        info['end_time_unix'] = info['subrunfinishtime']
-        del info['subrunstarttime']
-        del info['subrunfinishtime']
-        info["beam_summary"] = get_beam_summary(times['start_time'], times['end_time'])
-        info['run'] = run
-        info['filename'] = Path(info['logfilename']) \
-            .name.removesuffix('Controller0Log.txt') + 'RawData.dat'
-        output[subrun] = info
+def get_runsubrun_rows(sqlite, runs, columns):
+    # all runsubrun rows of runs in one query: {run: {subrun: row}}. Range predicates on runsubrun instead of runsubrun/10000 so an index on it is used
+    ranges = " OR ".join(["runsubrun BETWEEN ? AND ?"] * len(runs))
+    params = [bound for run in runs for bound in (run * subrun_multiplier, (run + 1) * subrun_multiplier - 1)]
+    sqlite.cursor.execute(f"SELECT {', '.join(columns)} FROM runsubrun WHERE {ranges}", params)
 
-    sqlite.close_connection()
+    rows = {run: {} for run in runs}
+    for row in sqlite.cursor.fetchall():
+        info = dict(zip(columns, row))
+        rows[info['runsubrun'] // subrun_multiplier].setdefault(info['runsubrun'] % subrun_multiplier, info)
+    return rows
 
-    if not any(output.values()):
-        print(f"No data found for run number {run} in the Mx2 database")
+def Mx2_blob_makers(runs, start=None, end=None, dump_all_data=False, subruns=None):
+    # several runs in one pass over the database: {run: output of Mx2_blob_maker}.
+    # subruns: {run: subrun dict} for the runs the caller already has them for (runsdb_build), the others are queried
+    print(f"\n----------------------------------------Fetching Mx2 data for the runs {', '.join(str(run) for run in runs)}----------------------------------------")
 
-    elif dump_all_data:
-        dump(output, f'Mx2_all_ucondb_measurements_run-{run}_{start_time}_{end_time}')
+    config = load_config("config/Mx2_parameters.yaml")
+    sqlite = SQLiteDBManager(run=runs[0], filename=config.get('filename'), read_only=True)
+    catalog = get_run_catalog()
+
+    columns = [c.lower() for c in sqlite.get_column_names('runsubrun')]
+    run_rows = get_runsubrun_rows(sqlite, runs, columns)
+
+    outputs = {}
+    for run in runs:
+        sqlite.run = run
+        run_subruns = (subruns or {}).get(run)
+        if run_subruns is None:
+            run_subruns = sqlite.get_subruns(table='runsubrun', start='subrunstarttime', end='subrunfinishtime', subrun='runsubrun', condition='runsubrun', run_multiplier=subrun_multiplier, catalog=catalog, system='mx2')
+            if start and end: run_subruns = clean_subrun_dict(run_subruns, start=start, end=end)
+
+        beam_summaries = dict(zip(run_subruns.keys(), get_beam_summaries([(times['start_time'], times['end_time']) for times in run_subruns.values()])))
+
+        output = {}
+        start_time = None
+        end_time = None
+        for subrun, times in run_subruns.items():
+            if start_time is None: start_time = times['start_time']
+            end_time = times['end_time']
+
+            if subrun not in run_rows[run]:
+                continue
+
+            info = {key: val for key, val in run_rows[run][subrun].items() if key != 'runsubrun'}
+            info['start_time_unix'] = info['subrunstarttime']
+            info['end_time_unix'] = info['subrunfinishtime']
+            del info['subrunstarttime']
+            del info['subrunfinishtime']
+            info["beam_summary"] = beam_summaries[subrun]
+            info['run'] = run
+            info['filename'] = Path(info['logfilename']) \
+                .name.removesuffix('Controller0Log.txt') + 'RawData.dat'
+            output[subrun] = info
+
+        if not any(output.values()):
+            print(f"No data found for run number {run} in the Mx2 database")
+
+        elif dump_all_data:
+            dump(output, f'Mx2_all_ucondb_measurements_run-{run}_{start_time}_{end_time}')
+
+        outputs[run] = output
+
+    sqlite.close_connection()
+    return outputs
 
-    return output
+def Mx2_blob_maker(run, start=None, end=None, dump_all_data=False, subruns=None):
+    return Mx2_blob_makers([run], start=start, end=end, dump_all_data=dump_all_data, subruns=None if subruns is None else {run: subruns})[run]
 
 def main():
     parser = argparse.ArgumentParser(description="Query Mx2 SQLite database and dump data to JSON file.")
-    parser.add_argument("--run", type=int, required=True, help="Run number")
+    parser.add_argument("--run", type=str, required=True, help="Run number, or comma-separated run numbers fetched in one pass")
     args = parser.parse_args()
 
-    run = args.run
+    runs = [int(run) for run in args.run.split(',') if run]
 
-    if not run:
+    if not runs:
         raise ValueError("run number is a required argument")
 
-    Mx2_blob_maker(run, dump_all_data=True)
+    Mx2_blob_makers(runs, dump_all_data=True)
 
 
 if __name__ == "__main__":
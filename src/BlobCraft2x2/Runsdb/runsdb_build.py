@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from ..DB import SQLiteDBManager
+from ..DataManager import load_config, dump, clean_subrun_dict, parse_datetime
+from ..Beam.beam_query import cache_POT_series, clear_POT_cache
+from ..LRS.LRS_query import LRS_blob_maker
+from ..Mx2.Mx2_query import Mx2_blob_makers
+from ..SC.SC_query import SC_blob_maker
+from ..Catalog.run_catalog import get_run_catalog
+
+shift_subrun=10000000
+subrun_timediff=5 #seconds
+
+# where the subruns of every system are: parameters file (its sqlite filename) and the get_subruns arguments
+subrun_sources = {
+    'crs': ("config/CRS_parameters.yaml", dict(table='crs_runs_data', start='start_time_unix', end='end_time_unix', subrun='subrun', condition='morcs_run_nr')),
+    'lrs': ("config/LRS_parameters.yaml", dict(table='lrs_runs_data', start='start_time_unix', end='end_time_unix', subrun='subrun', condition='morcs_run_nr')),
+    'mx2': ("config/Mx2_parameters.yaml", dict(table='runsubrun', start='subrunstarttime', end='subrunfinishtime', subrun='runsubrun', condition='runsubrun', run_multiplier=10000)),
+}
+
+# HACK
+# TODO: Key subrun dict on (run, subrun) instead of subrun
+extra_mx2_runs = {50005: [50006]} #Mx2 runs belonging to another global run
+
+def clean_global_subrun_dict(global_subrun_dict, run): #remove really small subruns
+    final_global_subrun_dict = {}
+    new_global_subrun_id = run * shift_subrun
+    time_shift = timedelta(seconds=0)
+    for old_id, times in sorted(global_subrun_dict.items()):
+        start_time = datetime.fromisoformat(times['start_time'])
+        end_time = datetime.fromisoformat(times['end_time'])
+        duration = (end_time - start_time).total_seconds()
+
+        if duration < subrun_timediff:
+            time_shift += timedelta(seconds=duration)
+            continue
+
+        start_time = start_time - time_shift
+        time_shift = timedelta(seconds=0)
+
+        final_global_subrun_dict[new_global_subrun_id] = {
+            **times,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'duration': str(end_time - start_time),
+        }
+        new_global_subrun_id += 1
+    return final_global_subrun_dict
+
+def load_subruns(system, run, morcs_start=None, morcs_end=None):
+    config_file, arguments = subrun_sources[system]
+    sqlite = SQLiteDBManager(run=run, filename=load_config(config_file).get('filename'), read_only=True)
+    data = sqlite.get_subruns(**arguments, catalog=get_run_catalog(), system=system)
+    sqlite.close_connection()
+    if morcs_start is None or morcs_end is None:
+        return data
+    return clean_subrun_dict(data, start=morcs_start, end=morcs_end)
+
+def copy_subruns(subrun_dict):
+    # the subrun dicts are shared between stages and clean_subrun_dict edits them in place, every consumer gets its own copy
+    return {subrun: dict(times) for subrun, times in subrun_dict.items()}
+
+def get_subrun_dict(run, morcs_start, morcs_end, subrun_dicts=None):
+    # subrun_dicts: {system: {run: subrun dict}} already loaded by the caller, the others are loaded here
+    def load_subrun_data(system, run):
+        if subrun_dicts is not None and run in subrun_dicts.get(system, {}):
+            return copy_subruns(subrun_dicts[system][run])
+        return load_subruns(system, run, morcs_start, morcs_end)
+
+    crs_subrun_dict = load_subrun_data('crs', run)
+    lrs_subrun_dict = load_subrun_data('lrs', run)
+    mx2_subrun_dict = load_subrun_data('mx2', run)
+    # HACK
+    extra_mx2_subrun_dicts = [load_subrun_data('mx2', extra_run) for extra_run in extra_mx2_runs.get(run, [])]
+
+    subrun_info = []
+    for subrun, times in crs_subrun_dict.items():
+        subrun_info.extend([(times['start_time'], 'crs', 'start', times['run'], subrun),
+                            (times['end_time'], 'crs', 'end', times['run'], subrun)])
+    for subrun, times in lrs_subrun_dict.items():
+        subrun_info.extend([(times['start_time'], 'lrs', 'start', times['run'], subrun),
+                            (times['end_time'], 'lrs', 'end', times['run'], subrun)])
+    for subrun, times in mx2_subrun_dict.items():
+        subrun_info.extend([(times['start_time'], 'mx2', 'start', times['run'], subrun),
+                            (times['end_time'], 'mx2', 'end', times['run'], subrun)])
+    # HACK
+    for extra_subrun_dict in extra_mx2_subrun_dicts:
+        for subrun, times in extra_subrun_dict.items():
+            subrun_info.extend([(times['start_time'], 'mx2', 'start', times['run'], subrun),
+                                (times['end_time'], 'mx2', 'end', times['run'], subrun)])
+
+    subrun_info.sort()  # Sort subrun_info by time
+
+    global_subrun_dict = {}
+    first_global_subrun = run * shift_subrun
+    global_subrun = first_global_subrun - 1
+    now_running = {'crs': (None, None),
+                   'lrs': (None, None),
+                   'mx2': (None, None)}
+
+    for i, (subrun_time, system, subrun_type, run, subrun) in enumerate(subrun_info):
+        global_subrun = first_global_subrun + i
+        if subrun_type == 'start':
+            now_running[system] = (run, subrun)
+        elif subrun_type == 'end':
+            now_running[system] = (None, None)
+
+        if global_subrun != first_global_subrun:
+            global_subrun_dict[global_subrun - 1]['end_time'] = subrun_time
+
+        global_subrun_dict[global_subrun] = {
+            'global_run': run,
+            'start_time': subrun_time,
+            'end_time': None,
+            'crs_run': now_running['crs'][0],
+            'crs_subrun': now_running['crs'][1],
+            'lrs_run': now_running['lrs'][0],
+            'lrs_subrun': now_running['lrs'][1],
+            'mx2_run': now_running['mx2'][0],
+            'mx2_subrun': now_running['mx2'][1],
+        }
+
+    if global_subrun in global_subrun_dict and global_subrun_dict[global_subrun]['end_time'] is None:
+        last_crs_end_time = max(crs_subrun_dict[subrun]['end_time'] for subrun in crs_subrun_dict)
+        last_lrs_end_time = max(lrs_subrun_dict[subrun]['end_time'] for subrun in lrs_subrun_dict)
+        last_mx2_end_time = max(mx2_subrun_dict[subrun]['end_time'] for subrun in mx2_subrun_dict)
+        global_subrun_dict[global_subrun]['end_time'] = max(last_crs_end_time,
+                                                            last_lrs_end_time,
+                                                            last_mx2_end_time)
+
+    return clean_global_subrun_dict(global_subrun_dict, run)
+
+def read_watermarks(filename, run):
+    # {(system, run): (last subrun, last end time)} stored in an existing runsdb file by an incremental build, {} if there are none
+    if not os.path.exists(filename):
+        return {}
+    conn = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='watermarks'").fetchone() is None:
+            return {}
+        return {(system, system_run): (last_subrun, last_end) for system, system_run, last_subrun, last_end in
+                conn.execute("SELECT system, run, last_subrun, last_end FROM watermarks WHERE global_run=?", (run,))}
+    finally:
+        conn.close()
+
+def get_watermark(subruns):
+    # last subrun and latest end time of a subrun dict
+    if not subruns:
+        return None
+    return max(subruns), max((times['end_time'] for times in subruns.values()), key=lambda end: parse_datetime(end, is_start=False))
+
+def select_tail(subruns, watermark):
+    # the subruns an incremental build summarizes again: the ones after the watermark, the last summarized one (its end moves while the run
+    # is going) and late ones ending after the watermark end
+    if watermark is None:
+        return subruns
+    last_subrun, last_end = watermark
+    last_end = parse_datetime(last_end, is_start=False)
+    return {subrun: times for subrun, times in subruns.items() if subrun >= last_subrun or parse_datetime(times['end_time'], is_start=False) > last_end}
+
+def write_watermarks(writer, run, watermarks):
+    writer.cursor.execute("CREATE TABLE IF NOT EXISTS watermarks (system TEXT, run INTEGER, global_run INTEGER, last_subrun INTEGER, last_end TEXT, updated REAL, PRIMARY KEY (system, run))")
+    writer.cursor.executemany("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?, ?)",
+                              [(system, system_run, run, *watermark, time.time()) for (system, system_run), watermark in watermarks.items() if watermark is not None])
+
+def delete_global_tail(writer, run, first_global_subrun):
+    # global subruns from first_global_subrun to the end of the run, recomputed by an incremental build (there may be fewer of them now)
+    for table in ('All_global_subruns', 'SC_beam_summary'):
+        if writer.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None:
+            writer.cursor.execute(f"DELETE FROM {table} WHERE global_subrun >= ? AND global_subrun < ?", (first_global_subrun, (run + 1) * shift_subrun))
+
+def load_CRS_summary(run, blob_dir='blobs_CRS'):
+    # HACK: the CRS summary is made beforehand by CRS_query
+    pattern = f'CRS_all_ucondb_measurements_run-{run:05d}*.json'
+    path = next(Path(blob_dir).glob(pattern))
+    with open(path) as f:
+        return json.load(f)
+
+class BuildGraph:
+    # stages of a build and the stages they need. A stage runs as soon as the stages it needs are done, independent stages run in parallel
+    # threads. Every stage is called with {name: result} of the stages it needs and its result is passed on to the stages needing it
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}
+        self.total = 0.
+
+    def add(self, name, function, needs=()):
+        self.stages[name] = (function, tuple(needs))
+
+    def run_stage(self, name, results, build_start):
+        function, needs = self.stages[name]
+        start = time.perf_counter()
+        result = function({need: results[need] for need in needs})
+        self.timings[name] = (start - build_start, time.perf_counter() - start, threading.current_thread().name)
+        return result
+
+    def run(self, workers=4, executor=None):
+        # executor: a ThreadPoolExecutor shared by several builds (a batch), so their stages keep running in the same threads and
+        # reuse the per-thread connections of the registry (influx clients) instead of opening new ones in new threads
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as executor:
+                return self.run(executor=executor)
+        for name, (_, needs) in self.stages.items():
+            unknown = [need for need in needs if need not in self.stages]
+            if unknown: raise ValueError(f"Stage {name} needs unknown stages {unknown}")
+
+        results, pending, running = {}, dict(self.stages), {}
+        build_start = time.perf_counter()
+        try:
+            while pending or running:
+                for name in [name for name, (_, needs) in pending.items() if all(need in results for need in needs)]:
+                    running[executor.submit(self.run_stage, name, results, build_start)] = name
+                    del pending[name]
+                if not running:
+                    raise ValueError(f"Stages {list(pending)} need each other")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result() #a failed stage stops the build once the running stages are done
+        finally:
+            wait(running) #a shared executor outlives the build, its stages still running are waited for like the with block did
+        self.total = time.perf_counter() - build_start
+        return results
+
+    def report(self):
+        print("\nStage timings (s since the build started):")
+        for name, (start, seconds, thread) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            needs = ", ".join(self.stages[name][1]) or "-"
+            print(f"  {name:<14} start {start:8.3f}  took {seconds:8.3f}  [{thread}]  needs: {needs}")
+        print(f"  total {self.total:.3f} s, {sum(seconds for _, seconds, _ in self.timings.values()):.3f} s if run one after the other")
+
+def build_runsdb(run, start, end, filename=None, workers=4, crs_blob_dir='blobs_CRS', writer=None, incremental=False, executor=None):
+    # the runsdb SQLite file of scripts/test_runsdb.py: every system's subruns are loaded once and passed to its blob maker and to the global
+    # subrun dict, the POT series of the run is fetched once for the LRS, Mx2 and SC beam summaries.
+    # writer: an open SQLiteDBManager the tables are added to instead (one file for a whole batch)
+    # incremental: only summarize the subruns after the per-system watermarks stored in the file by the previous incremental build and the
+    # global subruns from the earliest of them on, and upsert them. Without watermarks everything is built and the watermarks are stored
+    # executor: the stage threads of a batch (see BuildGraph.run), workers threads of this build otherwise
+    if not filename:
+        filename = f'Runsdb_run_{run}_{start}_{end}'
+    mx2_runs = [run] + extra_mx2_runs.get(run, [])
+
+    def load_mx2_subruns(results):
+        return {mx2_run: load_subruns('mx2', mx2_run, start, end) for mx2_run in mx2_runs}
+
+    def select_tails(results):
+        # {(system, run): subruns to summarize}, all of them for a full build
+        subrun_dicts = {('crs', run): results['crs_subruns'], ('lrs', run): results['lrs_subruns']}
+        subrun_dicts.update({('mx2', mx2_run): subruns for mx2_run, subruns in results['mx2_subruns'].items()})
+        tails = {key: select_tail(subruns, results['watermarks'].get(key)) for key, subruns in subrun_dicts.items()}
+        if results['watermarks']:
+            print(f"Incremental build of run {run}: " + ", ".join(f"{system} {system_run} {len(tails[(system, system_run)])}/{len(subruns)} subruns"
+                                                               for (system, system_run), subruns in subrun_dicts.items()))
+        return tails
+
+    def select_global_tail(results):
+        # the global subruns ending at or after the start of the earliest subrun summarized again, all of them for a full build
+        subrun_dict = results['subrun_dict']
+        if not results['watermarks']:
+            return subrun_dict
+        tail_starts = [parse_datetime(times['start_time'], is_start=True) for tail in results['tails'].values() for times in tail.values()]
+        if not tail_starts:
+            return {}
+        window_start = min(tail_starts)
+        return {global_subrun: times for global_subrun, times in subrun_dict.items() if parse_datetime(times['end_time'], is_start=False) >= window_start}
+
+    def fetch_beam(results):
+        # the span of every subrun summarized, which can stick out of [start, end]
+        subruns = [times for tail in results['tails'].values() for times in tail.values()] + list(results['global_tail'].values())
+        if not subruns:
+            return None
+        bounds = [(parse_datetime(times[key], is_start=(key == 'start_time')), times[key]) for times in subruns for key in ('start_time', 'end_time')]
+        if not incremental:
+            bounds += [(parse_datetime(start, is_start=True), start), (parse_datetime(end, is_start=False), end)]
+        return cache_POT_series(min(bounds)[1], max(bounds)[1])
+
+    def summarize_mx2(results):
+        tail_runs = [mx2_run for mx2_run in mx2_runs if results['tails'][('mx2', mx2_run)]]
+        summaries = {mx2_run: {} for mx2_run in mx2_runs}
+        if tail_runs:
+            summaries.update(Mx2_blob_makers(tail_runs, start=start, end=end, subruns={mx2_run: copy_subruns(results['tails'][('mx2', mx2_run)]) for mx2_run in tail_runs}))
+        return summaries
+
+    def select_CRS_summary(results):
+        tail = results['tails'][('crs', run)]
+        if len(tail) == len(results['crs_subruns']):
+            return results['crs_summary']
+        first_subrun = min(tail, default=None)
+        return {} if first_subrun is None else {subrun: info for subrun, info in results['crs_summary'].items() if int(subrun) >= first_subrun}
+
+    def dump_tables(results, writer):
+        if incremental and results['global_tail']:
+            delete_global_tail(writer, run, min(results['global_tail']))
+        dump(results['global_tail'], filename=filename, format='sqlite-global', tablename='All_global_subruns', is_global_subrun=True, writer=writer)
+        dump(results['crs_tail'], filename=filename, format='sqlite', tablename='CRS_summary', global_run=run, writer=writer)
+        dump(results['lrs_summary'], filename=filename, format='sqlite', tablename='LRS_summary', global_run=run, writer=writer)
+        dump(results['mx2_summary'][run], filename=filename, format='sqlite', tablename='Mx2_summary', global_run=run, writer=writer)
+        dump(results['sc_summary'], filename=filename, format='sqlite', tablename='SC_beam_summary', global_run=run, is_global_subrun=True, writer=writer)
+        # HACK
+        for extra_run in mx2_runs[1:]:
+            dump(results['mx2_summary'][extra_run], filename=filename, format='sqlite', tablename='Mx2_summary', global_run=run, writer=writer)
+        if incremental:
+            write_watermarks(writer, run, {**{key: get_watermark(subruns) for key, subruns in results['tails'].items() if subruns},
+                                           ('global', run): get_watermark(results['subrun_dict'])})
+
+    def write(results):
+        with SQLiteDBManager(f'{filename}.db', run=-100) as file_writer:
+            dump_tables(results, file_writer)
+        return f'{filename}.db'
+
+    graph = BuildGraph()
+    graph.add('catalog', lambda results: get_run_catalog())
+    graph.add('crs_subruns', lambda results: load_subruns('crs', run, start, end), needs=['catalog'])
+    graph.add('lrs_subruns', lambda results: load_subruns('lrs', run, start, end), needs=['catalog'])
+    graph.add('mx2_subruns', load_mx2_subruns, needs=['catalog'])
+    graph.add('crs_summary', lambda results: load_CRS_summary(run, crs_blob_dir))
+    graph.add('watermarks', lambda results: read_watermarks(writer.filename if writer is not None else f'{filename}.db', run) if incremental else {})
+    graph.add('tails', select_tails, needs=['watermarks', 'crs_subruns', 'lrs_subruns', 'mx2_subruns'])
+    graph.add('crs_tail', select_CRS_summary, needs=['crs_summary', 'crs_subruns', 'tails'])
+    graph.add('subrun_dict', lambda results: get_subrun_dict(run, start, end, subrun_dicts={'crs': {run: results['crs_subruns']}, 'lrs': {run: results['lrs_subruns']}, 'mx2': results['mx2_subruns']}),
+              needs=['crs_subruns', 'lrs_subruns', 'mx2_subruns'])
+    graph.add('global_tail', select_global_tail, needs=['watermarks', 'subrun_dict', 'tails'])
+    graph.add('beam', fetch_beam, needs=['tails', 'global_tail'])
+    graph.add('lrs_summary', lambda results: LRS_blob_maker(run=run, start=start, end=end, subruns=copy_subruns(results['tails'][('lrs', run)])) if results['tails'][('lrs', run)] else {},
+              needs=['tails', 'beam'])
+    graph.add('mx2_summary', summarize_mx2, needs=['tails', 'beam'])
+    graph.add('sc_summary', lambda results: SC_blob_maker(measurement_name="runsdb", run_number=run, subrun_dict=results['global_tail']) if results['global_tail'] else {},
+              needs=['global_tail', 'beam'])
+    if writer is None:
+        graph.add('write', write, needs=['tails', 'subrun_dict', 'global_tail', 'crs_tail', 'lrs_summary', 'mx2_summary', 'sc_summary'])
+
+    results = graph.run(workers=workers, executor=executor)
+    graph.report()
+    if writer is not None:
+        # the batch writer's connection belongs to the calling thread
+        dump_tables(results, writer)
+        return writer.filename
+    return results['write']
+
+def parse_runs(runs):
+    # "50014,50016-50018" -> [50014, 50016, 50017, 50018]
+    parsed = []
+    for part in runs.split(','):
+        if '-' in part.strip()[1:]:
+            first, last = part.split('-', 1)
+            parsed.extend(range(int(first), int(last) + 1))
+        elif part.strip():
+            parsed.append(int(part))
+    return parsed
+
+def read_run_csv(filename, run_column='run', start_column='start', end_column='end'):
+    # (run, start, end) of every row of a MORCS-like run list
+    with open(filename, newline='') as f:
+        return [(int(row[run_column]), row[start_column], row[end_column]) for row in csv.DictReader(f)]
+
+def get_run_times(run):
+    # start and end of a run without MORCS times: the first start and last end of its CRS, LRS and Mx2 subruns
+    bounds = []
+    for system in subrun_sources:
+        for times in load_subruns(system, run).values():
+            bounds.extend([(parse_datetime(times['start_time'], is_start=True), times['start_time']),
+                           (parse_datetime(times['end_time'], is_start=False), times['end_time'])])
+    if not bounds:
+        return None, None
+    return min(bounds)[1], max(bounds)[1]
+
+def group_runs(run_times, max_gap):
+    # runs sorted by start, split where the gap to the previous run is longer than max_gap seconds
+    groups = []
+    last_end = None
+    for run, start, end in sorted(run_times, key=lambda item: parse_datetime(item[1], is_start=True)):
+        start_dt, end_dt = parse_datetime(start, is_start=True), parse_datetime(end, is_start=False)
+        if last_end is None or (start_dt - last_end).total_seconds() > max_gap:
+            groups.append([])
+        groups[-1].append((run, start, end))
+        last_end = end_dt if last_end is None else max(last_end, end_dt)
+    return groups
+
+def build_runsdb_batch(run_times, output_dir=None, combined=None, workers=4, crs_blob_dir='blobs_CRS', beam_gap=3600, beam_margin=600, incremental=False):
+    # run_times: [(run, start, end)], start/end None to take them from the subruns. All runs are built in this process, sharing its connections,
+    # run catalog and metadata caches. Runs less than beam_gap seconds apart share one POT series fetch (beam_margin seconds wider for the
+    # subruns sticking out of the run times). combined: one runsdb file for all runs instead of one file per run
+    batch_start = time.perf_counter()
+    resolved = []
+    for run, start, end in run_times:
+        if start is None or end is None:
+            start, end = get_run_times(run)
+        if start is None:
+            print(f"WARNING: No subruns found for run {run}, skipped")
+            continue
+        resolved.append((run, start, end))
+
+    writer = None
+    if combined:
+        writer = SQLiteDBManager(f'{combined}.db', run=-100)
+        writer.begin_build()
+    built, failed = [], {}
+    try:
+        # one set of stage threads for the whole batch, so its runs reuse the per-thread influx clients
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as executor:
+            for group in group_runs(resolved, beam_gap):
+                group_start = min(parse_datetime(start, is_start=True) for _, start, _ in group) - timedelta(seconds=beam_margin)
+                group_end = max(parse_datetime(end, is_start=False) for _, _, end in group) + timedelta(seconds=beam_margin)
+                print(f"\n----------------------------------------Runs {', '.join(str(run) for run, _, _ in group)}: one beam series from {group_start} to {group_end}----------------------------------------")
+                cache_POT_series(group_start.isoformat(), group_end.isoformat())
+                for run, start, end in group:
+                    # an incremental file keeps its name while the run is still going and its end moves
+                    filename = None if combined else os.path.join(output_dir or '', f'Runsdb_run_{run}' if incremental else f'Runsdb_run_{run}_{start}_{end}')
+                    # the tables of a run failing halfway are taken out of the combined file's transaction again
+                    if writer is not None: writer.cursor.execute(f"SAVEPOINT run_{run}")
+                    try:
+                        built.append(build_runsdb(run, start, end, filename=filename, workers=workers, crs_blob_dir=crs_blob_dir, writer=writer, incremental=incremental, executor=executor))
+                    except Exception as e:
+                        if writer is not None:
+                            writer.cursor.execute(f"ROLLBACK TO run_{run}")
+                            writer.table_columns.clear() #the columns the run added are gone again
+                        print(f"WARNING: Run {run} failed: {e!r}")
+                        failed[run] = e
+                    if writer is not None: writer.cursor.execute(f"RELEASE run_{run}")
+                clear_POT_cache()
+    finally:
+        if writer is not None:
+            writer.end_build()
+            writer.close_connection()
+
+    print(f"\nBatch: {len(built)} runs built in {time.perf_counter() - batch_start:.3f} s" + (f", failed: {sorted(failed)}" if failed else ""))
+    return built, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the runsdb SQLite file of a run, running the independent queries in parallel")
+    parser.add_argument('--run', type=int, default=50014)
+    parser.add_argument('--start', default="2024-07-08T11:42:18")
+    parser.add_argument('--end', default="2024-07-08T13:35:51")
+    parser.add_argument('-o', '--output', help="Output file name without the .db extension (default: Runsdb_run_<run>_<start>_<end>)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of stages running at the same time (default: 4)")
+    parser.add_argument('--crs_blob_dir', default='blobs_CRS', help="Directory of the CRS_query json blobs (default: blobs_CRS)")
+    parser.add_argument('--incremental', action='store_true', help="Only add the subruns that are new or changed since the last incremental build of the output file")
+    args = parser.parse_args()
+
+    query_start = datetime.now()
+    build_runsdb(args.run, args.start, args.end, filename=args.output, workers=args.workers, crs_blob_dir=args.crs_blob_dir, incremental=args.incremental)
+    query_end = datetime.now()
+    print("----------------------------------------END OF QUERYING AND BLOB MAKING----------------------------------------")
+    print("Total querying and blob making time in s: ", query_end - query_start)
+
+def batch_main():
+    parser = argparse.ArgumentParser(description="Build the runsdb files of many runs in one process")
+    parser.add_argument('--runs', type=str, help="Comma-separated runs and ranges, e.g. 50014,50016-50020. Their start and end are those of their subruns")
+    parser.add_argument('--csv', type=str, help="MORCS-like csv file with a run, start and end column per run")
+    parser.add_argument('--csv_columns', type=str, default="run,start,end", help="Names of the run, start and end columns of the csv file (default: run,start,end)")
+    parser.add_argument('--combined', type=str, help="Write all runs into this one runsdb file (without the .db extension) instead of one file per run")
+    parser.add_argument('--output_dir', type=str, default=None, help="Directory of the per-run files (default: current directory)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of stages of a run running at the same time (default: 4)")
+    parser.add_argument('--crs_blob_dir', default='blobs_CRS', help="Directory of the CRS_query json blobs (default: blobs_CRS)")
+    parser.add_argument('--beam_gap', type=float, default=3600, help="Runs less than this many seconds apart share one beam series fetch (default: 3600)")
+    parser.add_argument('--beam_margin', type=float, default=600, help="Seconds the shared beam series extends past the first and last run (default: 600)")
+    parser.add_argument('--incremental', action='store_true', help="Only add the subruns that are new or changed since the last incremental build of the output files")
+    args = parser.parse_args()
+
+    run_times = []
+    if args.runs:
+        run_times.extend((run, None, None) for run in parse_runs(args.runs))
+    if args.csv:
+        run_times.extend(read_run_csv(args.csv, *args.csv_columns.split(',')))
+    if not run_times:
+        raise ValueError("Give the runs with --runs or --csv")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    build_runsdb_batch(run_times, output_dir=args.output_dir, combined=args.combined, workers=args.workers, crs_blob_dir=args.crs_blob_dir,
+                       beam_gap=args.beam_gap, beam_margin=args.beam_margin, incremental=args.incremental)
+
+if __name__ == "__main__":
+    main()
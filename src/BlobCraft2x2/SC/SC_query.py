@@ -3,9 +3,9 @@
 import os
 import argparse
 from ..DataManager import parse_datetime
-from ..DB import InfluxDBManager, PsqlDBManager
+from ..DB import InfluxDBManager, PsqlDBManager, InfluxMetadataCache
 from .SC_utils import *
-from ..Beam.beam_query import get_beam_summary
+from ..Beam.beam_query import get_beam_summaries
 
 class SCQueryGlobals:
     def __init__(self):
@@ -22,8 +22,19 @@ class SCQueryGlobals:
         config_influx=None
         config_pqsl=None
         output_dir=None
+        workers=1
+        aggregates=None
+        output_format='json'
+        json_options={}
+        stream_options=None
 
 glob = SCQueryGlobals()
+metadata_caches = {} #(file, ttl): InfluxDB metadata cache, loaded once per process and shared by every run of a batch
+
+def get_metadata_cache(filename, ttl):
+    if (filename, ttl) not in metadata_caches:
+        metadata_caches[(filename, ttl)] = InfluxMetadataCache(filename=filename, ttl=ttl)
+    return metadata_caches[(filename, ttl)]
 
 def get_measurement_info():
     if glob.measurement in glob.config_influx.get('influx_SC_special_dict', {}):
@@ -54,20 +65,20 @@ def process_single_instance():
         dump(data, output_json_filename)
 
     elif glob.measurement == "all":
-        dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=True, individual=True, output_dir=glob.output_dir)
+        dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=True, individual=True, output_dir=glob.output_dir, workers=glob.workers, aggregates=glob.aggregates, output_format=glob.output_format, json_options=glob.json_options, stream_options=glob.stream_options)
 
     else:
         source, info = get_measurement_info()
         if source == 'influx':
             database, measurement, variables = info
-            dump_single_influx(influxDB=glob.influxDB, database=database, measurement=measurement, variables=variables, subsample=glob.subsample, output_dir=glob.output_dir)
+            dump_single_influx(influxDB=glob.influxDB, database=database, measurement=measurement, variables=variables, subsample=glob.subsample, output_dir=glob.output_dir, aggregates=glob.aggregates, output_format=glob.output_format, json_options=glob.json_options, stream_options=glob.stream_options)
         elif source == 'psql_purity_mon':
             tablename, measurements, variables = info
-            dump_single_prm(psqlDB=glob.psqlDB, tablename=tablename, measurements=measurements, variables=variables, subsample=glob.subsample,  output_dir=glob.output_dir)
+            dump_single_prm(psqlDB=glob.psqlDB, tablename=tablename, measurements=measurements, variables=variables, subsample=glob.subsample,  output_dir=glob.output_dir, aggregates=glob.aggregates, output_format=glob.output_format, json_options=glob.json_options, stream_options=glob.stream_options)
         else:
             print(f"Measurement '{measurement}' not found in the configuration.")
 
-def SC_blob_maker(measurement_name, start_time=None, end_time=None, subsample_interval=None, run_number=None, subrun_number=None, subrun_dict=None, output_directory=None):
+def SC_blob_maker(measurement_name, start_time=None, end_time=None, subsample_interval=None, run_number=None, subrun_number=None, subrun_dict=None, output_directory=None, run_level=True, refresh_metadata=False, workers=1, aggregates=None, output_format='json', compact=False, compression=None, rollover=None, stream=False):
 
     if (measurement_name=="runsdb" or measurement_name=="ucondb")  and not subrun_dict and not start_time and not end_time:
         raise ValueError("ERROR: please provide start and end times or a subrun_dict!")
@@ -80,6 +91,10 @@ def SC_blob_maker(measurement_name, start_time=None, end_time=None, subsample_in
     glob.subrun=subrun_number
     glob.subsample=subsample_interval
     glob.output_dir=output_directory
+    glob.workers=workers
+    glob.aggregates=aggregates
+    glob.output_format=output_format
+    glob.json_options={"indent": None if compact else 4, "compression": compression, "rollover": rollover}
 
     if output_directory:
         glob.output_dir=output_directory
@@ -92,15 +107,34 @@ def SC_blob_maker(measurement_name, start_time=None, end_time=None, subsample_in
 
     cred_config = load_config(cred_config_file)
     glob.param_config = load_config(glob.param_config_file)
+    config_influx = glob.param_config["influxdb"]
+    glob.stream_options = {"window": config_influx.get("stream_window"), "batch_size": config_influx.get("stream_batch_size", 10000), "max_memory_mb": config_influx.get("stream_max_memory_mb")} if stream else None
 
-    glob.psqlDB = PsqlDBManager(config=cred_config["psql"])
-    glob.influxDB = InfluxDBManager(config=cred_config["influxdb"])
+    config_psql = glob.param_config["psql"]
+    glob.psqlDB = PsqlDBManager(config=cred_config["psql"], pool_options={"pool_size": config_psql.get("pool_size", 5), "max_overflow": config_psql.get("pool_max_overflow", 10), "pool_recycle": config_psql.get("pool_recycle", 3600)})
+    metadata_cache = get_metadata_cache(glob.param_config["influxdb"].get("metadata_cache_file"), glob.param_config["influxdb"].get("metadata_cache_ttl", 86400))
+    if refresh_metadata: metadata_cache.invalidate()
+    glob.influxDB = InfluxDBManager(config=cred_config["influxdb"], metadata_cache=metadata_cache, epoch=glob.param_config["influxdb"].get("epoch", "ns"))
 
     if subrun_dict:
         if not (glob.measurement == "runsdb" or glob.measurement == "ucondb"): raise ValueError("Unrecognized measurement value. Only give 'ucondb' or 'runsdb' if subrun_dict is used!")
 
         data = {}
         output_json_filename=''
+
+        SC_run_data = None
+        if glob.measurement=="runsdb" and run_level and glob.subsample is None: #fetch every measurement once for the whole run instead of once per subrun
+            try:
+                subrun_times = {subrun: (parse_datetime(times['start_time'], is_start=True), parse_datetime(times['end_time'], is_start=False)) for subrun, times in subrun_dict.items()}
+            except ValueError as e:
+                print(f"Error parsing date: {e}")
+                return
+            print(f"----------------------------------------Fetching Slow Controls data for {len(subrun_times)} subruns, {min(t[0] for t in subrun_times.values())} to {max(t[1] for t in subrun_times.values())}----------------------------------------")
+            SC_run_data = dump_SC_run_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subrun_times=subrun_times)
+
+        if glob.measurement=="runsdb":
+            beam_summaries = dict(zip(subrun_dict.keys(), get_beam_summaries([(times['start_time'], times['end_time']) for times in subrun_dict.values()])))
+
         for subrun, times in subrun_dict.items():
             if not start_time: start_str=times['start_time']
             end_str=times['end_time']
@@ -117,20 +151,21 @@ def SC_blob_maker(measurement_name, start_time=None, end_time=None, subsample_in
             glob.influxDB.set_time_range(glob.start, glob.end)
 
             if glob.measurement=="runsdb":
-                beam_data = {"beam_summary": get_beam_summary(start_t, end_t)}
-                SC_data = dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=False)
+                beam_data = {"beam_summary": beam_summaries[subrun]}
+                if SC_run_data is not None: SC_data = SC_run_data[subrun]
+                else: SC_data = dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=False)
                 data[subrun] = {**SC_data, **beam_data}
                 # dump() currently expects unix timestamps
                 data[subrun]['start_time_unix'] = iso_to_unix(times['start_time'])
                 data[subrun]['end_time_unix'] = iso_to_unix(times['end_time'])
-            if glob.measurement=="ucondb": data[f'subrun_{subrun}'] = dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=True)
+            if glob.measurement=="ucondb": data[f'subrun_{subrun}'] = dump_SC_data(influxDB_manager=glob.influxDB, psqlDB_manager=glob.psqlDB, config_file=glob.param_config_file, subsample=glob.subsample, dump_all_data=True, workers=glob.workers, aggregates=glob.aggregates, output_format=glob.output_format)
 
 
         if glob.measurement=="runsdb":
             glob.influxDB.close_connection()
             glob.psqlDB.close_connection()
             return data
-        if glob.measurement=="ucondb": dump(data, os.path.join(glob.output_dir, f"SlowControls_all_ucondb_measurements_run-{glob.run}_{start_str}_{end_str}"))
+        if glob.measurement=="ucondb": dump(data, os.path.join(glob.output_dir, f"SlowControls_all_ucondb_measurements_run-{glob.run}_{start_str}_{end_str}"), format=glob.output_format, indent=glob.json_options["indent"], compression=compression)
 
     else:
         print(f"----------------------------------------Fetching Slow Controls data for the time period {start_time} to {end_time}----------------------------------------")
@@ -154,11 +189,19 @@ def main():
     parser.add_argument('--measurement', type=str, required=True, help="Measurement name to query. Use 'runsdb' for runs database and 'all' if you want all the measurements in the parameters/config.yaml (influx_SC_data_dict, cryostat_tag_dict, purity_mon_variables)")
     parser.add_argument('--run', type=int, default=None, help="Run number for runsdb (required when measurement is runsdb)")
     parser.add_argument('--subsample', type=str, default=None, help="Subsample interval in s like '60S' (optional)")
+    parser.add_argument('--aggregates', type=str, default=None, help="Comma-separated aggregates per subsample interval: mean, min, max, count (optional, default: mean)")
     parser.add_argument('--output_dir', type=str, default=None, help="Directory to save the output files")
+    parser.add_argument('--refresh_metadata', action='store_true', help="Ignore the cached InfluxDB measurements/field keys/tag keys and fetch them again")
+    parser.add_argument('--format', type=str, default='json', choices=['json', 'hdf5'], help="Output format of the dumped time series (default: json). hdf5 is not used for the runsdb summary")
+    parser.add_argument('--compact', action='store_true', help="Write compact json instead of indenting it by 4 spaces")
+    parser.add_argument('--compress', type=str, default=None, choices=['gzip', 'zstd'], help="Compress the json output (zstd needs the zstandard package)")
+    parser.add_argument('--rollover', type=str, default=None, choices=['day'], help="Split every json time series into one file per day")
+    parser.add_argument('--stream', action='store_true', help="Stream InfluxDB measurements in chunks/time windows straight into the output file instead of loading the whole time range (stream_* in config/SC_parameters.yaml)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of concurrent fetch/format/dump tasks for --measurement=all (default: 1, serial)")
 
     args = parser.parse_args()
 
-    SC_blob_maker(start_time=args.start, end_time=args.end, measurement_name=args.measurement, subsample_interval=args.subsample, run_number=args.run, output_directory=args.output_dir)
+    SC_blob_maker(start_time=args.start, end_time=args.end, measurement_name=args.measurement, subsample_interval=args.subsample, run_number=args.run, output_directory=args.output_dir, refresh_metadata=args.refresh_metadata, workers=args.workers, aggregates=args.aggregates.split(',') if args.aggregates else None, output_format=args.format, compact=args.compact, compression=args.compress, rollover=args.rollover, stream=args.stream)
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from zoneinfo import ZoneInfo
+from datetime import timedelta
 from ..DataManager import *
+from ..DB import InfluxDBManager, connections
 
 chicago_tz = ZoneInfo("America/Chicago")
 
+#summary placeholders when there is no measurement before the end time
+no_O2_meas = {'time': default_utc_time, 'magnitude': '0.0'}
+no_electron_lifetime = (pd.Timestamp(0, tz="UTC"), 0.0)
+
 class SCUtilsGlobals:
     def __init__(self):
         config_influx = {}
@@ -17,43 +25,140 @@ class SCUtilsGlobals:
         psqlDB = None
         individual = False
         output_dir = None
+        workers = 1
+        aggregates = None
+        output_format = 'json'
+        json_options = {}
+        stream_options = None
 
 
 glob = SCUtilsGlobals()
+stream_bytes_per_value = 200
+thread_local = threading.local()
+thread_lock = threading.Lock()
+thread_influxDBs = []
+
+def format_data(data, columnar=False, **format_options):
+    # formatted entries, or with columnar the DataManager.to_columns series the hdf5 output is written from (times stay int64 ns)
+    if columnar: return DataManager(data).to_columns(**format_options)
+    return DataManager(data).format(**format_options)
+
+def fetch_influx_data(influxDB, database, measurement, variables, subsample=None, aggregates=None, columnar=False):
+    fetch_subsample, format_variables, format_subsample = plan_subsample(subsample, variables, aggregates)
+    result = influxDB.fetch_measurement_data(database, measurement, variables, subsample=fetch_subsample, aggregates=aggregates)
+    return format_data(result, columnar, source="influx", variables=format_variables, subsample_interval=format_subsample, aggregates=aggregates, time_unit=influxDB.epoch, drop_missing=fetch_subsample is not None)
+
+def get_stream_batch_size(variables, batch_size=10000, max_memory_mb=None):
+    # rough ceiling: a streamed value costs about stream_bytes_per_value between the chunked response, its DataFrame and the formatted entry
+    if not max_memory_mb: return batch_size
+    return max(1, min(batch_size, int(max_memory_mb * 1e6) // (stream_bytes_per_value * (len(variables) + 2))))
+
+def stream_influx_data(influxDB, database, measurement, variables, subsample=None, aggregates=None, stream_options=None, per_window=False, columnar=False):
+    # yields batches of formatted entries, one per influx chunk (or per time window with per_window, e.g. to keep hdf5 output sorted),
+    # so a dump never holds the whole time range. stream_options: window, batch_size, max_memory_mb
+    fetch_subsample, format_variables, format_subsample = plan_subsample(subsample, variables, aggregates)
+    if format_subsample is not None:
+        print(f"WARNING: Subsample interval {subsample} is resampled in pandas and needs the whole time range, {measurement} is not streamed")
+        yield fetch_influx_data(influxDB, database, measurement, variables, subsample=subsample, aggregates=aggregates, columnar=columnar) or []
+        return
+
+    stream_options = stream_options or {}
+    batch_size = get_stream_batch_size(variables, stream_options.get("batch_size", 10000), stream_options.get("max_memory_mb"))
+    for chunks in influxDB.iter_measurement_data(database, measurement, variables, subsample=fetch_subsample, aggregates=aggregates, window=stream_options.get("window"), batch_size=batch_size):
+        window_data = []
+        for chunk in chunks:
+            if not chunk: continue
+            formatted_data = format_data(chunk, columnar, source="influx", variables=format_variables, time_unit=influxDB.epoch, drop_missing=fetch_subsample is not None)
+            if per_window: window_data += formatted_data
+            else: yield formatted_data
+        if per_window and window_data: yield window_data
+
+def stream_psql_data(batches, variables, aggregates=None, columnar=False):
+    # formats every batch of rows from a PsqlDBManager iter_* reader (server-side cursor) as it arrives
+    for rows in batches:
+        yield format_data(rows, columnar, source="psql", variables=variables, aggregates=aggregates) or []
 
 def get_mean(data, varname):
     df = pd.DataFrame(data)
     return df[varname].mean()
 
-def influx_blind_dump():
+def get_thread_influxDB(): #InfluxDBClient sessions are not shared between threads, every worker gets its own client with the same time range and metadata cache
+    if glob.workers <= 1:
+        return glob.influxDB
+    if getattr(thread_local, "influxDB", None) is None:
+        influxDB = InfluxDBManager(config=glob.influxDB.config, metadata_cache=glob.influxDB.metadata_cache, epoch=glob.influxDB.epoch)
+        with thread_lock:
+            thread_influxDBs.append(influxDB)
+        thread_local.influxDB = influxDB
+    thread_local.influxDB.set_time_range(glob.influxDB.start, glob.influxDB.end)
+    return thread_local.influxDB
+
+def close_thread_influxDBs():
+    with thread_lock:
+        for influxDB in thread_influxDBs:
+            connections.close_influx_client(influxDB.client)
+        thread_influxDBs.clear()
+
+def influx_measurement_dump(database, measurement):
+    influxDB = get_thread_influxDB()
+    variables = influxDB.fetch_measurement_fields(database, measurement)
+    if glob.individual and glob.stream_options is not None:
+        out_filename = os.path.join(glob.output_dir, influxDB.make_filename(database, measurement))
+        batches = stream_influx_data(influxDB, database, measurement, variables, subsample=glob.subsample_interval, aggregates=glob.aggregates, stream_options=glob.stream_options, per_window=glob.output_format == 'hdf5', columnar=glob.output_format == 'hdf5')
+        dump(batches, filename=out_filename, format=glob.output_format, measurement=f'{database}/{measurement}', **glob.json_options)
+        return
+    formatted_data = fetch_influx_data(influxDB, database, measurement, variables, subsample=glob.subsample_interval, aggregates=glob.aggregates, columnar=glob.output_format == 'hdf5')
+    if not glob.individual: return formatted_data
+    out_filename = os.path.join(glob.output_dir, influxDB.make_filename(database, measurement))
+    dump(formatted_data, filename=out_filename, format=glob.output_format, measurement=f'{database}/{measurement}', **glob.json_options)
+
+def run_tasks(tasks, executor=None):
+    # tasks: list of (name, function, args). Results come back in task order. With an executor, a failing task is reported and the rest keep running
+    if executor is None:
+        return [(name, function(*args)) for name, function, args in tasks]
+
+    futures = [(name, executor.submit(function, *args)) for name, function, args in tasks]
+    results = []
+    failed = []
+    for name, future in futures:
+        try:
+            results.append((name, future.result()))
+        except Exception as e:
+            print(f"ERROR: Fetching {name} failed: {e!r}")
+            failed.append(name)
+    if failed:
+        print(f"WARNING: {len(failed)} of {len(tasks)} tasks failed: {failed}")
+    return results
+
+def influx_blind_dump(executor=None):
     databases = glob.config_influx.get("influx_SC_db", [])
-    merged_data = {}
+    tasks = []
     for database in databases:
         measurements = glob.influxDB.fetch_measurements(database)
         for measurement in measurements:
-            variables = glob.influxDB.fetch_measurement_fields(database, measurement)
-            result_data = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables))
-            formatted_data = result_data.format(source="influx", variables=variables, subsample_interval=glob.subsample_interval)
-            if not glob.individual: merged_data[f'{database}_{measurement}'] = formatted_data
-            else:
-                out_filename = os.path.join(glob.output_dir, glob.influxDB.make_filename(database, measurement))
-                dump(formatted_data, filename=out_filename)
+            tasks.append((f'{database}_{measurement}', influx_measurement_dump, (database, measurement)))
 
-    if not glob.individual: return merged_data
+    results = run_tasks(tasks, executor=executor)
+    if not glob.individual: return dict(results)
 
 def psql_blind_dump():
     merged_data = {}
     purity_mon_dict = glob.config_psql.get("purity_mon_variables", {})
     varnames = list(purity_mon_dict.keys())
     variables = list(purity_mon_dict.values())
-    purity_monitor = DataManager(glob.psqlDB.get_purity_monitor_data(tablename=glob.config_psql["purity_mon_table"], variables=variables))
-    formatted_data_prm = purity_monitor.format(source="psql", variables=varnames, subsample_interval=glob.subsample_interval)
+    fetch_subsample, format_varnames, format_subsample = plan_subsample(glob.subsample_interval, varnames, glob.aggregates)
+    if glob.individual and glob.stream_options is not None and format_subsample is None:
+        batches = glob.psqlDB.iter_purity_monitor_data(tablename=glob.config_psql["purity_mon_table"], variables=variables, subsample=fetch_subsample, aggregates=glob.aggregates, batch_size=glob.stream_options.get("batch_size", 10000))
+        dump(stream_psql_data(batches, format_varnames, aggregates=glob.aggregates, columnar=glob.output_format == 'hdf5'), filename=os.path.join(glob.output_dir, glob.psqlDB.make_filename("purity_monitor")), format=glob.output_format, measurement="purity_monitor", **glob.json_options)
+        return
+    purity_monitor = glob.psqlDB.get_purity_monitor_data(tablename=glob.config_psql["purity_mon_table"], variables=variables, subsample=fetch_subsample, aggregates=glob.aggregates)
+    formatted_data_prm = format_data(purity_monitor, glob.output_format == 'hdf5', source="psql", variables=format_varnames, subsample_interval=format_subsample, aggregates=glob.aggregates)
     if not glob.individual:
         merged_data["purity_monitor"] = formatted_data_prm
         return merged_data
     else:
         out_filename = os.path.join(glob.output_dir,  glob.psqlDB.make_filename("purity_monitor"))
-        dump(formatted_data_prm, filename=out_filename)
+        dump(formatted_data_prm, filename=out_filename, format=glob.output_format, measurement="purity_monitor", **glob.json_options)
 
 def get_influx_db_meas_vars(meas_name):
     database, measurement, variables = glob.config_influx.get("influx_SC_special_dict", {}).get(meas_name, [None, None, None])
@@ -64,7 +169,17 @@ def get_influx_db_meas_vars(meas_name):
 def get_tag(measurement_name, field_name, threshold):
     database, measurement, variables = get_influx_db_meas_vars(measurement_name)
 
-    data = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables)).format(source="influx", variables=variables, subsample_interval=glob.subsample_interval)
+    if glob.subsample_interval is None: #only the counts are needed, influx computes them
+        stats = glob.influxDB.fetch_summary_stats(database, measurement, [field_name], threshold=threshold)[field_name]
+        if not stats["count"]:
+            return "no data", 0.0
+        bad_percent = stats["below"] * 100. / stats["count"]
+        if stats["below"]:
+            print(f"WARNING: {bad_percent}% of bad values detected in {measurement_name}")
+            return "bad", bad_percent
+        return "good", bad_percent
+
+    data = fetch_influx_data(glob.influxDB, database, measurement, variables, subsample=glob.subsample_interval)
 
     tag = "bad"
     bad_values = []
@@ -85,15 +200,34 @@ def get_tag(measurement_name, field_name, threshold):
     return tag, bad_percent
     #With psql:
     # data = DataManager(glob.psqlDB.get_cryostat_data(table_prefix=glob.config_psql["cryo_table_prefix"], variable="LAr_level", tagid=glob.config_psql["cryostat_tag_dict"]["LAr_level"])).format(source="psql", variables=["LAr_level"], subsample_interval=glob.subsample_interval)
+def get_asof_lookback():
+    lookback = glob.config_influx.get("asof_lookback")
+    return None if lookback is None else pd.Timedelta(lookback)
+
+def fetch_influx_last_values(meas_name, ends_ns):
+    # latest raw point at or before every end, searched by influx (ORDER BY time DESC LIMIT 1) within asof_lookback
+    database, measurement, variables = get_influx_db_meas_vars(meas_name)
+    lookback = get_asof_lookback()
+    points = glob.influxDB.fetch_last_values(database, measurement, variables, [end_ns // 1000000 for end_ns in ends_ns], lookback_ms=None if lookback is None else lookback.value // 1000000)
+
+    last_values = []
+    for point in points:
+        if point is None:
+            last_values.append(None)
+            continue
+        time_ns = epoch_to_ns([point["time"]], glob.influxDB.epoch)[0] if glob.influxDB.epoch else to_ns(parse_times([point["time"]]))[0]
+        last_values.append({"time": ns_to_iso(time_ns), **{var: point.get(var) for var in variables}})
+    return last_values
+
 def get_last_O2():
-    database, measurement, variables = get_influx_db_meas_vars("O2_ppb")
-    data = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables)).format(source="influx", variables=variables, subsample_interval=glob.subsample_interval)
-    if data: return data[-1]
-    else: return {'time': datetime.now(), 'magnitude': '0.0'}
+    return fetch_influx_last_values("O2_ppb", [to_query_ns(glob.influxDB.end)])[0] or no_O2_meas
 
 def get_spellman_hv():
     database, measurement, variables = get_influx_db_meas_vars("set_voltage")
-    data = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables)).format(source="influx", variables=variables, subsample_interval=glob.subsample_interval)
+    if glob.subsample_interval is None:
+        stats = glob.influxDB.fetch_summary_stats(database, measurement, variables[:1])[variables[0]]
+        return stats["mean"] if stats["count"] else 0.0
+    data = fetch_influx_data(glob.influxDB, database, measurement, variables, subsample=glob.subsample_interval)
     if not data: return 0.0
     mean = get_mean(data, variables[0])
     return mean
@@ -101,14 +235,179 @@ def get_spellman_hv():
 def get_mod_voltages():
     mod_voltages = np.zeros(4)
     database, measurement, variables = get_influx_db_meas_vars("pick_off_voltages")
-    data = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables)).format(source="influx", variables=variables, subsample_interval=glob.subsample_interval)
+    if glob.subsample_interval is None:
+        stats = glob.influxDB.fetch_summary_stats(database, measurement, variables)
+        if not any(stats[var]["count"] for var in variables):
+            return mod_voltages
+        for i, var in enumerate(variables):
+            mod_voltages[i] = stats[var]["mean"] if stats[var]["count"] else np.nan
+        return mod_voltages
+    data = fetch_influx_data(glob.influxDB, database, measurement, variables, subsample=glob.subsample_interval)
     if not data:
         return mod_voltages
     for i, var in enumerate(variables):
         mod_voltages[i] = get_mean(data, var)
     return mod_voltages
 
-def dump_SC_data(influxDB_manager, psqlDB_manager, config_file, subsample=None, json_filename="", dump_all_data=False, individual=False, output_dir=None):
+def make_SC_summary(ground_tag, bad_ground_per, LAr_tag, bad_LAr_per, O2_meas, electron_lifetime, set_voltage, mod_voltages):
+    electric_fields = mod_voltages/(1e3*glob.config_influx["drift_dist"])
+
+    data = {
+        "Gizmo_grounding": {
+            "quality": ground_tag,
+            "bad_values_percent": bad_ground_per
+        },
+        "Liquid_Argon_level": {
+            "quality": LAr_tag,
+            "bad_values_percent": bad_LAr_per
+        },
+        "Purity_monitor": {
+            "last_timestamp": pd.to_datetime(electron_lifetime[0], utc=True).astimezone(chicago_tz).isoformat(),
+            "electron_lifetime_ms": electron_lifetime[1]*1e3
+        },
+        "O2_ppb": {
+            "last_timestamp": O2_meas['time'],
+            "value": O2_meas['magnitude']
+        },
+        "Mean_Spellman_set_voltage_kV": set_voltage,
+        "Mean_module_voltages_kV": {
+            "Module0": mod_voltages[0],
+            "Module1": mod_voltages[1],
+            "Module2": mod_voltages[2],
+            "Module3": mod_voltages[3]
+        },
+        "Electric_fields_V_per_cm": {
+            "Module0": electric_fields[0],
+            "Module1": electric_fields[1],
+            "Module2": electric_fields[2],
+            "Module3": electric_fields[3]
+        }
+    }
+
+    return data
+
+#Run-level versions of the summaries above: every measurement is fetched once for the whole run and each subrun is a binary-searched slice of it
+def to_query_ns(dt): #same millisecond truncation as the time range used in the influx queries
+    return int(dt.timestamp() * 1e3) * 1000000
+
+def to_native(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+def get_influx_columns(meas_name):
+    database, measurement, variables = get_influx_db_meas_vars(meas_name)
+    columns = DataManager(glob.influxDB.fetch_measurement_data(database, measurement, variables)).to_columns(source="influx", variables=variables, time_unit=glob.influxDB.epoch)
+    return variables, columns
+
+def get_slices(columns, starts_ns, ends_ns):
+    return [(np.searchsorted(series["time"], starts_ns, side="left"), np.searchsorted(series["time"], ends_ns, side="right")) for _, series in columns]
+
+def get_run_tags(meas_name, field_name, threshold, starts_ns, ends_ns):
+    variables, columns = get_influx_columns(meas_name)
+    slices = get_slices(columns, starts_ns, ends_ns)
+
+    total = np.zeros(len(starts_ns), dtype=np.int64)
+    bad = np.zeros(len(starts_ns), dtype=np.int64)
+    for (_, series), (lo, hi) in zip(columns, slices):
+        bad_cumsum = np.concatenate([[0], np.cumsum(series[field_name] < threshold)])
+        total += hi - lo
+        bad += bad_cumsum[hi] - bad_cumsum[lo]
+
+    tags = []
+    for n_total, n_bad in zip(total.tolist(), bad.tolist()):
+        if not n_total:
+            tags.append(("no data", 0.0))
+            continue
+        bad_percent = n_bad * 100. / n_total
+        if n_bad:
+            print(f"WARNING: {bad_percent}% of bad values detected in {meas_name}")
+            tags.append(("bad", bad_percent))
+        else:
+            tags.append(("good", bad_percent))
+    return tags
+
+def get_run_means(meas_name, starts_ns, ends_ns):
+    variables, columns = get_influx_columns(meas_name)
+    slices = get_slices(columns, starts_ns, ends_ns)
+
+    means = []
+    for i in range(len(starts_ns)):
+        if not any(hi[i] > lo[i] for lo, hi in slices):
+            means.append(None)
+            continue
+        means.append([pd.Series(np.concatenate([series[var][lo[i]:hi[i]] for (_, series), (lo, hi) in zip(columns, slices)])).mean() for var in variables])
+    return means
+
+def get_run_last_values(meas_name, starts_ns, ends_ns):
+    # as-of lookup: latest point at or before every subrun end from the run-level series, ends with nothing before them in the
+    # fetched range (or further back than asof_lookback) are pushed down to influx in one request
+    variables, columns = get_influx_columns(meas_name)
+    times_ns = np.concatenate([series["time"] for _, series in columns]) if columns else np.array([], dtype=np.int64)
+    lookback = get_asof_lookback()
+    last_idx = asof_indices(ends_ns, times_ns, tolerance_ns=None if lookback is None else lookback.value)
+
+    last_values = [None] * len(ends_ns)
+    if len(times_ns):
+        values = {var: np.concatenate([series[var] for _, series in columns]) for var in variables}
+        for i, idx in enumerate(last_idx.tolist()):
+            if idx >= 0: last_values[i] = {"time": ns_to_iso(times_ns[idx]), **{var: to_native(values[var][idx]) for var in variables}}
+
+    missing = [i for i, last in enumerate(last_values) if last is None]
+    if missing:
+        for i, last in zip(missing, fetch_influx_last_values(meas_name, [ends_ns[i] for i in missing])):
+            last_values[i] = last
+    return last_values
+
+def get_run_electron_lifetimes(starts, ends):
+    # as-of lookup of the last purity monitor measurement before every subrun end: one query over the run plus purity_mon_lookback_days,
+    # ends with nothing in that window get one UNION ALL query of ORDER BY DESC LIMIT 1 selects
+    tablename = glob.config_psql["purity_mon_table"]
+    window_start = min(starts) - timedelta(days=glob.config_psql.get("purity_mon_lookback_days", 7))
+    glob.psqlDB.set_time_range(window_start, max(ends))
+    rows = glob.psqlDB.get_purity_monitor_data(tablename=tablename, variables=["prm_lifetime"])
+
+    times_ns = to_ns(pd.to_datetime([row[0] for row in rows], utc=True)) if rows else np.array([], dtype=np.int64)
+    last_idx = asof_indices([pd.Timestamp(end).value for end in ends], times_ns)
+    electron_lifetimes = [rows[idx] if idx >= 0 else None for idx in last_idx.tolist()]
+
+    missing = [i for i, last in enumerate(electron_lifetimes) if last is None]
+    if missing:
+        for i, last in zip(missing, glob.psqlDB.get_purity_monitor_last_values(tablename, ["prm_lifetime"], [ends[i] for i in missing])):
+            if last is None: print(f"WARNING: No purity monitor measurement found before {ends[i]}")
+            electron_lifetimes[i] = last or no_electron_lifetime
+    return electron_lifetimes
+
+def dump_SC_run_data(influxDB_manager, psqlDB_manager, config_file, subrun_times):
+    config = load_config(config_file)
+    glob.config_influx = config["influxdb"]
+    glob.config_psql = config["psql"]
+    glob.subsample_interval = None
+    glob.influxDB = influxDB_manager
+    glob.psqlDB = psqlDB_manager
+
+    subruns = list(subrun_times.keys())
+    starts = [subrun_times[subrun][0] for subrun in subruns]
+    ends = [subrun_times[subrun][1] for subrun in subruns]
+    starts_ns = np.array([to_query_ns(start) for start in starts], dtype=np.int64)
+    ends_ns = np.array([to_query_ns(end) for end in ends], dtype=np.int64)
+
+    glob.influxDB.set_time_range(min(starts), max(ends))
+    ground_tags = get_run_tags("ground_impedance", "resistance", glob.config_influx["good_ground_impedance"], starts_ns, ends_ns)
+    LAr_tags = get_run_tags("LAr_level_mm", "magnitude", glob.config_influx["good_LAr_level"], starts_ns, ends_ns)
+    O2_meas = get_run_last_values("O2_ppb", starts_ns, ends_ns)
+    set_voltages = get_run_means("set_voltage", starts_ns, ends_ns)
+    mod_voltages = get_run_means("pick_off_voltages", starts_ns, ends_ns)
+    electron_lifetimes = get_run_electron_lifetimes(starts, ends)
+
+    data = {}
+    for i, subrun in enumerate(subruns):
+        data[subrun] = make_SC_summary(*ground_tags[i], *LAr_tags[i],
+                                       O2_meas[i] or no_O2_meas,
+                                       electron_lifetimes[i],
+                                       set_voltages[i][0] if set_voltages[i] else 0.0,
+                                       np.array(mod_voltages[i]) if mod_voltages[i] else np.zeros(4))
+    return data
+
+def dump_SC_data(influxDB_manager, psqlDB_manager, config_file, subsample=None, json_filename="", dump_all_data=False, individual=False, output_dir=None, workers=1, aggregates=None, output_format='json', json_options=None, stream_options=None):
     config = load_config(config_file)
     glob.config_influx = config["influxdb"]
     glob.config_psql = config["psql"]
@@ -118,9 +417,25 @@ def dump_SC_data(influxDB_manager, psqlDB_manager, config_file, subsample=None,
     glob.individual = individual
     if output_dir: glob.output_dir = output_dir
     else: glob.output_dir=os.getcwd()
+    glob.workers = workers
+    glob.aggregates = aggregates
+    glob.output_format = output_format
+    glob.json_options = json_options or {}
+    glob.stream_options = stream_options
     if dump_all_data:
-        influx_data = influx_blind_dump()
-        psql_data = psql_blind_dump()
+        if glob.workers > 1: #the purity monitor dump runs alongside the per-measurement influx tasks
+            with ThreadPoolExecutor(max_workers=glob.workers) as executor:
+                psql_future = executor.submit(psql_blind_dump)
+                influx_data = influx_blind_dump(executor=executor)
+                try:
+                    psql_data = psql_future.result()
+                except Exception as e:
+                    print(f"ERROR: Fetching purity_monitor failed: {e!r}")
+                    psql_data = {}
+            close_thread_influxDBs()
+        else:
+            influx_data = influx_blind_dump()
+            psql_data = psql_blind_dump()
         if not glob.individual:
             merged_data = {**influx_data, **psql_data}
             return merged_data
@@ -128,54 +443,37 @@ def dump_SC_data(influxDB_manager, psqlDB_manager, config_file, subsample=None,
         ground_tag, bad_ground_per = get_tag("ground_impedance", "resistance", glob.config_influx["good_ground_impedance"])
         LAr_tag, bad_LAr_per = get_tag("LAr_level_mm", "magnitude", glob.config_influx["good_LAr_level"])
         O2_meas = get_last_O2()
-        electron_lifetime = glob.psqlDB.get_purity_monitor_data(tablename=glob.config_psql["purity_mon_table"], variables=["prm_lifetime"], last_value=True)
+        electron_lifetime = glob.psqlDB.get_purity_monitor_data(tablename=glob.config_psql["purity_mon_table"], variables=["prm_lifetime"], last_value=True) or no_electron_lifetime
         set_voltage = get_spellman_hv()
         mod_voltages = get_mod_voltages()
-        electric_fields = mod_voltages/(1e3*glob.config_influx["drift_dist"])
-
-        data = {
-            "Gizmo_grounding": {
-                "quality": ground_tag,
-                "bad_values_percent": bad_ground_per
-            },
-            "Liquid_Argon_level": {
-                "quality": LAr_tag,
-                "bad_values_percent": bad_LAr_per
-            },
-            "Purity_monitor": {
-                "last_timestamp": pd.to_datetime(electron_lifetime[0], utc=True).astimezone(chicago_tz).isoformat(),
-                "electron_lifetime_ms": electron_lifetime[1]*1e3
-            },
-            "O2_ppb": {
-                "last_timestamp": O2_meas['time'],
-                "value": O2_meas['magnitude']
-            },
-            "Mean_Spellman_set_voltage_kV": set_voltage,
-            "Mean_module_voltages_kV": {
-                "Module0": mod_voltages[0],
-                "Module1": mod_voltages[1],
-                "Module2": mod_voltages[2],
-                "Module3": mod_voltages[3]
-            },
-            "Electric_fields_V_per_cm": {
-                "Module0": electric_fields[0],
-                "Module1": electric_fields[1],
-                "Module2": electric_fields[2],
-                "Module3": electric_fields[3]
-            }
-        }
 
-        return data
+        return make_SC_summary(ground_tag, bad_ground_per, LAr_tag, bad_LAr_per, O2_meas, electron_lifetime, set_voltage, mod_voltages)
 
-def dump_single_influx(influxDB, database, measurement, variables=[], subsample=None, output_dir=None):
+def dump_single_influx(influxDB, database, measurement, variables=[], subsample=None, output_dir=None, aggregates=None, output_format='json', json_options=None, stream_options=None):
     if not variables: variables = influxDB.fetch_measurement_fields(database, measurement)
     out_filename = os.path.join(output_dir, influxDB.make_filename(database, measurement))
-    dump(DataManager(influxDB.fetch_measurement_data(database=database, measurement=measurement, variables=variables)).format(source="influx", variables=variables, subsample_interval=subsample), filename=out_filename)
+    if stream_options is not None: data = stream_influx_data(influxDB, database, measurement, variables, subsample=subsample, aggregates=aggregates, stream_options=stream_options, per_window=output_format == 'hdf5', columnar=output_format == 'hdf5')
+    else: data = fetch_influx_data(influxDB, database, measurement, variables, subsample=subsample, aggregates=aggregates, columnar=output_format == 'hdf5')
+    dump(data, filename=out_filename, format=output_format, measurement=f'{database}/{measurement}', **(json_options or {}))
 
-def dump_single_cryostat(psqlDB, table_prefix, variable, tagid, subsample=None, output_dir=None):
+def dump_single_cryostat(psqlDB, table_prefix, variable, tagid, subsample=None, output_dir=None, aggregates=None, output_format='json', json_options=None, stream_options=None):
     out_filename = os.path.join(output_dir,  psqlDB.make_filename(variable))
-    dump(DataManager(psqlDB.get_cryostat_data(table_prefix=table_prefix, variable=variable, tagid=tagid)).format(source="psql", variables=[variable], subsample_interval=subsample), filename=out_filename)
+    fetch_subsample, format_variables, format_subsample = plan_subsample(subsample, [variable], aggregates)
+    if stream_options is not None and format_subsample is None:
+        batches = psqlDB.iter_cryostat_data(table_prefix=table_prefix, variable=variable, tagid=tagid, subsample=fetch_subsample, aggregates=aggregates, batch_size=stream_options.get("batch_size", 10000))
+        data = stream_psql_data(batches, format_variables, aggregates=aggregates, columnar=output_format == 'hdf5')
+    else:
+        data = format_data(psqlDB.get_cryostat_data(table_prefix=table_prefix, variable=variable, tagid=tagid, subsample=fetch_subsample, aggregates=aggregates), output_format == 'hdf5',
+                           source="psql", variables=format_variables, subsample_interval=format_subsample, aggregates=aggregates)
+    dump(data, filename=out_filename, format=output_format, measurement=variable, **(json_options or {}))
 
-def dump_single_prm(psqlDB, tablename, measurements, variables, subsample=None, output_dir=None):
+def dump_single_prm(psqlDB, tablename, measurements, variables, subsample=None, output_dir=None, aggregates=None, output_format='json', json_options=None, stream_options=None):
     out_filename = os.path.join(output_dir,  psqlDB.make_filename('_'.join(measurements)))
-    dump(DataManager(psqlDB.get_purity_monitor_data(tablename=tablename, variables=variables)).format(source="psql", variables=measurements, subsample_interval=subsample), filename=out_filename)
+    fetch_subsample, format_measurements, format_subsample = plan_subsample(subsample, measurements, aggregates)
+    if stream_options is not None and format_subsample is None:
+        batches = psqlDB.iter_purity_monitor_data(tablename=tablename, variables=variables, subsample=fetch_subsample, aggregates=aggregates, batch_size=stream_options.get("batch_size", 10000))
+        data = stream_psql_data(batches, format_measurements, aggregates=aggregates, columnar=output_format == 'hdf5')
+    else:
+        data = format_data(psqlDB.get_purity_monitor_data(tablename=tablename, variables=variables, subsample=fetch_subsample, aggregates=aggregates), output_format == 'hdf5',
+                           source="psql", variables=format_measurements, subsample_interval=format_subsample, aggregates=aggregates)
+    dump(data, filename=out_filename, format=output_format, measurement='_'.join(measurements), **(json_options or {}))